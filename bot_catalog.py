@@ -0,0 +1,124 @@
+"""
+Catalog of items and variants that Count Bot keeps count of, and the alias index used to resolve what users type.
+
+This module is pure Python. It imports neither discord.py nor pandas, so that tools and tests can use it cheaply.
+"""
+
+__all__ = {
+    "ITEM_CHOICES",
+    "VARIANT_CHOICES",
+    "ITEMS_WITH_NO_VARIANTS",
+    "Catalog",
+    "get_catalog",
+    "set_catalog",
+}
+
+# Items are things that makers can print or build.
+# Use lower-case for item names.
+ITEM_CHOICES = {
+    'verkstan':  "3D Verkstan head band",
+    'prusa':     "Prusa head band",
+    'visor':     "Transparency sheet",
+    'earsaver':  "Ear saver",
+}
+
+VARIANT_CHOICES = {
+    'prusa':     ["PETG", "PLA"],
+    'verkstan':  ["PETG", "PLA"],
+    'visor':     ["prusa", "verkstan"],
+    'earsaver':  [" "],
+}
+
+ITEMS_WITH_NO_VARIANTS = {
+    'earsaver',
+}
+
+
+class Catalog:
+    """
+    Items and their variants. The alias index, which maps 3-letter and longer prefixes of item and variant names
+    to full names, is only built when it is first needed.
+    """
+
+    def __init__(self, item_choices, variant_choices, items_with_no_variants):
+        self.item_choices = item_choices
+        self.variant_choices = variant_choices
+        self.items_with_no_variants = items_with_no_variants
+        self._alias_maps = None
+        self._all_item_variant_combos = None
+
+    @classmethod
+    def from_config(cls, config):
+        """
+        Build a catalog from the 'CATALOG' section of the configuration file. See my_tokens.get_catalog_config().
+        Items with an empty list of variants have no variants.
+        """
+        if not isinstance(config, dict) or not config:
+            raise ValueError('the catalog must map item names to their description and variants')
+        item_choices = {}
+        variant_choices = {}
+        items_with_no_variants = set()
+        for item, item_config in config.items():
+            item = item.strip().lower()
+            if not isinstance(item_config, dict):
+                raise ValueError("item '{0}' needs a description and a list of variants".format(item))
+            variants = item_config.get('variants', [])
+            if len(item.split()) != 1 or not all(isinstance(v, str) and len(v.split()) == 1 for v in variants):
+                raise ValueError("item '{0}' needs a one-word name and a list of one-word variant names".format(item))
+            item_choices[item] = item_config.get('description', item)
+            if variants:
+                variant_choices[item] = [variant.strip() for variant in variants]
+            else:
+                variant_choices[item] = [" "]
+                items_with_no_variants.add(item)
+        # The transaction log tells an item with no variants by its name in the variant position
+        for item in items_with_no_variants:
+            if any(item in variants for variants in variant_choices.values()):
+                raise ValueError("item '{0}' has no variants, so it cannot also be a variant name".format(item))
+        return cls(item_choices, variant_choices, items_with_no_variants)
+
+    def _setup_aliases(self):
+        alias_maps = {}
+        all_item_variant_combos = []
+        for item, variants in self.variant_choices.items():
+            alias_maps[item.lower()] = item  # In case len is less than 3
+            alias_maps.update([(item[:i].lower(), item) for i in range(3, len(item))])
+            for variant in variants:
+                alias_maps[variant.lower()] = variant  # In case len is less than 3
+                alias_maps.update([(variant[:i].lower(), variant) for i in range(3, len(variant))])
+                all_item_variant_combos.append((item, variant))
+        self._alias_maps = alias_maps
+        self._all_item_variant_combos = all_item_variant_combos
+
+    @property
+    def alias_maps(self):
+        if self._alias_maps is None:
+            self._setup_aliases()
+        return self._alias_maps
+
+    @property
+    def all_item_variant_combos(self):
+        if self._all_item_variant_combos is None:
+            self._setup_aliases()
+        return self._all_item_variant_combos
+
+
+_catalog = None
+
+
+def get_catalog():
+    """The catalog in use."""
+    global _catalog
+    if _catalog is None:
+        _catalog = Catalog(ITEM_CHOICES, VARIANT_CHOICES, ITEMS_WITH_NO_VARIANTS)
+    return _catalog
+
+
+def set_catalog(catalog):
+    """
+    Swap in a new catalog at runtime. Its alias index is built before the swap, so a caller of get_catalog()
+    gets either the complete old catalog or the complete new one.
+    """
+    global _catalog
+    catalog._setup_aliases()
+    _catalog = catalog
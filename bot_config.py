@@ -0,0 +1,158 @@
+"""
+Deployment configuration of Count Bot, read once from the configuration file and from environment variables.
+
+Every setting has a default in BotConfig. The configuration file, one line of JSON that is not checked into git,
+can override it under the upper-case name of the setting:
+   {"TOKEN": "...", "MSG_HISTORY_TROLLING_LIMIT": 8000, "LEASE_BACKEND": "file"}
+An environment variable with the COUNT_BOT_ prefix overrides both, e.g. COUNT_BOT_MSG_HISTORY_TROLLING_LIMIT=8000.
+
+This module is pure Python. It imports neither discord.py nor pandas.
+"""
+import json
+import os
+
+from typing import NamedTuple, Optional
+
+__all__ = {
+    "CONFIG_FILE_NAME",
+    "ENV_VAR_PREFIX",
+    "BotConfig",
+    "read_config_file",
+    "load_config",
+    "get_config",
+}
+
+CONFIG_FILE_NAME = os.getenv('COUNT_BOT_CONFIG_FILE', '_discord_config_no_commit.txt')
+ENV_VAR_PREFIX = 'COUNT_BOT_'
+
+_TRUE_STRINGS = ('1', 'true', 'yes', 'on')
+_FALSE_STRINGS = ('0', 'false', 'no', 'off', '')
+
+
+class BotConfig(NamedTuple):
+    token: Optional[str] = None
+
+    # Defaults of channel and role names. Each guild can override them under 'GUILDS'. See count_bot.GuildConfig.
+    inventory_channel: str = 'bot-inventory'  # The bot only listens to this official text channel, plus personal DM channels
+    admin_role_name: str = 'botadmin'  # Users who can run 'sudo' commands
+    collector_role_name: str = 'collector'  # Users who collect printed items from makers
+    digest_channel: str = ''  # Where scheduled digests are posted. Empty for the inventory channel.
+
+    msg_history_trolling_limit: int = 4000  # How many messages do we read back from transaction log until we hit a sync point?
+    replay_max_sync_points: int = 3  # Replay falls back over this many bad sync points in a row before giving up
+    history_cache_max_messages: int = 20000  # Per guild. How much channel history 'report --at' keeps in memory.
+    change_feed_max_changes: int = 1000  # Per guild. How many recent transactions 'changes' answers from memory.
+    zero_row_retention_days: int = 14  # Zero-count rows older than this are left out of sync points
+    import_max_errors_shown: int = 20  # How many bad rows of an imported CSV file are listed back to the admin
+    outbox_max_pending_replies: int = 50  # Per channel. Older replies are dropped when rate limits hold a channel back.
+    digest_interval_hours: float = 0  # Post a digest of totals and changes this often, e.g. 24 or 1. 0 turns digests off.
+    render_worker_threads: int = 1  # Threads that render reports and CSV files, so that the event loop only does I/O
+
+    storage_backend: str = 'dataframe'  # 'dataframe' (in memory, rebuilt from the log on restart) or 'sqlite'
+    storage_dir: str = '.'  # Where 'sqlite' inventory files are kept. One file per guild, not shared between processes.
+
+    lease_backend: str = 'channel'  # 'channel' (pinned message in inventory channel) or 'file'
+    lease_file_dir: str = '.'  # Where 'file' leases are kept. Processes must share this dir.
+    lease_renew_interval_seconds: float = 10  # How often the writer renews its lease, and standbys check whether they can take over
+    lease_duration_seconds: float = 30  # A writer that does not renew within this period is presumed dead
+
+    # DEBUG-ONLY configuration - Leave all these debug flags FALSE for production run.
+    # 'debug' is the default of the three flags below.
+    debug: bool = False
+    debug_disable_startup_inventory_sync: Optional[bool] = None  # Post the start-up sync point to debug_member_id in DM instead
+    debug_disable_inventory_posts_from_dm: Optional[bool] = None  # Disable any official inventory posting when testing in DM channel
+    debug_pretend_dm_is_inventory: Optional[bool] = None  # Make interactions in DM channel mimic behavior seen in official inventory
+    debug_member_id: Optional[int] = None  # Who gets the start-up sync point when it is not posted in the inventory channel
+
+    # Nested sections. They can only be set in the configuration file.
+    guilds: dict = {}  # Per-guild overrides keyed by guild id. See my_tokens.get_guild_configs().
+    catalog: Optional[dict] = None  # Items and variants. See my_tokens.get_catalog_config().
+
+
+_NESTED_FIELDS = ('guilds', 'catalog')
+_DEBUG_FLAGS = ('debug_disable_startup_inventory_sync', 'debug_disable_inventory_posts_from_dm',
+                'debug_pretend_dm_is_inventory')
+
+
+def _convert(name, value, field_type):
+    """Convert a value read from JSON or an env var to the type of the named BotConfig field."""
+    if field_type == Optional[bool]:
+        field_type = bool
+    elif field_type == Optional[int]:
+        field_type = int
+    elif field_type == Optional[str]:
+        field_type = str
+
+    if value is None:
+        return None
+    try:
+        if field_type is bool:
+            if isinstance(value, bool):
+                return value
+            if str(value).strip().lower() in _TRUE_STRINGS:
+                return True
+            if str(value).strip().lower() in _FALSE_STRINGS:
+                return False
+            raise ValueError(value)
+        if field_type is int and isinstance(value, float):
+            raise ValueError(value)
+        return field_type(value)
+    except (TypeError, ValueError):
+        raise ValueError("configuration setting '{0}' must be of type {1}, not {2!r}".format(
+            name.upper(), field_type.__name__, value)) from None
+
+
+def read_config_file(file_name=None):
+    """The settings in the configuration file, as a dict. Empty if there is no configuration file."""
+    file_name = file_name or CONFIG_FILE_NAME
+    if not os.path.isfile(file_name):
+        return {}
+    with open(file_name, 'r') as f:
+        first = f.readline()
+    return json.loads(first.replace("\\n", ""))
+
+
+def load_config(file_name=None, environ=None) -> BotConfig:
+    """
+    Read the configuration file and the environment into a BotConfig. Raises ValueError on unknown settings in the
+    file and on values of the wrong type, so that a typo does not go unnoticed until the setting is needed.
+    """
+    environ = os.environ if environ is None else environ
+    settings = {}
+    for key, value in read_config_file(file_name).items():
+        name = key.lower()
+        if name not in BotConfig._fields:
+            raise ValueError("unknown configuration setting '{0}' in {1}".format(key, file_name or CONFIG_FILE_NAME))
+        settings[name] = value
+
+    for name in BotConfig._fields:
+        env_name = ENV_VAR_PREFIX + name.upper()
+        if name not in _NESTED_FIELDS and env_name in environ:
+            settings[name] = environ[env_name]
+
+    for name, value in list(settings.items()):
+        if name not in _NESTED_FIELDS:
+            settings[name] = _convert(name, value, BotConfig.__annotations__[name])
+
+    config = BotConfig(**settings)
+    config = config._replace(**dict((flag, config.debug) for flag in _DEBUG_FLAGS if getattr(config, flag) is None))
+    if config.lease_backend not in ('channel', 'file'):
+        raise ValueError("configuration setting 'LEASE_BACKEND' must be 'channel' or 'file', not {0!r}".format(
+            config.lease_backend))
+    if config.storage_backend not in ('dataframe', 'sqlite'):
+        raise ValueError("configuration setting 'STORAGE_BACKEND' must be 'dataframe' or 'sqlite', not {0!r}".format(
+            config.storage_backend))
+    if config.debug_disable_startup_inventory_sync and config.debug_member_id is None:
+        raise ValueError("configuration setting 'DEBUG_MEMBER_ID' is needed to disable the start-up sync point")
+    return config
+
+
+_config = None
+
+
+def get_config() -> BotConfig:
+    """The configuration of this process. The configuration file and the environment are only read once."""
+    global _config
+    if _config is None:
+        _config = load_config()
+    return _config
@@ -0,0 +1,51 @@
+"""
+Recent changes to a guild's inventory, for the 'changes' command.
+
+ChangeFeed keeps the newest transaction log records in a ring buffer of bounded size, oldest first, as they are
+applied. Asking for the changes since some time only walks back over the records newer than that time, however big
+the inventory is. Once the buffer has dropped a record newer than the asked time, the feed can no longer answer.
+The caller then reads the transaction log in Discord instead.
+
+This module is pure Python. It imports neither discord.py nor pandas.
+"""
+from collections import deque
+from datetime import datetime
+from typing import List, NamedTuple, Optional
+
+from trans_log import TransLogRecord
+
+__all__ = {
+    "Change",
+    "ChangeFeed",
+}
+
+
+class Change(NamedTuple):
+    time: datetime  # When the record was posted to the transaction log, naive UTC
+    message_id: int
+    record: TransLogRecord
+
+
+class ChangeFeed:
+    def __init__(self, max_changes=1000, started: Optional[datetime] = None):
+        self.changes = deque(maxlen=max_changes)
+        # Every change posted after this time is in the buffer. It moves forward as old changes are dropped.
+        self.covered_since = started or datetime.utcnow()
+
+    def append(self, time, message_id, records):
+        for record in records:
+            if len(self.changes) == self.changes.maxlen:
+                self.covered_since = max(self.covered_since, self.changes[0].time)
+            self.changes.append(Change(time, message_id, record))
+
+    def get_changes_since(self, since: datetime) -> Optional[List[Change]]:
+        """The changes posted after 'since', oldest first. None if some of them were already dropped."""
+        if since < self.covered_since:
+            return None
+        changes = []
+        for change in reversed(self.changes):
+            if change.time <= since:
+                break
+            changes.append(change)
+        changes.reverse()
+        return changes
@@ -10,140 +10,201 @@ NOTE: Discord.py isn't available as a Conda package it seems. So it is not speci
    python -m pip install -U discord.py
    pip install humanize
 """
+import asyncio
 import discord
 import logging
-import pandas as pd
 import sys
 import os
 import io
 import traceback
 import getpass
+import hashlib
+import re
 
+from concurrent.futures import ThreadPoolExecutor
 from pprint import pprint
-from functools import lru_cache
 from discord.ext import commands
-from my_tokens import get_bot_token
-from datetime import datetime
-from typing import NamedTuple, Optional
-from humanize import naturaltime
+from my_tokens import get_bot_token, get_guild_configs, get_catalog_config
+from bot_config import get_config
+from leader_lease import ChannelLease, FileLease, get_lease_holder_id
+from outbox import Outbox
+from history_cache import HistoryCache
+from sqlite_store import SqliteInventoryStore
+from change_feed import Change, ChangeFeed
+from digest import InventoryDigest, DigestTable, get_next_digest_time
+from memory_stats import get_peak_rss, get_current_rss, get_deep_size, AllocationSnapshots
+from lazy_import import lazy_import, load_now
+from bot_catalog import Catalog, get_catalog, set_catalog, ITEM_CHOICES, VARIANT_CHOICES, ITEMS_WITH_NO_VARIANTS
+from inventory_schema import COL_USER_ID, COL_USER_NAME, COL_ITEM, COL_VARIANT, COL_COUNT, COL_UPDATE_TIME, \
+    COL_HUMAN_INTERVAL, COL_SECOND_USER_ID, COL_SECOND_USER_NAME, COL_MAKER_NAME, COL_COLLECTOR_NAME, \
+    USER_ID_COLUMNS, USER_ID_TO_NAME_MAP, PERSONAL_PRIMARY_KEY, PERSONAL_DF_COLUMNS, TRANSACTION_PRIMARY_KEY, \
+    TRANSACTION_DF_COLUMNS, USER_ROLE_MAKERS, USER_ROLE_COLLECTORS, USER_ROLE_DROPBOXES, USER_ROLES_IN_ORDER
+from trans_log import TransLogRecord, decode_trans_log_records, process_one_trans_record, \
+    SyncPointSummary, is_sync_point_text, format_sync_point_text, decode_sync_point_summary
+from inventory_engine import InventoryEngine, InventoryError, NegativeCountError, InventoryRow, \
+    resolve_item_name, resolve_variant_name, parse_count_list
+from datetime import datetime, timedelta
+from types import SimpleNamespace
+from typing import NamedTuple, Optional, List
 from collections import OrderedDict
 
+# Heavy dependencies are only loaded on first use. A hot standby, or a test that never builds a dataframe,
+# does not pay for them. See lazy_import.py.
+pd = lazy_import('pandas')
+humanize = lazy_import('humanize')
+
 logging.basicConfig(level=logging.INFO)
 
-# CONFIGURATION tailored to a particular Discord server (guild).
-INVENTORY_CHANNEL = os.getenv("COUNT_BOT_INVENTORY_CHANNEL", 'bot-inventory')  # The bot only listens to this official text channel, plus personal DM channels
-ADMIN_ROLE_NAME = 'botadmin'        # Users who can run 'sudo' commands
-COLLECTOR_ROLE_NAME = 'collector'   # Users who collect printed items from makers
+# CONFIGURATION read from the config file and COUNT_BOT_* env vars. See bot_config.py for what each setting does.
+CONFIG = get_config()
+
+# Channel and role names tailored to a particular Discord server (guild).
+# These are defaults. Each guild can override them in the config file. See GuildConfig.
+INVENTORY_CHANNEL = CONFIG.inventory_channel
+ADMIN_ROLE_NAME = CONFIG.admin_role_name
+COLLECTOR_ROLE_NAME = CONFIG.collector_role_name
+DIGEST_CHANNEL = CONFIG.digest_channel
 PRODUCT_CSV_FILE_NAME = 'product_inventory.csv'  # File name of the product inventory attachment in a sync point
-MSG_HISTORY_TROLLING_LIMIT = 4000  # How many messages do we read back from transaction log until we hit a sync point?
-CODE_VERSION = '0.6'  # Increment this whenever the schema of persisted inventory csv or trnx logs change
+MSG_HISTORY_TROLLING_LIMIT = CONFIG.msg_history_trolling_limit
+REPLAY_MAX_SYNC_POINTS = CONFIG.replay_max_sync_points
+SYNC_POINT_ZERO_ROW_RETENTION_DAYS = CONFIG.zero_row_retention_days
+LEASE_BACKEND = CONFIG.lease_backend
+LEASE_FILE_DIR = CONFIG.lease_file_dir
+LEASE_RENEW_INTERVAL_SECONDS = CONFIG.lease_renew_interval_seconds
+HISTORY_CACHE_MAX_MESSAGES = CONFIG.history_cache_max_messages
+STORAGE_BACKEND = CONFIG.storage_backend
+STORAGE_DIR = CONFIG.storage_dir
+RENDER_WORKER_THREADS = CONFIG.render_worker_threads
+DIGEST_INTERVAL_HOURS = CONFIG.digest_interval_hours
+CHANGE_FEED_MAX_CHANGES = CONFIG.change_feed_max_changes
+CODE_VERSION = '0.8'  # Increment this whenever the schema of persisted inventory csv or trnx logs change
+DROP_CONFIRM_EMOJI = '💯'  # Collectors react to a drop record with this to confirm it
 
 # DEBUG-ONLY configuration - Leave all these debug flags FALSE for production run.
-# TODO - Probably should turn into real config parameter stored in _discord_config_no_commit.txt
-DEBUG_ = False
-DEBUG_DISABLE_STARTUP_INVENTORY_SYNC = DEBUG_  # Disable the inventory sync point recorded at bot start-up
-DEBUG_DISABLE_INVENTORY_POSTS_FROM_DM = DEBUG_  # Disable any official inventory posting when testing in DM channel
-DEBUG_PRETEND_DM_IS_INVENTORY = DEBUG_  # Make interactions in DM channel mimic behavior seen in official inventory
+DEBUG_ = CONFIG.debug
+DEBUG_DISABLE_STARTUP_INVENTORY_SYNC = CONFIG.debug_disable_startup_inventory_sync
+DEBUG_DISABLE_INVENTORY_POSTS_FROM_DM = CONFIG.debug_disable_inventory_posts_from_dm
+DEBUG_PRETEND_DM_IS_INVENTORY = CONFIG.debug_pretend_dm_is_inventory
+DEBUG_MEMBER_ID = CONFIG.debug_member_id
 
 # FIXME - Julie doesn't need forecast counts. She needs actual 'collected' ledger transactions.
 # FIXME - add command to produce sync point csv on demand, but only send to DM channel for manual backup
-# FIXME - add convenient spying tools: count @Freddie, report @Freddie, and collect @Freddie
 # FIXME - add 'collect from <maker>' - same as count @Freddie
 # FIXME - add 'collect from <maker> ALL [pru] [pet] - to get all items without specifying the count nor item
 # FIXME - add 'delivered' command and a hospital bucket
 # FIXME - track historical contributions per person in a separate historical table. Mark an entry for collections and deliveries
-# FIXME - prevent two bots from running against the same channel
 # FIXME - when reading back trnx log entries - print its msg.created_at value on the left before {:60}
 # FIXME - consider making the bot respond if people type in wrong commands that do not exist. Let them know the bot is still alive.
-# FIXME - move INVENTORY_CHANNEL and related config params to my_token. They can all come from env vars, or from the locally-cached config file
-# FIXME - maybe addd assembly as an item type
 # FIXME - look into google sheet API to update it automatically. https://developers.google.com/sheets/api/guides/concepts
-# FIXME - 'remove all' generates: PerformanceWarning: dropping on a non-lexsorted multi-index without a level parameter may impact performance.
-
-USER_ROLE_HUMAN_TO_DISCORD_LABEL_MAP = {
-    'admins': ADMIN_ROLE_NAME,
-    'collectors': COLLECTOR_ROLE_NAME,
-}
-
-# Items are things that makers can print or build.
-# Use lower-case for item names.
-ITEM_CHOICES = {
-    'verkstan':  "3D Verkstan head band",
-    'prusa':     "Prusa head band",
-    'visor':     "Transparency sheet",
-    'earsaver':  "Ear saver",
-}
-
-VARIANT_CHOICES = {
-    'prusa':     ["PETG", "PLA"],
-    'verkstan':  ["PETG", "PLA"],
-    'visor':     ["prusa", "verkstan"],
-    'earsaver':  [" "],
-}
-
-ITEMS_WITH_NO_VARIANTS = {
-    'earsaver',
-}
-
-COL_USER_ID = 'user_id'
-COL_USER_NAME = 'user'
-COL_ITEM = 'item'
-COL_VARIANT = 'variant'
-COL_COUNT = 'count'
-
-# DiscordPy returns 'naive' datetime in UTC, not 'aware' datetime.
-# For conformity I just use naive UTC datetime as well. These are stored into CSV files also in naive UTC datetime.
-COL_UPDATE_TIME = 'update_time'
-COL_HUMAN_INTERVAL = 'updated'
-
-COL_SECOND_USER_ID = 'second_user_id'
-COL_SECOND_USER_NAME = 'second_user'
-
-COL_MAKER_NAME = 'maker'
-COL_COLLECTOR_NAME = 'collector'
 
-USER_ID_COLUMNS = (COL_USER_ID, COL_SECOND_USER_ID)
-USER_ID_TO_NAME_MAP = {
-    COL_USER_ID: COL_USER_NAME,
-    COL_SECOND_USER_ID: COL_SECOND_USER_NAME,
+USER_ROLE_HUMAN_TO_GUILD_CONFIG_FIELD_MAP = {
+    'admins': 'admin_role_name',
+    'collectors': 'collector_role_name',
 }
 
 TIME_DIFF = datetime.utcnow() - datetime.now()
 
-# Personal inventories are where a user alone is part of the primary key.
-# This includes maker inventories and collector inventories.
-PERSONAL_PRIMARY_KEY = [COL_USER_ID, COL_ITEM, COL_VARIANT]
-PERSONAL_DF_COLUMNS = PERSONAL_PRIMARY_KEY + [COL_COUNT, COL_UPDATE_TIME]
+USER_NAME_LEFT_JUST_WIDTH = 30
 
-# A transaction inventory is where we record a transaction between two users.
-# So both users need to be part of the primary key.
-TRANSACTION_PRIMARY_KEY = PERSONAL_PRIMARY_KEY + [COL_SECOND_USER_ID]
-TRANSACTION_DF_COLUMNS = TRANSACTION_PRIMARY_KEY + [COL_COUNT, COL_UPDATE_TIME]
+class GuildConfig(NamedTuple):
+    """Channel and role names tailored to one Discord server (guild)."""
+    inventory_channel: str = INVENTORY_CHANNEL
+    admin_role_name: str = ADMIN_ROLE_NAME
+    collector_role_name: str = COLLECTOR_ROLE_NAME
+    digest_channel: str = DIGEST_CHANNEL  # Empty to post digests in the inventory channel
 
-USER_NAME_LEFT_JUST_WIDTH = 30
+# Per-guild overrides of GuildConfig fields, keyed by guild id. Guilds not listed here use the defaults.
+GUILD_CONFIG_OVERRIDES = get_guild_configs()
 
-USER_ROLE_MAKERS = 'makers'  # Stores what makers have made, but not yet passed onto collectors
-USER_ROLE_COLLECTORS = 'collectors'  # Stores what collectors have collected from makers
-USER_ROLE_DROPBOXES = 'dropboxes'  # Dropboxes serving as intermediate buffer between makers and collectors
-
-# maps 'makers' (USER_ROLE_MAKERS), 'collectors', etc to dataframes that store per-role inventory
-INVENTORY_BY_USER_ROLE = OrderedDict()
-
-# DO NOT CHANGE THE ORDER OF ITEMS IN THIS LIST WITHOUT CAREFUL CONSIDERATION.
-# The order of items in this list is important. It is used to persist CSV tables into CSV sync point
-USER_ROLES_IN_ORDER = [USER_ROLE_MAKERS, USER_ROLE_COLLECTORS, USER_ROLE_DROPBOXES]
-
-ALIAS_MAPS = {}
-ALL_ITEM_VARIANT_COMBOS = []
-def _setup_aliases():
-    for item, variants in VARIANT_CHOICES.items():
-        ALIAS_MAPS[item.lower()] = item  # In case len is less than 3
-        ALIAS_MAPS.update([(item[:i].lower(), item) for i in range(3, len(item))])
-        for variant in variants:
-            ALIAS_MAPS[variant.lower()] = variant  # In case len is less than 3
-            ALIAS_MAPS.update([(variant[:i].lower(), variant) for i in range(3, len(variant))])
-            ALL_ITEM_VARIANT_COMBOS.append((item, variant))
-_setup_aliases()
+def _get_guild_config(guild_id):
+    return GuildConfig(**GUILD_CONFIG_OVERRIDES.get(guild_id, {}))
+
+class GuildInventory:
+    """
+    Inventory state of one Discord server (guild). One bot process can serve several maker groups, each in its own
+    guild, with its own inventory channel, role names and inventory tables.
+    """
+    def __init__(self, guild, config):
+        self.guild = guild
+        self.config = config
+        # Where per-role inventory tables are kept. See STORAGE_BACKEND.
+        self.store = _make_inventory_store(guild.id)
+        # Running totals and changes since the last digest, kept up to date by every write. See digest.py.
+        self.digest = InventoryDigest()
+        self.digest_task = None
+        # Inventory rules, applied to the tables of the store. Commands are thin adapters over the engine.
+        self.engine = InventoryEngine(DigestTable.wrap_tables(self.store.tables, self.digest))
+        self._inventory_channel = None
+
+        # Only the writer process (lease holder) takes commands and posts to the transaction log.
+        # Other processes are hot standbys that follow the writer's posts. See leader_lease.py.
+        self.lease = None
+        self.lease_task = None
+        self.is_writer = False
+        self.last_message_id = None  # Newest inventory channel message applied to this inventory
+        self.catching_up = False
+        self.pending_messages = []
+        self.history_cache = None  # Channel history kept for 'report --at'. See history_cache.py.
+        # maps transaction log message id to the items it dropped into a dropbox, so that collectors can confirm a
+        # drop with a reaction. Filled while replaying the log, and on every drop posted. See on_raw_reaction_add().
+        self.dropbox_messages = {}
+        # Item and variant combinations in the transaction log since the last sync point. Replay needs the catalog to
+        # know them, so 'catalog reload' keeps them. See catalog_reload().
+        self.logged_item_variants = set()
+        # The newest transaction records applied, for 'changes'. See change_feed.py.
+        self.change_feed = ChangeFeed(CHANGE_FEED_MAX_CHANGES)
+        self.changes_viewed = {}  # maps user id to when the user last ran 'changes'
+
+    @property
+    def inventory_by_user_role(self):
+        """maps 'makers' (USER_ROLE_MAKERS), 'collectors', etc to dataframes that store per-role inventory"""
+        return self.store.get_frames()
+
+    def get_inventory_channel(self):
+        """Find the right inventory channel model"""
+        if self._inventory_channel is None:
+            self._inventory_channel = discord.utils.get(self.guild.channels, name=self.config.inventory_channel)
+        if self._inventory_channel is None:
+            raise RuntimeError('No channel named "{0}" found in guild "{1}"'.format(
+                self.config.inventory_channel, self.guild.name))
+        return self._inventory_channel
+
+    def get_digest_channel(self):
+        if not self.config.digest_channel:
+            return self.get_inventory_channel()
+        ch = discord.utils.get(self.guild.channels, name=self.config.digest_channel)
+        if ch is None:
+            raise RuntimeError('No channel named "{0}" found in guild "{1}"'.format(
+                self.config.digest_channel, self.guild.name))
+        return ch
+
+# maps guild id to GuildInventory. A guild is only added once its inventory has been rebuilt from its log.
+GUILD_INVENTORIES = {}
+
+# Commands that every process answers, writer or standby. They are used to find and kill extraneous bots,
+# and to reload the catalog in every process.
+STANDBY_COMMANDS = ('who', 'hello', 'kamikaze', 'catalog reload')
+LEASE_HOLDER_ID = get_lease_holder_id()
+
+# All messages the bot posts go through this scheduler. Transaction log writes go first. See outbox.py.
+OUTBOX = Outbox(CONFIG.outbox_max_pending_replies)
+
+def _reply(destination, content=None, **kwargs):
+    """Queue a reply to a context, channel or user. It is posted in the background."""
+    OUTBOX.post_reply(destination, content, **kwargs)
+
+def _is_standby_command(content):
+    words = content.lower().split()
+    return any(words[:len(command.split())] == command.split() for command in STANDBY_COMMANDS)
+
+def _load_catalog():
+    """The item/variant catalog from the configuration file, or the built-in one if the file has none."""
+    config = get_catalog_config()
+    if config is None:
+        return Catalog(ITEM_CHOICES, VARIANT_CHOICES, ITEMS_WITH_NO_VARIANTS)
+    return Catalog.from_config(config)
+
+set_catalog(_load_catalog())
 
 def _fake_command_prefix_in_right_channel(_bot, message):
     """
@@ -156,11 +217,18 @@ def _fake_command_prefix_in_right_channel(_bot, message):
     """
     ch = message.channel
     if ch.type == discord.ChannelType.private:
-        return ''  # no command prefix means that comments from this DM channel will be matched and processed
+        # Standby processes leave DMs to the writer of the user's guild
+        if _is_standby_command(message.content) or any(
+                inv.is_writer and inv.guild.get_member(message.author.id) for inv in GUILD_INVENTORIES.values()):
+            return ''  # no command prefix means that comments from this DM channel will be matched and processed
+        return '#fake-prefix-no-one-uses#'
     elif ch.type != discord.ChannelType.text:
         return '#fake-prefix-no-one-uses#'
-    elif ch.name == INVENTORY_CHANNEL:
-        return ''
+
+    inventory = GUILD_INVENTORIES.get(message.guild.id)
+    if inventory and ch.name == inventory.config.inventory_channel:
+        if inventory.is_writer or _is_standby_command(message.content):
+            return ''
     return '#fake-prefix-no-one-uses#'
 
 description = '''Keep count of current numbers of face shields in each person's possession until the next drop. ''' \
@@ -169,11 +237,19 @@ description = '''Keep count of current numbers of face shields in each person's
     '''See 10-min guide at https://github.com/Fred-Hsu/count_bot.''' \
     .format(INVENTORY_CHANNEL)
 
+class OutboxHelpCommand(commands.DefaultHelpCommand):
+    """Help pages are queued in the outbox like other replies, so they are posted after the replies queued before them."""
+
+    async def send_pages(self):
+        destination = self.get_destination()
+        for page in self.paginator.pages:
+            _reply(destination, page)
+
 bot = commands.Bot(
     description=description,
     case_insensitive=True,  # No need to be draconian with case
     command_prefix=_fake_command_prefix_in_right_channel,
-    help_command=commands.DefaultHelpCommand(
+    help_command=OutboxHelpCommand(
         no_category='Commands',
         dm_help=True,   # Set to True to redirect help text that are too long to user's own DM channels
     ),
@@ -186,8 +262,32 @@ class NotEntitledError(commands.errors.CommandError):
 class NegativeCount(commands.errors.CommandError):
     pass
 
+class AmbiguousGuildError(commands.errors.CommandError):
+    pass
+
+class NotWriterError(commands.errors.CommandError):
+    pass
+
+class ReplayError(RuntimeError):
+    """The transaction log cannot be replayed into a complete inventory. See _replay_trans_log()."""
+    pass
+
+# CPU-heavy pandas work, such as rendering a big report, runs in these threads so that the event loop only does I/O.
+# Heartbeats and other users' commands are not held up meanwhile.
+RENDER_EXECUTOR = ThreadPoolExecutor(max_workers=RENDER_WORKER_THREADS, thread_name_prefix='count_bot_render')
+
+async def _run_in_worker(func, *args):
+    """
+    Run func(*args) in a render worker thread. It must not touch discord.py objects, or dataframes that commands
+    may change meanwhile. Give it a snapshot of the inventory instead. See get_snapshot() of the stores.
+    """
+    # The worker may be the first to touch pandas or humanize. Their lazy imports are finished in this thread.
+    load_now(pd)
+    load_now(humanize)
+    return await asyncio.get_event_loop().run_in_executor(RENDER_EXECUTOR, func, *args)
+
 def my_naturaltime(dt):
-    return naturaltime(dt - TIME_DIFF)
+    return humanize.naturaltime(dt - TIME_DIFF)
 
 @bot.listen()
 async def on_command_error(ctx, error):
@@ -198,56 +298,268 @@ async def on_command_error(ctx, error):
 
     This is a global error handler for all commands. Each command can also provide its own specific error handler.
     """
-    if isinstance(error, (NotEntitledError, NegativeCount)):
+    if isinstance(error, (NotEntitledError, NegativeCount, NotWriterError)):
         pass
+    elif isinstance(error, AmbiguousGuildError):
+        _reply(ctx, "❌  You are a member of more than one server served by this bot. "
+            "Please issue this command from the inventory channel of your server.")
     elif isinstance(error, (commands.errors.BadArgument, commands.errors.MissingRequiredArgument)):
-        await ctx.send("❌  I don't completely understand. See help.")
+        _reply(ctx, "❌  I don't completely understand. See help.")
         await ctx.send_help(ctx.command)
     else:
         # If this listener doesn't exist, the Bot.on_command_error does this:
         print('Ignoring exception in command {}:'.format(ctx.command), file=sys.stderr)
         traceback.print_exception(type(error), error, error.__traceback__, file=sys.stderr)
 
-async def _generate_inventory_csv_file():
+def _compact_inventory_df_for_sync_point(role_name, inventory_df, now=None):
+    """
+    Compaction stage applied to a role table before it is persisted into a sync point.
+
+    Makers keep zero-count rows on purpose ('drop ... all' leaves them behind, so that a bare 'count 20' keeps working),
+    but only for SYNC_POINT_ZERO_ROW_RETENTION_DAYS. Dropboxes never keep zero-count rows. Rows that share a primary
+    key are deduplicated, keeping the latest update. The result is sorted by primary key, which keeps
+    read_sync_point_csv() and set_index(verify_integrity=True) cheap on replay.
+    """
+    primary_key = BOOTSTRAP_CLASS_BY_USER_ROLE[role_name].primary_key
+    df = inventory_df.reset_index(drop=True)
+    if not len(df):
+        return df
+
+    now = now or datetime.utcnow()
+    is_zero = df[COL_COUNT] == 0
+    if role_name == USER_ROLE_DROPBOXES:
+        stale = is_zero
+    else:
+        cutoff = now - timedelta(days=SYNC_POINT_ZERO_ROW_RETENTION_DAYS)
+        stale = is_zero & (pd.to_datetime(df[COL_UPDATE_TIME]) < cutoff)
+
+    df = df[~stale]
+    df = df.sort_values(COL_UPDATE_TIME, kind='stable').drop_duplicates(subset=primary_key, keep='last')
+    return df.sort_values(primary_key).reset_index(drop=True)
+
+def _render_inventory_csv(inventory_by_user_role, names, compact=False):
+    """
+    Returns the CSV file content of all inventory tables, as bytes, and the number of rows of each table.
+    'names' maps user ids to display names.
+    """
     s_buf = io.StringIO()
+    row_counts = []
 
-    for _role, inventory_df in INVENTORY_BY_USER_ROLE.items():
-        modified_df = await _add_user_display_name_columns(inventory_df)
+    for role_name, inventory_df in inventory_by_user_role.items():
+        if compact:
+            inventory_df = _compact_inventory_df_for_sync_point(role_name, inventory_df)
+        modified_df = _add_user_display_name_columns(inventory_df, names)
         modified_df.to_csv(s_buf, index=False)
         s_buf.write('\n')
+        row_counts.append(len(modified_df))
 
     s_buf.write("version\n'{0}'\n".format(CODE_VERSION))
-    s_buf.seek(0)
-    file = discord.File(s_buf, PRODUCT_CSV_FILE_NAME)
-    return file
+    return s_buf.getvalue().encode('utf-8'), tuple(row_counts)
 
-async def _post_sync_point_to_trans_log():
-    file = await _generate_inventory_csv_file()
-    sync_text = '✅ ' + "Bot restarted: sync point"
+async def _generate_inventory_csv(inventory, compact=False, inventory_by_user_role=None):
+    """
+    Returns the CSV file content of all inventory tables, as bytes, and the number of rows of each table.
+    Sync points are rendered here on the event loop, not in a worker. No command may change the inventory between
+    the CSV and the sync point message, or the sync point would miss transactions posted before it.
+    """
+    inventory_by_user_role = inventory_by_user_role or inventory.inventory_by_user_role
+    names = await _get_display_names(inventory.guild, inventory_by_user_role.values(), pad_for_print=False)
+    return _render_inventory_csv(inventory_by_user_role, names, compact)
+
+async def _generate_inventory_csv_file(inventory, compact=False, inventory_by_user_role=None):
+    """The CSV file of the inventory, rendered by a worker thread from a snapshot of the inventory."""
+    if inventory_by_user_role is None:
+        inventory_by_user_role, _totals = inventory.store.get_snapshot()
+    names = await _get_display_names(inventory.guild, inventory_by_user_role.values(), pad_for_print=False)
+    csv_bytes, _row_counts = await _run_in_worker(_render_inventory_csv, inventory_by_user_role, names, compact)
+    return discord.File(io.BytesIO(csv_bytes), PRODUCT_CSV_FILE_NAME)
+
+async def _post_sync_point_to_trans_log(inventory, reason="Bot restarted", inventory_by_user_role=None):
+    csv_bytes, row_counts = await _generate_inventory_csv(inventory, compact=True,
+                                                          inventory_by_user_role=inventory_by_user_role)
+    file = discord.File(io.BytesIO(csv_bytes), PRODUCT_CSV_FILE_NAME)
+    # The summary lets replay reject a bad attachment before downloading or parsing it
+    summary = SyncPointSummary(CODE_VERSION, row_counts, len(csv_bytes), hashlib.sha256(csv_bytes).hexdigest())
+    sync_text = format_sync_point_text(reason, summary)
 
     if DEBUG_DISABLE_STARTUP_INVENTORY_SYNC:
-        # FIXME - remove hardcoded user...
-        guild = _get_first_guild()
-        member = guild.get_member(700184823628562482)
-        await member.send('DEBUG: record in DM: ' + sync_text, file=file)
+        member = inventory.guild.get_member(DEBUG_MEMBER_ID)
+        await OUTBOX.post_durable(member, 'DEBUG: record in DM: ' + sync_text, file=file)
         print('Posted a CSV sync point message on DM')
     else:
-        ch = _get_inventory_channel()
-        await ch.send(sync_text, file=file)
-        print('Posted a CSV sync point message on inventory channel')
+        ch = inventory.get_inventory_channel()
+        message = await OUTBOX.post_durable(ch, sync_text, file=file)
+        inventory.last_message_id = message.id
+        inventory.logged_item_variants = set()
+        print('Posted a CSV sync point message on inventory channel of', inventory.guild.name)
+
+def _make_lease(inventory):
+    if LEASE_BACKEND == 'file':
+        return FileLease(os.path.join(LEASE_FILE_DIR, 'count_bot_lease_{0}.json'.format(inventory.guild.id)))
+    return ChannelLease(inventory.get_inventory_channel(), bot.user)
+
+async def _try_acquire_lease(inventory):
+    try:
+        return await inventory.lease.try_acquire(LEASE_HOLDER_ID)
+    except Exception as e:
+        # A writer that cannot reach its lease must assume that a standby is about to take over.
+        print('---- failed to acquire or renew lease of guild "{0}": {1!r}'.format(inventory.guild.name, e))
+        return False
+
+async def _keep_lease(inventory):
+    """
+    The writer renews its lease periodically. A hot standby tries to take the lease over, which succeeds once the
+    writer stopped renewing it. Before serving commands, the new writer catches up with the log.
+    """
+    while True:
+        await asyncio.sleep(LEASE_RENEW_INTERVAL_SECONDS)
+        was_writer = inventory.is_writer
+        is_writer = await _try_acquire_lease(inventory)
+        if is_writer and not was_writer:
+            await _catch_up_with_trans_log(inventory)
+            print('---- took over as writer of guild:', inventory.guild.name)
+        elif was_writer and not is_writer:
+            print('---- lost lease, now a hot standby of guild:', inventory.guild.name)
+        inventory.is_writer = is_writer
+
+def _stop_lease_keeper(inventory):
+    if inventory.lease_task:
+        inventory.lease_task.cancel()
+        inventory.lease_task = None
+
+async def _post_digests(inventory):
+    """
+    Post a digest of the inventory every DIGEST_INTERVAL_HOURS. Only the writer posts. Standbys clear their changes
+    at the same times, so that a standby taking over does not post changes that a digest already covered.
+    """
+    while True:
+        now = datetime.utcnow()
+        await asyncio.sleep((get_next_digest_time(now, DIGEST_INTERVAL_HOURS) - now).total_seconds())
+        try:
+            await _post_digest(inventory)
+        except Exception as e:
+            print('---- failed to post digest of guild "{0}": {1!r}'.format(inventory.guild.name, e))
+
+async def _post_digest(inventory):
+    """
+    Digests are posted as durably as the transaction log, not as replies that the outbox may merge or drop.
+    If a digest cannot be posted, its changes go into the next one.
+    """
+    messages = inventory.digest.take()
+    if not messages or not inventory.is_writer:
+        return
+    try:
+        ch = inventory.get_digest_channel()
+        for text in messages:
+            await OUTBOX.post_durable(ch, text)
+    except Exception:
+        inventory.digest.untake()
+        raise
+
+def _stop_digest_poster(inventory):
+    if inventory.digest_task:
+        inventory.digest_task.cancel()
+        inventory.digest_task = None
+
+async def _bootstrap_guild_inventory(guild):
+    """Rebuild the inventory of one guild from its transaction log, then start serving commands for this guild."""
+    inventory = GuildInventory(guild, _get_guild_config(guild.id))
+    try:
+        inventory.get_inventory_channel()
+    except RuntimeError as e:
+        print('---- not serving guild "{0}": {1}'.format(guild.name, e))
+        return
+
+    inventory.lease = _make_lease(inventory)
+    inventory.is_writer = await _try_acquire_lease(inventory)
+    if inventory.store.last_message_id is not None:
+        # A persistent store only needs what was posted to the log after its last commit
+        print('---- opened stored inventory as {0}, catching up with log: {1}'.format(
+            'writer' if inventory.is_writer else 'hot standby', guild.name))
+        inventory.last_message_id = inventory.store.last_message_id
+        await _index_trans_log_since_sync_point(inventory)
+        await _catch_up_with_trans_log(inventory)
+    else:
+        print('---- rebuilding inventory from log as {0}: {1}'.format(
+            'writer' if inventory.is_writer else 'hot standby', guild.name))
+        try:
+            updates_since_sync_point = await _retrieve_inventory_df_from_transaction_log(inventory)
+        except ReplayError as e:
+            # Serving a partial inventory, and posting it as the next sync point, would lose counts for good.
+            # The lease is left to expire. Another process, or a restart after the log is fixed, may do better.
+            print('---- not serving guild "{0}": {1}'.format(guild.name, e))
+            return
+        if updates_since_sync_point and inventory.is_writer:
+            print('---- writing inventory sync point to log:', guild.name)
+            await _post_sync_point_to_trans_log(inventory)
+            inventory.store.commit(inventory.last_message_id)
+
+    if inventory.digest.totals is None:
+        # A stored inventory was opened, not rebuilt. Digests count changes from here on.
+        inventory.digest.set_totals(inventory.store.get_totals())
+
+    previous = GUILD_INVENTORIES.get(guild.id)
+    if previous:
+        _stop_lease_keeper(previous)
+        _stop_digest_poster(previous)
+    GUILD_INVENTORIES[guild.id] = inventory
+    inventory.lease_task = bot.loop.create_task(_keep_lease(inventory))
+    if DIGEST_INTERVAL_HOURS:
+        inventory.digest_task = bot.loop.create_task(_post_digests(inventory))
+    if not inventory.is_writer:
+        # Pick up whatever the writer posted while we were replaying
+        await _catch_up_with_trans_log(inventory)
 
 @bot.event
 async def on_ready():
     print('Logged in as')
     print(bot.user.name)
     print(bot.user.id)
-    print('---- rebuilding inventory from log')
-    updates_since_sync_point = await _retrieve_inventory_df_from_transaction_log()
-    if updates_since_sync_point:
-        print('---- writing inventory sync point to log')
-        await _post_sync_point_to_trans_log()
+    print('---- rebuilding inventories of {0} guilds'.format(len(bot.guilds)))
+    await asyncio.gather(*[_bootstrap_guild_inventory(guild) for guild in bot.guilds])
+    for inventory in GUILD_INVENTORIES.values():
+        print('---- memory after rebuilding {0}:\n  {1}'.format(
+            inventory.guild.name, '\n  '.join(_get_memory_report(inventory))))
     print('---- ready')
 
+@bot.event
+async def on_guild_join(guild):
+    await _bootstrap_guild_inventory(guild)
+
+@bot.event
+async def on_guild_remove(guild):
+    inventory = GUILD_INVENTORIES.pop(guild.id, None)
+    if inventory:
+        _stop_lease_keeper(inventory)
+        _stop_digest_poster(inventory)
+
+@bot.listen()
+async def on_message(message):
+    """Hot standbys follow the transaction log posted by the writer process, to keep their inventory warm."""
+    if message.guild is None or message.author != bot.user:
+        return
+    inventory = GUILD_INVENTORIES.get(message.guild.id)
+    if inventory is None or inventory.is_writer or message.channel.id != inventory.get_inventory_channel().id:
+        return
+    if inventory.catching_up:
+        inventory.pending_messages.append(message)
+        return
+
+    # Applying a sync point downloads its attachment. Messages arriving meanwhile are applied afterwards, in order.
+    inventory.catching_up = True
+    try:
+        await _apply_trans_log_message_to_inventory(inventory, message)
+        await _apply_pending_trans_log_messages(inventory)
+    finally:
+        inventory.catching_up = False
+
+@bot.after_invoke
+async def _commit_inventory_store(ctx):
+    """Commit what a command changed in a persistent inventory store, together with the newest transaction log message."""
+    inventory = getattr(ctx, 'guild_inventory', None)
+    if inventory is not None:
+        inventory.store.commit(inventory.last_message_id)
+
 # on_reaction_add - this only works if the bot was monitoring messages that reactions operated on.
 # If the reaction tags a message that was posted before this bot was rebooted, then the past
 # message will not be in the "internal message cache", and thus on_reaction_add won't be triggered.
@@ -256,36 +568,76 @@ async def on_ready():
 # async def on_reaction_add(reaction, user):
 #     print("Reaction: {0} {1}".format(user, reaction))
 
-# TODO - temporarily commented out. Will be resurrected when finish implementing reaction-based collection.
-# @bot.event
-# async def on_raw_reaction_add(payload):
-#     print("Reaction add: {0}".format(payload))
-#
-#     if payload.guild_id is None:
-#         print('  Ignore DM reactions')
-#         return
-#
-#     if payload.emoji.name != '💯':
-#         print('  Ignore emojis that are not 💯')
-#         return
-#
-#     is_collector = await _user_has_role(payload.member, COLLECTOR_ROLE_NAME)
-#     if not is_collector:
-#         print('  Ignore reactions from non-collectors')
-#         return
-#
-#     collector = payload.member
-#     ch = _get_inventory_channel()
-#     msg = await ch.fetch_message(payload.message_id)
-#
-#     result = parse_dropbox_count_trnx_log_entry(msg)
-#     if not result:
-#         print('  Not a dropbox count record')
-#         return
-#
-#     maker, collector, count, item, variant = result
-#     # FIXME - not yet done
-#
+class ReactionContext:
+    """
+    Stands in for a command context when a collector confirms a drop with a reaction. There is no command message,
+    so replies go to the inventory channel the reaction was made in.
+    """
+    def __init__(self, inventory, member, channel):
+        self.guild = inventory.guild
+        self.guild_inventory = inventory
+        self.channel = channel
+        self.author = member
+        self.message = SimpleNamespace(author=member, channel=channel)
+        self.command = None
+
+    async def send(self, content=None, **kwargs):
+        return await self.channel.send(content, **kwargs)
+
+    async def send_help(self, *args):
+        pass
+
+@bot.event
+async def on_raw_reaction_add(payload):
+    """
+    A collector confirms a drop by reacting with 💯 to its record in the inventory channel. Raw reactions also arrive
+    for messages posted before the bot was restarted. The record is looked up in GuildInventory.dropbox_messages,
+    so no message is fetched from Discord. Only the items of that drop are moved, as far as they are still in the
+    dropbox. Other drops into the same dropbox entry are confirmed with their own reactions.
+    """
+    if payload.guild_id is None or payload.emoji.name != DROP_CONFIRM_EMOJI:
+        return
+    inventory = GUILD_INVENTORIES.get(payload.guild_id)
+    if inventory is None or not inventory.is_writer or payload.user_id == bot.user.id:
+        return
+    ch = inventory.get_inventory_channel()
+    if payload.channel_id != ch.id:
+        return
+
+    dropped = inventory.dropbox_messages.get(payload.message_id)
+    if dropped is None:
+        print('  Ignore {0} on message {1}: not a drop record since the last sync point'.format(
+            DROP_CONFIRM_EMOJI, payload.message_id))
+        return
+    record = dropped.record
+    if payload.user_id != record.collector_id:
+        print('  Ignore {0} from someone other than the collector of the drop'.format(DROP_CONFIRM_EMOJI))
+        return
+
+    collector = payload.member or inventory.guild.get_member(payload.user_id)
+    if not await _user_has_role(inventory.guild, collector, inventory.config.collector_role_name):
+        print('  Ignore {0} from a member who is no longer a collector'.format(DROP_CONFIRM_EMOJI))
+        return
+    print('Reaction: {0} on drop of {1} {2} from {3} ({4})'.format(
+        DROP_CONFIRM_EMOJI, record.item, record.variant, record.member_id, collector.display_name))
+
+    # Each drop message is confirmed once. Later drops of the same item to the same collector have their own message.
+    del inventory.dropbox_messages[payload.message_id]
+    ctx = ReactionContext(inventory, collector, ch)
+    dropbox_key = _get_dropbox_key(record)
+    count = min(dropped.count, inventory.engine.tables[USER_ROLE_DROPBOXES].get_count(dropbox_key))
+    if not count:
+        _reply(ctx, "{0} The items of this drop are already in your collection.".format(collector.mention))
+        return
+
+    mapped_makers = await _map_dm_user_ids_to_members(inventory.guild, [record.member_id])
+    await _collect_dropbox_rows(ctx, inventory, collector, [InventoryRow(dropbox_key, count, None)], mapped_makers)
+    inventory.store.commit(inventory.last_message_id)
+
+    _reply(ctx, "{0} Collected {1} {2} {3} from the dropbox. Current collection:".format(
+        collector.mention, count, record.item, record.variant))
+    await _count(ctx, role=USER_ROLE_COLLECTORS)
+
 # @bot.event
 # async def on_raw_reaction_remove(payload):
 #     print("Reaction remove: {0}".format(payload))
@@ -295,22 +647,14 @@ async def on_ready():
 # async def on_raw_reaction_clear(payload):
 #     print("Reaction clear: {0}".format(payload))
 
-@lru_cache()
-def _get_inventory_channel():
-    """Find the right inventory channel model"""
-    for ch in bot.get_all_channels():
-        if ch.name == INVENTORY_CHANNEL:
-            return ch
-    raise RuntimeError('No channel named "{0}" found'.format(INVENTORY_CHANNEL))
-
 class RoleBootstrap:
     # This tracks the last action performed by a user on an item + variant.
     # Only the last action of said tuple is used to rebuild the inventory.
     # Any previous action by the user on said tuple are ignored.
     last_action = {}
     role_name = ''
-    sync_point_df = pd.DataFrame()
-    inventory_df = pd.DataFrame()
+    sync_point_df = None
+    inventory_df = None
 
     df_columns = PERSONAL_DF_COLUMNS
     primary_key = PERSONAL_PRIMARY_KEY
@@ -335,6 +679,11 @@ class RoleBootstrap:
         if COL_UPDATE_TIME not in sync_df:  # CSV before V0.3 did not have update time column
             sync_df[COL_UPDATE_TIME] = datetime.utcnow()
 
+        # A truncated table parses, with the missing values left empty
+        columns = self.primary_key + [COL_COUNT]
+        if not set(columns) <= set(sync_df.columns) or sync_df[columns].isnull().values.any():
+            raise ValueError('sync point table is missing values of {0}'.format(columns))
+
         self.sync_point_df = sync_df
 
     def rebuild_inventory_df_from_sync_n_updates(self):
@@ -352,6 +701,7 @@ class RoleBootstrap:
 
         df = pd.DataFrame(rows, columns=self.df_columns)
         df.set_index(keys=self.primary_key, inplace=True, verify_integrity=True, drop=False)
+        df.sort_index(inplace=True)
         self.inventory_df = df
 
 class TransactionRoleBootstrap(RoleBootstrap):
@@ -374,6 +724,7 @@ class TransactionRoleBootstrap(RoleBootstrap):
 
         df = pd.DataFrame(rows, columns=self.df_columns)
         df.set_index(keys=self.primary_key, inplace=True, verify_integrity=True, drop=False)
+        df.sort_index(inplace=True)
         self.inventory_df = df
 
 BOOTSTRAP_CLASS_BY_USER_ROLE = {
@@ -414,126 +765,45 @@ BOOTSTRAP_CLASS_BY_USER_ROLE = {
 #
 #     return maker, collector, count, item, variant
 
-class TransLogAction(NamedTuple):
-    count: Optional[int]
-    update_time: datetime
+def _get_trans_log_text(msg):
+    """Returns the text of a transaction log message posted by this bot, or None if it isn't one."""
+    text = msg.content
 
-async def _process_one_trans_record(member, last_action, text, item, variant, command, update_time, collector):
-    if not collector:
-        key = (member.id, item, variant)
-    else:
-        key = (member.id, collector.id, item, variant)
+    if msg.author != bot.user:
+        return None
+    if not text.startswith('✅ '):
+        return None
 
-    if key in last_action:
-        print("{} {:60} {}".format(update_time, text, 'superseded by count or remove'))
-        return
-    else:
-        if (item, variant) == ('remove', 'all'):
-            for combo in ALL_ITEM_VARIANT_COMBOS:
-                combo_key = (member.id, combo[0], combo[1])
-                if combo_key not in last_action:
-                    last_action[combo_key] = TransLogAction(None, update_time)
-            print("{} {:80} {}".format(update_time, text, 'remove all'))
-            return
-        elif command.startswith('remove'):
-            last_action[key] = TransLogAction(None, update_time)
-            print("{} {:80} {}".format(update_time, text, command))
-        elif command.startswith('count'):
-            parts = command.split()
-            last_action[key] = TransLogAction(int(parts[1]), update_time)
-            print("{} {:80} {}".format(update_time, text, command))
-        else:
-            print("{} {:80} {}".format(update_time, text, 'I DO NOT UNDERSTAND THIS COMMAND'))
+    if text.endswith(' (from DM chat)'):
+        text = text[:-15]
+    return text
+
+def _decode_trans_log_records(msg, text) -> List[TransLogRecord]:
+    if _is_sync_point_text(text):
+        # Sync points posted by 'import' mention the admin, but are not user transactions
+        return []
+    return decode_trans_log_records(text, [m.id for m in msg.mentions])
 
-async def _retrieve_inventory_df_from_transaction_log() -> int:
+async def _retrieve_inventory_df_from_transaction_log(inventory) -> int:
     """
     Troll through inventory channel's message records to find all relevant transactions until we hit a sync point.
-    Use these to rebuild in memory the inventory dataframe.
+    Use these to rebuild in memory the inventory dataframe of a guild. See _replay_trans_log() for how bad sync points
+    are skipped, and when ReplayError is raised.
+    Returns the number of updates since the sync point. A skipped sync point counts as one, so that a good one
+    gets posted in its place.
     """
-    ch = _get_inventory_channel()
-
-    bootstrap_by_role = OrderedDict()
-    for role_name in USER_ROLES_IN_ORDER:
-        # Make sure to add them in the right order so we can do simply do iteration when order is important.
-        cls = BOOTSTRAP_CLASS_BY_USER_ROLE[role_name]
-        bootstrap_by_role[role_name] = cls(role_name)
+    ch = inventory.get_inventory_channel()
+    bootstrap_by_role = _make_role_bootstraps()
 
     # Channel history is returned in reverse chronological order.
-    # Troll through these entries and process only transaction log-type messages posted by the bot itself.
-    async for msg in ch.history(limit=MSG_HISTORY_TROLLING_LIMIT):
-        text = msg.content
-
-        if msg.author != bot.user:
-            continue
-        if not text.startswith('✅ '):
-            continue
-
-        if text.endswith(' (from DM chat)'):
-            text = text[:-15]
-
-        if text.endswith('sync point'):
-            if not msg.attachments:
-                print('Internal error - found a syncpoint without attachment. Continue trolling...')
-                continue
-            product_att = msg.attachments[0]
-            print('Found attachment: ' + product_att.filename)
-            if product_att.filename != PRODUCT_CSV_FILE_NAME:
-                print('Internal error - wrong inventory file found. Continue trolling...')
-                continue
-
-            csv_mem = io.BytesIO(await product_att.read())
-            csv_text = csv_mem.getvalue()
-            csv_text = str(csv_text, 'utf-8')
-
-            tables = csv_text.split('\n\n')
-            tables, version = tables[:-1], tables[-1]
-
-            for i, role_name in enumerate(USER_ROLES_IN_ORDER):
-                if i >= len(tables):
-                    # Before V0.4, there were only makers and collectors tables.
-                    break
-                print("  parsing csv table for: ", role_name)
-                csv_text = tables[i]
-                bootstrap_by_role[role_name].read_sync_point_csv(csv_text)
-
-            print("{} {:80} sync point - stop trolling".format(msg.created_at, text))
-            break
-
-        if msg.mentions:
-            # Messages with mentions are records created in response to a user action.
-            # The order of the mentions list is not in any particular order so you should not rely on it.
-            # This is a discord limitation, not one with the library.
-            mention_map = dict([(str(m.id), m) for m in msg.mentions])
-
-            collector = None
-            head, item, variant = text.rsplit(maxsplit=2)
-            if variant in ITEMS_WITH_NO_VARIANTS:
-                head += ' ' + item
-                item = variant
-                variant = " "
-
-            member_prefix, command_head = head.split(':')
-            _garbage, member_str = member_prefix.rsplit(maxsplit=1)
-            member_str = member_str.strip('<@!>')
-            member = mention_map[member_str]
-
-            command_head = command_head.strip()
-            if command_head.startswith('collect'):
-                last_action = bootstrap_by_role[USER_ROLE_COLLECTORS].last_action
-                if (item, variant) != ('remove', 'all'):
-                    _garbage, command = command_head.split(maxsplit=1)
-                else:
-                    command = ''
-            elif command_head.startswith('drop'):
-                last_action = bootstrap_by_role[USER_ROLE_DROPBOXES].last_action
-                _cmd, collector_str, count = command_head.split(maxsplit=3)
-                collector_str = collector_str.strip('<@!>')
-                collector = mention_map[collector_str]
-                command = 'count ' + count
-            else:
-                last_action = bootstrap_by_role[USER_ROLE_MAKERS].last_action
-                command = command_head
-            await _process_one_trans_record(member, last_action, text, item, variant, command, msg.created_at, collector)
+    dropbox_messages = {}
+    logged_item_variants = set()
+    result = await _replay_trans_log(lambda before: ch.history(limit=MSG_HISTORY_TROLLING_LIMIT, before=before),
+                                     bootstrap_by_role, dropbox_messages=dropbox_messages,
+                                     logged_item_variants=logged_item_variants)
+    inventory.last_message_id = result.newest_message_id
+    inventory.dropbox_messages = dropbox_messages
+    inventory.logged_item_variants = logged_item_variants
 
     print('  --- updates since last syncpoint --')
 
@@ -543,20 +813,615 @@ async def _retrieve_inventory_df_from_transaction_log() -> int:
         pprint(bootstrap.last_action)
         updates_since_sync_point += len(bootstrap.last_action)
     print('updates since last sync point: ', updates_since_sync_point)
+    print('memory held by replay bookkeeping: ', humanize.naturalsize(
+        get_deep_size([bootstrap.last_action for bootstrap in bootstrap_by_role.values()])))
 
     print('  --- rebuilt inventory --')
 
+    await _install_rebuilt_inventory(inventory, bootstrap_by_role)
+    return updates_since_sync_point + len(result.bad_sync_point_ids)
+
+class TrollResult(NamedTuple):
+    newest_message_id: Optional[int]  # None if history is empty
+    sync_point: Optional[discord.Message]  # The good sync point that trolling stopped at, if any
+    bad_sync_point_ids: List[int]  # Sync points skipped because of a missing or wrong attachment, newest first
+    messages_read: int
+    oldest_message: Optional[discord.Message]  # The last message read
+
+async def _replay_trans_log(get_history, bootstrap_by_role, read_attachment=None, dropbox_messages=None,
+                            logged_item_variants=None, before=None) -> TrollResult:
+    """
+    Replay the transaction log into role bootstraps, newest first, down to the newest good sync point.
+    'get_history(before)' returns the history before a message, newest first, like channel.history().
+    Replay reads one window of history at a time, each up to the next sync point and at most
+    MSG_HISTORY_TROLLING_LIMIT messages. A bad sync point is skipped, and replay jumps to the window before it, up to
+    REPLAY_MAX_SYNC_POINTS of them. A channel with no good sync point at all, e.g. a new one, is replayed from its first
+    message. Otherwise ReplayError is raised if no good sync point is found, rather than replay partial counts.
+    Drop records are also indexed into 'dropbox_messages' if given. See GuildInventory.dropbox_messages.
+    Item and variant combinations of records are added to 'logged_item_variants' if given.
+    """
+    newest_message_id = None
+    bad_sync_point_ids = []
+    messages_read = 0
+    dropbox_indexer = DropboxIndexer(dropbox_messages) if dropbox_messages is not None else None
+    while True:
+        window = await _troll_trans_log(get_history(before), bootstrap_by_role, read_attachment, dropbox_indexer,
+                                        logged_item_variants, max_sync_points=1)
+        newest_message_id = newest_message_id or window.newest_message_id
+        bad_sync_point_ids += window.bad_sync_point_ids
+        messages_read += window.messages_read
+        if window.sync_point is not None:
+            break
+        if not window.bad_sync_point_ids:
+            if window.messages_read < MSG_HISTORY_TROLLING_LIMIT:
+                # The first message of the channel, and no sync point before it. Every record has been replayed.
+                break
+            raise ReplayError('no sync point in {0} messages before {1}. See MSG_HISTORY_TROLLING_LIMIT.'.format(
+                MSG_HISTORY_TROLLING_LIMIT, 'sync point {0}'.format(before.id) if before else 'the newest message'))
+        if len(bad_sync_point_ids) >= REPLAY_MAX_SYNC_POINTS:
+            raise ReplayError('the newest {0} sync points are bad: {1}'.format(
+                len(bad_sync_point_ids), bad_sync_point_ids))
+        before = window.oldest_message
+
+    if bad_sync_point_ids:
+        print('  --- skipped bad sync points {0}, replayed from {1}'.format(
+            bad_sync_point_ids, 'sync point {0}'.format(window.sync_point.id) if window.sync_point
+            else 'the first message'))
+    if dropbox_indexer is not None:
+        # Drops older than the sync point are not indexed, but their counts come before the oldest drops read
+        dropbox_indexer.finish(_get_nonzero_counts(bootstrap_by_role[USER_ROLE_DROPBOXES].sync_point_df,
+                                                   TRANSACTION_PRIMARY_KEY) if window.sync_point else {})
+    return TrollResult(newest_message_id, window.sync_point, bad_sync_point_ids, messages_read, window.oldest_message)
+
+async def _troll_trans_log(history, bootstrap_by_role, read_attachment=None, dropbox_indexer=None,
+                           logged_item_variants=None, max_sync_points=None) -> TrollResult:
+    """
+    Process transaction log messages from 'history', newest first, into role bootstraps until a good sync point is
+    found. Bad sync points are skipped. Trolling gives up after 'max_sync_points' of them, by default
+    REPLAY_MAX_SYNC_POINTS, so a corrupted log does not send replay through the whole channel history.
+    Drop records are also added to 'dropbox_indexer' if given. The caller finishes it.
+    Item and variant combinations of records are added to 'logged_item_variants' if given.
+    """
+    max_sync_points = max_sync_points or REPLAY_MAX_SYNC_POINTS
+
+    # Process only transaction log-type messages posted by the bot itself.
+    newest_message_id = None
+    sync_point = None
+    bad_sync_point_ids = []
+    messages_read = 0
+    msg = None
+    async for msg in history:
+        messages_read += 1
+        if newest_message_id is None:
+            newest_message_id = msg.id
+
+        text = _get_trans_log_text(msg)
+        if text is None:
+            continue
+
+        if _is_sync_point_text(text):
+            if await _read_sync_point_into_bootstraps(msg, bootstrap_by_role, text, read_attachment):
+                print("{} {:80} sync point - stop trolling".format(msg.created_at, text))
+                sync_point = msg
+                break
+            bad_sync_point_ids.append(msg.id)
+            if len(bad_sync_point_ids) >= max_sync_points:
+                print("{} {:80} bad sync point #{} - stop trolling".format(msg.created_at, text, max_sync_points))
+                break
+            continue
+
+        records = _decode_trans_log_records(msg, text)
+        for record in records:
+            last_action = bootstrap_by_role[record.role_name].last_action
+            process_one_trans_record(record, last_action, text, msg.created_at)
+            if dropbox_indexer is not None:
+                dropbox_indexer.add(msg.id, record)
+        if logged_item_variants is not None:
+            logged_item_variants.update(_get_item_variants(records))
+    return TrollResult(newest_message_id, sync_point, bad_sync_point_ids, messages_read, msg)
+
+def _get_nonzero_counts(df, primary_key):
+    """maps primary keys to counts. Zero-count rows are left out, as sync points may compact them away."""
+    df = df[df[COL_COUNT] != 0]
+    return dict(zip(df[primary_key].itertuples(index=False, name=None), (int(count) for count in df[COL_COUNT])))
+
+async def _verify_sync_points(inventory):
+    """
+    Check that the newest good sync point equals the good sync point before it, plus the transaction log between the
+    two. Only the window of history before the newest sync point is read for the older one.
+    Returns (newer sync point, older sync point, list of mismatches). Sync points are None if not found.
+    """
+    ch = inventory.get_inventory_channel()
+    newer_by_role = _make_role_bootstraps()
+    newer = await _troll_trans_log(ch.history(limit=MSG_HISTORY_TROLLING_LIMIT), newer_by_role)
+    if newer.sync_point is None:
+        return None, None, []
+
+    older_by_role = _make_role_bootstraps()
+    older = await _troll_trans_log(ch.history(limit=MSG_HISTORY_TROLLING_LIMIT, before=newer.sync_point),
+                                   older_by_role)
+    if older.sync_point is None:
+        return newer.sync_point, None, []
+
+    await _run_in_worker(_rebuild_inventory_dfs, older_by_role)
+    mismatches = []
+    for role_name in USER_ROLES_IN_ORDER:
+        if role_name == USER_ROLE_MAKERS and newer.sync_point.mentions:
+            # Sync points that mention an admin come from 'import', which replaces maker counts wholesale
+            continue
+        primary_key = BOOTSTRAP_CLASS_BY_USER_ROLE[role_name].primary_key
+        replayed = _get_nonzero_counts(older_by_role[role_name].inventory_df, primary_key)
+        expected = _get_nonzero_counts(newer_by_role[role_name].sync_point_df, primary_key)
+        for key in sorted(set(replayed) | set(expected), key=str):
+            if replayed.get(key, 0) != expected.get(key, 0):
+                mismatches.append('{0} {1}: {2} in sync point, {3} replayed'.format(
+                    role_name, ' '.join(str(part) for part in key), expected.get(key, 0), replayed.get(key, 0)))
+    return newer.sync_point, older.sync_point, mismatches
+
+def _get_item_variants(records):
+    """Item and variant combinations that records count or remove. A 'remove all' record names none."""
+    return set((record.item, record.variant) for record in records if (record.item, record.variant) != ('remove', 'all'))
+
+class DroppedItems(NamedTuple):
+    record: TransLogRecord
+    count: int  # Items this drop put into the dropbox. The record holds the new count of the whole dropbox entry.
+
+def _get_dropbox_key(record):
+    return record.member_id, record.item, record.variant, record.collector_id
+
+def _index_dropbox_message(dropbox_messages, message_id, record, previous_count):
+    """
+    Remember a message that dropped items into a dropbox, given the count of its dropbox entry before the drop.
+    Records that take items out of a dropbox are not confirmable.
+    """
+    if record.role_name != USER_ROLE_DROPBOXES:
+        return
+    count = int(record.command.split()[1]) - previous_count
+    if count > 0:
+        dropbox_messages[message_id] = DroppedItems(record, count)
+
+class DropboxIndexer:
+    """
+    Indexes the drop records of transaction log messages read newest first. What a drop added to its dropbox entry
+    is only known once the record before it, on the same entry, has been read.
+    """
+    def __init__(self, dropbox_messages):
+        self.dropbox_messages = dropbox_messages
+        self.oldest_read = {}  # maps dropbox key to (message id, record) of the oldest drop record read so far
+
+    def add(self, message_id, record):
+        if record.role_name != USER_ROLE_DROPBOXES:
+            return
+        key = _get_dropbox_key(record)
+        if key in self.oldest_read:
+            newer_message_id, newer_record = self.oldest_read[key]
+            _index_dropbox_message(self.dropbox_messages, newer_message_id, newer_record,
+                                   int(record.command.split()[1]))
+        self.oldest_read[key] = (message_id, record)
+
+    def finish(self, counts_before):
+        """'counts_before' maps dropbox keys to their counts before the oldest message read, e.g. in a sync point."""
+        for key, (message_id, record) in self.oldest_read.items():
+            _index_dropbox_message(self.dropbox_messages, message_id, record, counts_before.get(key, 0))
+        self.oldest_read = {}
+
+async def _retrieve_inventory_at(inventory, when):
+    """
+    Rebuild the inventory tables of a guild as they were at 'when', a naive UTC datetime, from the nearest good sync
+    point before that time. Raises ReplayError like _replay_trans_log(). The live inventory is left alone. History is
+    read through the guild's HistoryCache, so nearby points in time do not download the same pages and attachments
+    again.
+    """
+    if inventory.history_cache is None:
+        inventory.history_cache = HistoryCache(inventory.get_inventory_channel(), max_messages=HISTORY_CACHE_MAX_MESSAGES)
+    cache = inventory.history_cache
+
+    bootstrap_by_role = _make_role_bootstraps()
+    await _replay_trans_log(lambda before: cache.history_before(before or when, limit=MSG_HISTORY_TROLLING_LIMIT),
+                            bootstrap_by_role, cache.read_attachment)
+
+    await _run_in_worker(_rebuild_inventory_dfs, bootstrap_by_role)
+    return OrderedDict((role_name, bootstrap.inventory_df) for role_name, bootstrap in bootstrap_by_role.items())
+
+def _make_role_bootstraps():
+    bootstrap_by_role = OrderedDict()
+    for role_name in USER_ROLES_IN_ORDER:
+        # Make sure to add them in the right order so we can do simply do iteration when order is important.
+        cls = BOOTSTRAP_CLASS_BY_USER_ROLE[role_name]
+        bootstrap_by_role[role_name] = cls(role_name)
+    return bootstrap_by_role
+
+def _is_sync_point_text(text):
+    return is_sync_point_text(text)
+
+async def _read_sync_point_into_bootstraps(msg, bootstrap_by_role, text=None, read_attachment=None):
+    """
+    Parse the CSV attachment of a sync point message. Returns False if the attachment is missing or wrong.
+    Since V0.8, the message text summarizes the attachment. A wrong size is caught before the attachment is
+    downloaded, and a wrong checksum before it is parsed. Older sync points are only checked by parsing them.
+    'read_attachment' downloads the attachment of a message. By default it is not cached.
+    """
+    if not msg.attachments:
+        print('Internal error - found a syncpoint without attachment. Continue trolling...')
+        return False
+    product_att = msg.attachments[0]
+    print('Found attachment: ' + product_att.filename)
+    if product_att.filename != PRODUCT_CSV_FILE_NAME:
+        print('Internal error - wrong inventory file found. Continue trolling...')
+        return False
+
+    summary = decode_sync_point_summary(text or msg.content)
+    if summary is not None and product_att.size != summary.size:
+        print('Internal error - sync point attachment has {0} bytes instead of {1}. Continue trolling...'.format(
+            product_att.size, summary.size))
+        return False
+
+    csv_bytes = await (read_attachment(msg) if read_attachment else product_att.read())
+    if summary is not None and hashlib.sha256(csv_bytes).hexdigest() != summary.sha256:
+        print('Internal error - sync point attachment checksum does not match. Continue trolling...')
+        return False
+
+    sync_point_dfs = [(bootstrap, bootstrap.sync_point_df) for bootstrap in bootstrap_by_role.values()]
+    try:
+        csv_text = str(csv_bytes, 'utf-8')
+        # The tables are followed by the version of the bot that wrote them. A truncated attachment has no version.
+        tables = csv_text.split('\n\n')
+        tables, version = tables[:-1], _decode_sync_point_csv_version(tables[-1])
+        # Before V0.4, there were only makers and collectors tables.
+        table_count = 2 if version < (0, 4) else len(USER_ROLES_IN_ORDER)
+        if len(tables) < table_count:
+            raise ValueError('{0} tables instead of {1}'.format(len(tables), table_count))
+        for role_name, table in zip(USER_ROLES_IN_ORDER, tables):
+            print("  parsing csv table for: ", role_name)
+            bootstrap_by_role[role_name].read_sync_point_csv(table)
+    except ValueError as error:
+        # Also pandas' ParserError and UnicodeDecodeError. E.g. a truncated attachment of a sync point before V0.8.
+        print('Internal error - cannot parse sync point attachment: {0!r}. Continue trolling...'.format(error))
+        for bootstrap, sync_point_df in sync_point_dfs:
+            bootstrap.sync_point_df = sync_point_df
+        return False
+
+    if summary is not None:
+        row_counts = tuple(len(bootstrap_by_role[role_name].sync_point_df) for role_name in USER_ROLES_IN_ORDER)
+        if row_counts != summary.row_counts:
+            print('Internal error - sync point tables have {0} rows instead of {1}. Continue trolling...'.format(
+                row_counts, summary.row_counts))
+            for bootstrap, sync_point_df in sync_point_dfs:
+                bootstrap.sync_point_df = sync_point_df
+            return False
+    return True
+
+def _decode_sync_point_csv_version(text):
+    """The version at the end of a sync point CSV, e.g. "version\\n'0.8'\\n", as a tuple of ints"""
+    words = text.split()
+    if len(words) != 2 or words[0] != 'version':
+        raise ValueError('no version at the end of the sync point CSV')
+    return tuple(int(n) for n in words[1].strip("'").split('.'))
+
+def _rebuild_inventory_dfs(bootstrap_by_role, verbose=False):
+    """Build the inventory dataframe of each role from its sync point and updates. Run it with _run_in_worker()."""
     for role_name, bootstrap in bootstrap_by_role.items():
-        print('sync point: ', role_name)
-        print(bootstrap.sync_point_df.to_string(index=False))
-        print('building inventory df from sync point and updates: ', role_name)
+        if verbose:
+            print('sync point: ', role_name)
+            print(bootstrap.sync_point_df.to_string(index=False))
+            print('building inventory df from sync point and updates: ', role_name)
         bootstrap.rebuild_inventory_df_from_sync_n_updates()
 
+async def _install_rebuilt_inventory(inventory, bootstrap_by_role):
+    # The bootstraps belong to this replay alone, so a worker can build their dataframes while commands run
+    await _run_in_worker(_rebuild_inventory_dfs, bootstrap_by_role, True)
+
     for role_name in USER_ROLES_IN_ORDER:
         # Make sure to add them in the right order so we can do simply do iteration when order is important.
-        INVENTORY_BY_USER_ROLE[role_name] = bootstrap_by_role[role_name].inventory_df
+        inventory.store.replace_frame(role_name, bootstrap_by_role[role_name].inventory_df)
+    inventory.store.commit(inventory.last_message_id)
+    inventory.digest.set_totals(inventory.store.get_totals())
+
+async def _apply_trans_log_message_to_inventory(inventory, msg):
+    if inventory.last_message_id is not None and msg.id <= inventory.last_message_id:
+        return
+    inventory.last_message_id = msg.id
 
-    return updates_since_sync_point
+    text = _get_trans_log_text(msg)
+    if text is None:
+        return
+
+    if _is_sync_point_text(text):
+        # The writer posted a sync point, e.g. after an 'import'. Reload the inventory from it.
+        bootstrap_by_role = _make_role_bootstraps()
+        if await _read_sync_point_into_bootstraps(msg, bootstrap_by_role, text):
+            print("{} {:80} sync point reloaded by hot standby".format(msg.created_at, text))
+            await _install_rebuilt_inventory(inventory, bootstrap_by_role)
+            inventory.logged_item_variants = set()
+        return
+
+    records = _decode_trans_log_records(msg, text)
+    dropbox_table = inventory.engine.tables[USER_ROLE_DROPBOXES]
+    for record in records:
+        print("{} {:80} applied by hot standby".format(msg.created_at, text))
+        previous_count = dropbox_table.get_count(_get_dropbox_key(record)) if record.collector_id else 0
+        inventory.engine.apply_trans_log_record(record, msg.created_at)
+        _index_dropbox_message(inventory.dropbox_messages, msg.id, record, previous_count)
+    inventory.logged_item_variants.update(_get_item_variants(records))
+    inventory.change_feed.append(msg.created_at, msg.id, records)
+    inventory.store.commit(inventory.last_message_id)
+
+async def _index_trans_log_since_sync_point(inventory):
+    """
+    A stored inventory is opened without replaying the log. Collect what replay would have collected from the
+    transaction log since the last sync point, up to the newest message applied to the store: drops that collectors
+    can confirm, and item and variant combinations. The inventory tables are left alone.
+    """
+    ch = inventory.get_inventory_channel()
+    try:
+        await _replay_trans_log(lambda before: ch.history(limit=MSG_HISTORY_TROLLING_LIMIT, before=before),
+                                _make_role_bootstraps(), dropbox_messages=inventory.dropbox_messages,
+                                logged_item_variants=inventory.logged_item_variants,
+                                before=discord.Object(id=inventory.last_message_id + 1))
+    except ReplayError as e:
+        # The stored tables are complete without it. Only reactions to older drops, and catalog checks, miss out.
+        print('---- cannot index the transaction log of guild "{0}": {1}'.format(inventory.guild.name, e))
+
+async def _catch_up_with_trans_log(inventory):
+    """Apply transaction log messages newer than the last one applied. Used by hot standbys taking over."""
+    ch = inventory.get_inventory_channel()
+    after = discord.Object(id=inventory.last_message_id) if inventory.last_message_id else None
+
+    # Messages arriving live while we read history are applied afterwards, in order.
+    inventory.catching_up = True
+    try:
+        async for msg in ch.history(limit=None, after=after, oldest_first=True):
+            await _apply_trans_log_message_to_inventory(inventory, msg)
+        await _apply_pending_trans_log_messages(inventory)
+    finally:
+        inventory.pending_messages = []
+        inventory.catching_up = False
+
+async def _apply_pending_trans_log_messages(inventory):
+    while inventory.pending_messages:
+        await _apply_trans_log_message_to_inventory(inventory, inventory.pending_messages.pop(0))
+
+def _sort_inventory_df(df):
+    """
+    Lexsort the primary-key MultiIndex of an inventory dataframe, if new rows left it out of order. Reads that slice
+    the index call this first. Lookups by user then become index slices instead of full-table masks, and dropping rows
+    no longer raises PerformanceWarning.
+    """
+    if not df.index.is_monotonic_increasing:
+        df.sort_index(inplace=True)
+
+def _upsert_inventory_row(df, key, values):
+    """
+    Insert or update one row of an inventory dataframe in place. A new row is appended at the end, out of order.
+    Lookups by full primary key do not mind. Reads that slice the index sort it first, so that a batch of new rows
+    is only sorted once.
+    """
+    df.loc[key] = values
+
+def _drop_inventory_rows(df, key):
+    """
+    Drop one row by full primary key, or all rows of a user by user id. Dropping by user id slices the index, so it is
+    sorted first. Otherwise the order is left for the next read that slices the index to fix up.
+    """
+    if not isinstance(key, tuple):
+        _sort_inventory_df(df)
+    df.drop(key, inplace=True)
+
+def _get_user_rows(df, user_id):
+    """All rows whose primary key starts with user_id, sliced from the lexsorted index."""
+    _sort_inventory_df(df)
+    return df.loc[user_id:user_id]
+
+def _get_row_count(df, key):
+    """Current count stored under a full primary key, or 0 if there is no such row."""
+    if key in df.index:
+        return df.loc[key, COL_COUNT]
+    return 0
+
+def _df_to_inventory_rows(df):
+    times = df[COL_UPDATE_TIME] if COL_UPDATE_TIME in df else [None] * len(df)
+    return [InventoryRow(key, int(count), update_time) for key, count, update_time in zip(df.index, df[COL_COUNT], times)]
+
+def _inventory_rows_to_df(rows, columns=None):
+    if columns is None:
+        columns = TRANSACTION_DF_COLUMNS if rows and len(rows[0].key) > 3 else PERSONAL_DF_COLUMNS
+    df = pd.DataFrame([list(row.key) + [row.count, row.update_time] for row in rows], columns=columns)
+    return df.set_index(keys=columns[:-2], drop=False)
+
+def _get_user_view_df(inventory, role_name, user_id):
+    """The rows of one user in a role table, as a small dataframe built from the user's view. See DataFrameInventoryTable."""
+    return _inventory_rows_to_df(inventory.engine.get_user_rows(role_name, user_id))
+
+class DataFrameInventoryTable:
+    """
+    One per-role inventory dataframe of a guild, seen as a table of the inventory engine. The dataframe is looked up
+    on every access, because rebuilding the inventory from the transaction log replaces it.
+
+    The rows of a user, and for dropboxes the rows of a collector, are found through an index of row keys by user id.
+    The index is built from the dataframe once, when the table first sees it, and then kept up to date by upsert() and
+    drop(). So showing a user's inventory only touches that user's rows. It is built again when the dataframe is
+    replaced.
+
+    Snapshots are copy on write. A snapshot holds on to the dataframe itself, and the next write copies it first.
+    So taking a snapshot costs nothing, and a writer only pays for one copy after each snapshot.
+    """
+    def __init__(self, inventory_by_user_role, role_name):
+        self.inventory_by_user_role = inventory_by_user_role
+        self.role_name = role_name
+        self._shared_df = None  # The dataframe last handed out to a snapshot. It is never changed in place again.
+        self._indexed_df = None  # The dataframe the indexes below were built from
+        self._user_keys = {}  # maps user id to the set of its row keys
+        self._second_user_keys = {}  # maps second user id to the set of its row keys, for dropboxes
+
+    @property
+    def df(self):
+        df = self.inventory_by_user_role[self.role_name]
+        if df is not self._indexed_df:
+            self._indexed_df = df
+            self._user_keys = _index_keys_by_user(df.index, 0)
+            self._second_user_keys = _index_keys_by_user(df.index, 3) if COL_SECOND_USER_ID in df else {}
+        return df
+
+    def __len__(self):
+        return len(self.df)
+
+    def snapshot(self):
+        """The dataframe as it is now, sorted. Writes from now on go to a copy of it."""
+        _sort_inventory_df(self.df)
+        self._shared_df = self.df
+        return self._shared_df
+
+    def _get_writable_df(self):
+        df = self.df
+        if df is self._shared_df:
+            df = df.copy()
+            self.inventory_by_user_role[self.role_name] = df
+            self._indexed_df = df  # Same rows, so the indexes still hold
+            self._shared_df = None
+        return df
+
+    def rows(self):
+        _sort_inventory_df(self.df)
+        return _df_to_inventory_rows(self.df)
+
+    def has_row(self, key):
+        return key in self.df.index
+
+    def get_count(self, key):
+        return int(_get_row_count(self.df, key))
+
+    def get_user_rows(self, user_id):
+        df = self.df
+        return _get_indexed_rows(df, self._user_keys, user_id)
+
+    def get_second_user_rows(self, second_user_id):
+        df = self.df
+        return _get_indexed_rows(df, self._second_user_keys, second_user_id)
+
+    def upsert(self, key, count, update_time):
+        _upsert_inventory_row(self._get_writable_df(), key, list(key) + [count, update_time])
+        for keys_by_user, user_id in self._get_index_entries(key):
+            keys_by_user.setdefault(user_id, set()).add(key)
+
+    def drop(self, key):
+        _drop_inventory_rows(self._get_writable_df(), key)
+        for keys_by_user, user_id in self._get_index_entries(key):
+            _discard_indexed_key(keys_by_user, user_id, key)
+
+    def drop_user(self, user_id):
+        df = self.df
+        keys = self._user_keys.pop(user_id, None)
+        if keys:
+            df = self._get_writable_df()
+            df.drop(sorted(keys), inplace=True)
+            for key in keys:
+                if len(key) > 3:
+                    _discard_indexed_key(self._second_user_keys, key[3], key)
+
+    def _get_index_entries(self, key):
+        """The indexes that a row key is in, each with the user id it is indexed by"""
+        entries = [(self._user_keys, key[0])]
+        if len(key) > 3:
+            entries.append((self._second_user_keys, key[3]))
+        return entries
+
+def _index_keys_by_user(keys, level):
+    """maps the user ids at one level of some row keys to the set of the keys"""
+    keys_by_user = {}
+    for key in keys:
+        keys_by_user.setdefault(key[level], set()).add(key)
+    return keys_by_user
+
+def _get_indexed_rows(df, keys_by_user, user_id):
+    keys = keys_by_user.get(user_id)
+    if not keys:
+        return []
+    return _df_to_inventory_rows(df.loc[sorted(keys)])
+
+def _discard_indexed_key(keys_by_user, user_id, key):
+    keys = keys_by_user.get(user_id)
+    if keys is not None:
+        keys.discard(key)
+        if not keys:
+            del keys_by_user[user_id]
+
+def _get_frame_totals(inventory_by_user_role):
+    """maps each role to the total count of each (item, variant) in its dataframe"""
+    totals = OrderedDict()
+    for role_name, df in inventory_by_user_role.items():
+        sums = df[COL_COUNT].groupby([df[COL_ITEM].values, df[COL_VARIANT].values]).sum()
+        totals[role_name] = dict(sums.items())
+    return totals
+
+class DataFrameInventoryStore:
+    """
+    Inventory tables of a guild kept in memory, as one pandas dataframe per role. This is the default store.
+    Nothing is kept on the bot host. On restart, the tables are rebuilt from the transaction log.
+    """
+    last_message_id = None  # Nothing survives a restart
+
+    def __init__(self):
+        self.inventory_by_user_role = OrderedDict()
+        self.tables = OrderedDict([(role_name, DataFrameInventoryTable(self.inventory_by_user_role, role_name))
+            for role_name in USER_ROLES_IN_ORDER])
+
+    def get_frames(self):
+        return self.inventory_by_user_role
+
+    def replace_frame(self, role_name, df):
+        self.inventory_by_user_role[role_name] = df
+
+    def get_totals(self):
+        return _get_frame_totals(self.inventory_by_user_role)
+
+    def get_snapshot(self):
+        """
+        One consistent version of all dataframes, for a report or a worker thread to read while commands keep
+        changing the inventory. Nothing is copied until a command writes to a table. See DataFrameInventoryTable.
+        Totals are None. The reader adds them up from the snapshot.
+        """
+        frames = OrderedDict((role_name, table.snapshot()) for role_name, table in self.tables.items())
+        return frames, None
+
+    def get_memory_usage(self):
+        """maps each role to the bytes held by its dataframe (deep, with index) and by its indexes by user id"""
+        usage = OrderedDict()
+        for role_name, table in self.tables.items():
+            df = self.inventory_by_user_role.get(role_name)
+            frame_size = int(df.memory_usage(index=True, deep=True).sum()) if df is not None else 0
+            usage[role_name] = frame_size + get_deep_size((table._user_keys, table._second_user_keys))
+        return usage
+
+    def commit(self, last_message_id):
+        pass
+
+class SqliteFrameStore(SqliteInventoryStore):
+    """
+    Inventory tables of a guild kept in a local SQLite file. See sqlite_store.py.
+    Code that works on whole dataframes, such as sync points and report breakdowns, gets them read from the file.
+    """
+    def get_frames(self):
+        return OrderedDict([(role_name, _inventory_rows_to_df(table.rows(), BOOTSTRAP_CLASS_BY_USER_ROLE[role_name].df_columns))
+            for role_name, table in self.tables.items()])
+
+    def replace_frame(self, role_name, df):
+        self.tables[role_name].replace_rows(_df_to_inventory_rows(df))
+
+    def get_totals(self):
+        return OrderedDict([(role_name, table.get_totals()) for role_name, table in self.tables.items()])
+
+    def get_snapshot(self):
+        """Dataframes read from the file, and totals added up by SQLite. The connection is only used by the event loop."""
+        return self.get_frames(), self.get_totals()
+
+    def get_memory_usage(self):
+        """The tables are on disk. See file_name."""
+        return OrderedDict([(role_name, None) for role_name in self.tables])
+
+def _make_inventory_store(guild_id):
+    if STORAGE_BACKEND == 'sqlite':
+        return SqliteFrameStore(os.path.join(STORAGE_DIR, 'count_bot_inventory_{0}.sqlite3'.format(guild_id)))
+    return DataFrameInventoryStore()
 
 def _add_human_interval_col(df):
     new_col = df.apply(lambda row: my_naturaltime(row[COL_UPDATE_TIME]), axis=1)
@@ -564,104 +1429,114 @@ def _add_human_interval_col(df):
 
 async def _send_df_as_msg_to_user(ctx, df, prefix=''):
     if not len(df):
-        await ctx.send(prefix + "```(no inventory records)```")
+        _reply(ctx, prefix + "```(no inventory records)```")
     else:
         result = _add_human_interval_col(df)
         result = result.loc[:, [COL_COUNT, COL_ITEM, COL_VARIANT, COL_HUMAN_INTERVAL]]
-        result = result.sort_index(axis='index')
-        await ctx.send(prefix + "```{0}```".format(result.to_string(index=False)))
+        _reply(ctx, prefix + "```{0}```".format(result.to_string(index=False)))
 
 async def _send_dropbox_df_as_msg_to_maker(ctx, df, prefix=''):
     if not len(df):
-        await ctx.send(prefix + "```(no dropbox records)```")
+        _reply(ctx, prefix + "```(no dropbox records)```")
     else:
         dropped = df.drop(columns=COL_USER_ID)
-        mapped = await _map_user_id_column_to_display_names(dropped)
+        mapped = await _map_user_id_column_to_display_names(_get_guild_inventory(ctx).guild, dropped)
         renamed = mapped.rename(columns={COL_SECOND_USER_ID: COL_COLLECTOR_NAME})
         result = _add_human_interval_col(renamed)
         result = result.loc[:, [COL_COLLECTOR_NAME, COL_ITEM, COL_VARIANT, COL_COUNT, COL_HUMAN_INTERVAL]]
-        result = result.sort_index(axis='index')
-        await ctx.send(prefix + "```{0}```".format(result.to_string(index=False)))
+        _reply(ctx, prefix + "```{0}```".format(result.to_string(index=False)))
 
 async def _send_dropbox_df_as_msg_to_collector(ctx, df, prefix=''):
     if not len(df):
-        await ctx.send(prefix + "```(your dropbox is empty)```")
+        _reply(ctx, prefix + "```(your dropbox is empty)```")
     else:
         dropped = df.drop(columns=COL_SECOND_USER_ID)
-        mapped = await _map_user_id_column_to_display_names(dropped)
+        mapped = await _map_user_id_column_to_display_names(_get_guild_inventory(ctx).guild, dropped)
         renamed = mapped.rename(columns={COL_USER_ID: COL_MAKER_NAME})
         result = _add_human_interval_col(renamed)
         result = result.loc[:, [COL_MAKER_NAME, COL_ITEM, COL_VARIANT, COL_COUNT, COL_HUMAN_INTERVAL]]
-        result = result.sort_index(axis='index')
-        await ctx.send(prefix + "```{0}```".format(result.to_string(index=False)))
+        _reply(ctx, prefix + "```{0}```".format(result.to_string(index=False)))
+
+async def _send_inventory_error(ctx, error):
+    """Tell the user why the inventory engine turned down a command. Negative counts abort the command."""
+    _reply(ctx, error.message)
+    if error.rows is not None:
+        await _send_df_as_msg_to_user(ctx, _inventory_rows_to_df(error.rows))
+    if error.show_help:
+        await ctx.send_help(ctx.command)
+    if isinstance(error, NegativeCountError):
+        raise NegativeCount()
 
 async def _resolve_item_name(ctx, item):
-    item_name = ALIAS_MAPS.get(item.lower())
-    if not item_name:
-        await ctx.send("❌  Item '{0}' is not something I know about. See help.".format(item))
-        await ctx.send_help(ctx.command)
+    try:
+        return resolve_item_name(item)
+    except InventoryError as error:
+        await _send_inventory_error(ctx, error)
         return None
-    if item_name not in ITEM_CHOICES:
-        await ctx.send("❌  '{0}' is not valid item. See help.".format(item_name))
-        await ctx.send_help(ctx.command)
-        return None
-    return item_name
 
 async def _resolve_variant_name(ctx, item, variant):
-    variant_name = ALIAS_MAPS.get(variant.lower())
-    if not variant_name:
-        await ctx.send("❌  Variant '{0}' is not something I know about. See help.".format(variant))
-        await ctx.send_help(ctx.command)
+    try:
+        return resolve_variant_name(item, variant)
+    except InventoryError as error:
+        await _send_inventory_error(ctx, error)
         return None
-    variants = VARIANT_CHOICES.get(item)
-    if variant_name not in variants:
-        await ctx.send("❌  '{0}' is not valid variant of item '{1}'. See help.".format(variant_name, item))
-        await ctx.send_help(ctx.command)
-        return None
-    return variant_name
 
-async def _post_user_record_to_trans_log(ctx, command_text, detail_text):
+async def _post_user_record_to_trans_log(ctx, command_text, detail_text, member=None):
     """
     All valid transactions must begin with '✅ '.
     Do not post transaction messages without calling this function.
+    The record is attributed to 'member', by default the author of the command. A discord.Object stands for a user
+    who has left the guild, e.g. the maker of a dropbox entry that a collector confirms.
+    Returns the message posted to the inventory channel, or None if it was only posted in DM for debugging.
     """
+    member = member or ctx.message.author
 
     # Only members of associated guilds can post transactions.
     # This is the last line of defense against random users DM'ins the bot to cause DoS attacks.
     # The function will raise exception of user is not in the guild.
-    await _map_dm_user_to_member(ctx.message.author)
+    inventory = _get_guild_inventory(ctx)
+    if isinstance(member, discord.Object):
+        await _map_dm_user_to_member(inventory.guild, ctx.message.author)
+        mention = '<@{0}>'.format(member.id)
+    else:
+        await _map_dm_user_to_member(inventory.guild, member)
+        mention = member.mention
 
-    trans_text = '{0}: {1} {2}'.format(ctx.message.author.mention, command_text, detail_text)
+    trans_text = '{0}: {1} {2}'.format(mention, command_text, detail_text)
 
     if ctx.message.channel.type == discord.ChannelType.private:
-        await ctx.send("Command processed. Transaction posted to channel '{0}'.".format(INVENTORY_CHANNEL))
+        _reply(ctx, "Command processed. Transaction posted to channel '{0}'.".format(
+            inventory.config.inventory_channel))
         # If private DM channel, also post to inventory channel
-        ch = _get_inventory_channel()
+        ch = inventory.get_inventory_channel()
         if DEBUG_DISABLE_INVENTORY_POSTS_FROM_DM:
-            await ctx.send('DEBUG: record in DM: ✅ ' + trans_text)
-        else:
-            await ch.send('✅ ' + trans_text + ' (from DM chat)')
+            await OUTBOX.post_durable(ctx, 'DEBUG: record in DM: ✅ ' + trans_text)
+            return None
+        message = await OUTBOX.post_durable(ch, '✅ ' + trans_text + ' (from DM chat)')
     else:
-        await ctx.send('✅ ' + trans_text)
+        message = await OUTBOX.post_durable(ctx, '✅ ' + trans_text)
+    inventory.last_message_id = message.id
+    records = _decode_trans_log_records(message, _get_trans_log_text(message))
+    inventory.logged_item_variants.update(_get_item_variants(records))
+    inventory.change_feed.append(message.created_at, message.id, records)
+    return message
 
 async def show_maker_inventory_and_dropbox(ctx):
     maker_id = ctx.message.author.id
-    maker_df = INVENTORY_BY_USER_ROLE[USER_ROLE_MAKERS]
-    maker_cond = maker_df[COL_USER_ID] == maker_id
+    inventory = _get_guild_inventory(ctx)
+    maker_df = _get_user_view_df(inventory, USER_ROLE_MAKERS, maker_id)
 
-    await _send_df_as_msg_to_user(ctx, maker_df[maker_cond], prefix="Your maker inventory:")
+    await _send_df_as_msg_to_user(ctx, maker_df, prefix="Your maker inventory:")
 
-    dropbox_df = INVENTORY_BY_USER_ROLE[USER_ROLE_DROPBOXES]
-    dropbox_cond = dropbox_df[COL_USER_ID] == maker_id
-    dropbox_found_num = sum(dropbox_cond)
+    dropbox_df = _get_user_view_df(inventory, USER_ROLE_DROPBOXES, maker_id)
 
-    if dropbox_found_num:
-        await _send_dropbox_df_as_msg_to_maker(ctx, dropbox_df[dropbox_cond], prefix="Items you dropped off:")
+    if len(dropbox_df):
+        await _send_dropbox_df_as_msg_to_maker(ctx, dropbox_df, prefix="Items you dropped off:")
 
 @bot.command(
     brief="Update the current count of items from a maker",
     description='Update the current {total} count of an {item} of {variant} type from a maker:')
-async def count(ctx, total: int = None, item: str = None, variant: str = None):
+async def count(ctx, total: str = None, item: str = None, variant: str = None, *more: str):
     """
 Item and variant choices are shown below. Words are case-insensitive. \
 You can also use aliases such as 'ver', 'verk', 'pru', 'pet' \
@@ -675,6 +1550,7 @@ earsaver
 count - shortcut to print out items under your possession.'.
 count 20 - shortcut to update a single item you make, to a total count of 20.
 count 20 prusa - shortcut to update a single variant of prusa shield you make.
+count 12 ver pla, 30 pru pet, 5 ear - update several counts at once.
 """
 
     # The help doc is too long.... Once I figure out how to show collapsible text, resurrect these:
@@ -697,7 +1573,11 @@ count 20 prusa - shortcut to update a single variant of prusa shield you make.
     # If you only print one variant of an item in the system, you can update its current count without re-specifying \
     # the variant type.
 
-    print('Command: count {0} {1} {2} ({3})'.format(total, item, variant, ctx.message.author.display_name))
+    print('Command: count {0} {1} {2} {3} ({4})'.format(total, item, variant, more, ctx.message.author.display_name))
+    count_list, total = _parse_count_args(total, item, variant, more)
+    if count_list:
+        await _count_many(ctx, count_list)
+        return
     await _count(ctx, total, item, variant)
 
 async def _count(ctx, total: int = None, item: str = None, variant: str = None, delta: bool = False,
@@ -716,123 +1596,90 @@ async def _count(ctx, total: int = None, item: str = None, variant: str = None,
         await show_maker_inventory_and_dropbox(ctx)
         return
 
-    df = INVENTORY_BY_USER_ROLE[role]
-
+    inventory = _get_guild_inventory(ctx)
     user_id = ctx.message.author.id
-    cond = df[COL_USER_ID] == user_id
-    found_num = sum(cond)
 
     if total is None:
         # "count" without argument with existing inventory.
-
-        if not found_num:
-            await ctx.send('You have not recorded any item types yet.')
+        user_df = _get_user_view_df(inventory, role, user_id)
+        if not len(user_df):
+            _reply(ctx, 'You have not recorded any item types yet.')
             await ctx.send_help(ctx.command)
             return
 
-        result = df[cond]
-        await _send_df_as_msg_to_user(ctx, result)
+        await _send_df_as_msg_to_user(ctx, user_df)
         return
 
-    elif not item or not variant:
-        # Note that if item is None, then variant must also be None
+    try:
+        plan = inventory.engine.plan_count(role, user_id, total, item, variant, delta=delta)
+    except InventoryError as error:
+        await _send_inventory_error(ctx, error)
+        return
 
-        # The user is updating count without fully specifying both item and variant args.
-        # Either variant is not provided, or both item and variant are not provided.
-        # Do a search to see if it is possible to narrow down recorded items to just one item.
+    if trial_run_only:
+        return plan.total, plan.item, plan.variant
 
-        if not item:
-            # Aka, Only count is specified.
+    await _commit_count_plan(ctx, plan, ctx.message.author, display_result=display_result)
 
-            if not found_num:
-                await ctx.send('❌  You have not recorded any item types yet. Cannot update count without a specific item.')
-                await ctx.send_help(ctx.command)
-                return
+async def _commit_count_plan(ctx, plan, member, display_result=True):
+    """Post the transaction record of a count plan made by the inventory engine, then apply it to the inventory."""
+    txt = '{0} {1} {2}'.format(plan.total, plan.item, plan.variant)
+    await _post_user_record_to_trans_log(
+        ctx, 'count' if plan.role_name == USER_ROLE_MAKERS else 'collect count', txt, member=member)
 
-            elif found_num > 1:
-                await ctx.send("❌  Found more than one type of item. Please be more specific with item type. "
-                    "Or use 'reset' to remove item types. See help.")
-                await _send_df_as_msg_to_user(ctx, df[cond])
-                await ctx.send_help(ctx.command)
-                return
+    # Only update memory DF after we have persisted the message to the inventory channel.
+    # Think of the inventory channel as "disk", the permanent store.
+    # If the bot crashes right here, it can always restore its previous state by trolling through the inventory
+    # channel and all DM rooms, to find user commands it has not successfully processed.
+    inventory = _get_guild_inventory(ctx)
+    inventory.engine.apply_count(plan, datetime.utcnow())
+    msg_prefix = "previous count: {0}  delta: {1}".format(plan.previous_count, plan.total - plan.previous_count)
+    if display_result:
+        await _send_df_as_msg_to_user(ctx, _get_user_view_df(inventory, plan.role_name, plan.user_id), prefix=msg_prefix)
+    else:
+        _reply(ctx, msg_prefix)
 
-            # Fall through on purpose, to update count
-            pass
+def _parse_count_args(total, item, variant, more):
+    """
+    Arguments of 'count' and 'collect count'. Several counts separated by commas, such as '12 ver pla, 30 pru petg',
+    are split up into separate args, and the comma may stick to the total, as in '12, 5 ear'. These are joined back
+    into one count list. Returns (count list or None, total as an int or None).
+    """
+    text = ' '.join(str(arg) for arg in (total, item, variant) + more if arg is not None)
+    if ',' in text:
+        return text, None
+    if total is None:
+        return None, None
+    try:
+        return None, int(total)
+    except ValueError:
+        raise commands.errors.BadArgument('"{0}" is not a count'.format(total))
 
-        else:
-            # Aka, Count and item are specified, Variant is not specified.
-            item = await _resolve_item_name(ctx, item)
-            if not item:
-                return
-
-            # Change condition to add the item as a filter
-            cond = (df[COL_USER_ID] == user_id) & (df[COL_ITEM] == item)
-            found_num = sum(cond)
-
-            # Some items have no variants
-            supported_variants = VARIANT_CHOICES.get(item)
-            if supported_variants == [" "]:
-                variant = " "
-
-            elif found_num == 0:
-                await ctx.send("❌  You have no recorded variant of type '{0}'. Please specify a variant.".format(item))
-                await _send_df_as_msg_to_user(ctx, df[cond])
-                await ctx.send_help(ctx.command)
-                return
-
-            elif found_num > 1:
-                await ctx.send("❌  Found more than one variant of item. Please be more specific with variant name. "
-                    "Or use 'reset' to remove item types. See help.")
-                await _send_df_as_msg_to_user(ctx, df[cond])
-                await ctx.send_help(ctx.command)
-                return
-
-        if found_num == 1:
-            # There is only one row in the record. Retrieve item and variant names from the single record.
-            row = df[cond]
-            item = row[COL_ITEM][0]
-            variant = row[COL_VARIANT][0]
-
-    item = await _resolve_item_name(ctx, item)
-    if not item:
-        return
+async def _count_many(ctx, count_list, role=USER_ROLE_MAKERS):
+    """
+    Several counts in one command. All of them are validated first. They are then recorded as one transaction
+    log message, and answered with one reply.
+    """
+    inventory = _get_guild_inventory(ctx)
+    user_id = ctx.message.author.id
 
-    variant = await _resolve_variant_name(ctx, item, variant)
-    if not variant:
+    try:
+        plans = inventory.engine.plan_counts(role, user_id, parse_count_list(count_list))
+    except InventoryError as error:
+        await _send_inventory_error(ctx, error)
         return
 
-    current_count = 0
-    cond = (df[COL_USER_ID] == user_id) & (df[COL_ITEM] == item) & (df[COL_VARIANT] == variant)
-    rows = df[cond]
-    if len(rows) == 1:
-        row = rows.iloc[0]
-        current_count = row[COL_COUNT]
-
-    if delta:
-        # this is not an update of current count, but a delta addition to current count.
-            total += current_count
-
-    if total < 0:
-        await ctx.send("❌  This results in a negative count of '{0}'. Current '{1}' count is {2}.".format(
-            total, role, current_count))
-        raise NegativeCount()
-
-    if trial_run_only:
-        return total, item, variant
-
-    txt = '{0} {1} {2}'.format(total, item, variant)
+    txt = ', '.join('{0} {1} {2}'.format(plan.total, plan.item, plan.variant).rstrip() for plan in plans)
     await _post_user_record_to_trans_log(ctx, 'count' if role == USER_ROLE_MAKERS else 'collect count', txt)
 
     # Only update memory DF after we have persisted the message to the inventory channel.
-    # Think of the inventory channel as "disk", the permanent store.
-    # If the bot crashes right here, it can always restore its previous state by trolling through the inventory
-    # channel and all DM rooms, to find user commands it has not successfully processed.
-    df.loc[(user_id, item, variant)] = [user_id, item, variant, total, datetime.utcnow()]
-    msg_prefix = "previous count: {0}  delta: {1}".format(current_count, total - current_count)
-    if display_result:
-        await _send_df_as_msg_to_user(ctx, df[(df[COL_USER_ID] == user_id)], prefix=msg_prefix)
-    else:
-        await ctx.send(msg_prefix)
+    update_time = datetime.utcnow()
+    for plan in plans:
+        inventory.engine.apply_count(plan, update_time)
+
+    msg_prefix = '\n'.join("{0} {1}  previous count: {2}  delta: {3}".format(
+        plan.item, plan.variant, plan.previous_count, plan.total - plan.previous_count) for plan in plans)
+    await _send_df_as_msg_to_user(ctx, _get_user_view_df(inventory, role, user_id), prefix=msg_prefix)
 
 @bot.command(
     brief="Same as 'count 0'")
@@ -887,115 +1734,72 @@ async def _remove(ctx, item: str = None, variant: str = None, role=USER_ROLE_MAK
     Many user commands get translated into this basic command record to perform actual changes to the inventory.
     """
 
-    df = INVENTORY_BY_USER_ROLE[role]
-
+    inventory = _get_guild_inventory(ctx)
     user_id = ctx.message.author.id
-    cond = df[COL_USER_ID] == user_id
-    found_num = sum(cond)
-
-    if not found_num:
-        await ctx.send('❌  You have not recorded any item types. There is nothing to remove.')
-        return
-
-    if item == 'all':
-        await _post_user_record_to_trans_log(ctx, 'remove' if role == USER_ROLE_MAKERS else 'collect remove', 'all')
-
-        # Only update memory DF after we have persisted the message to the inventory channel.
-        df.drop(user_id, inplace=True)
-        await ctx.send('All your records have been removed')
-        return
-
-    if not item and not variant:
-        if found_num == 1:
-            # There is only one row in the record. Retrieve item and variant names from the single record.
-            row = df[cond]
-            item = row[COL_ITEM][0]
-            variant = row[COL_VARIANT][0]
-            # Fall through to normal code which updates the count
-        else:
-            await ctx.send("❌  Found more than one types of items. Please be more specific. See help.")
-            await _send_df_as_msg_to_user(ctx, df[cond])
-            await ctx.send_help(ctx.command)
-            return
-
-    if item and not variant:
-        # Variant is not specified.
-        item = await _resolve_item_name(ctx, item)
-        if not item:
-            return
-
-        cond = (df[COL_USER_ID] == user_id) & (df[COL_ITEM] == item)
-        found_num = sum(cond)
-
-        if found_num == 1:
-            # There is only one row in the record. Retrieve item and variant names from the single record.
-            row = df[cond]
-            variant = row[COL_VARIANT][0]
-            # Fall through to normal code which updates the count
-        elif found_num > 1:
-            await ctx.send("❌  Found more than one variant of item '{0}'. "
-                "Please be more specific. See help.".format(item))
-            await _send_df_as_msg_to_user(ctx, df[cond])
-            await ctx.send_help(ctx.command)
-            return
-        else:
-            await ctx.send("❌  You have no more items of this type to remove.")
-            return
-
-    item = await _resolve_item_name(ctx, item)
-    if not item:
-        return
-
-    variant = await _resolve_variant_name(ctx, item, variant)
-    if not variant:
-        return
 
-    cond = (df[COL_USER_ID] == user_id) & (df[COL_ITEM] == item) & (df[COL_VARIANT] == variant)
-    rows = df[cond]
-    if len(rows) == 0:
-        await ctx.send("❌  You have no more items of this type to remove.")
-        return
-    elif len(rows) != 1:
-        txt = '❌  Internal error - got more than one row - this is not expected. Abort.'
-        print(txt)
-        await ctx.send(txt)
+    try:
+        plan = inventory.engine.plan_remove(role, user_id, item, variant)
+    except InventoryError as error:
+        await _send_inventory_error(ctx, error)
         return
 
-    txt = '{0} {1}'.format(item, variant)
+    txt = 'all' if plan.item is None else '{0} {1}'.format(plan.item, plan.variant)
     await _post_user_record_to_trans_log(ctx, 'remove' if role == USER_ROLE_MAKERS else 'collect remove', txt)
 
     # Only update memory DF after we have persisted the message to the inventory channel.
-    df.drop((user_id, item, variant), inplace=True)
-    await _send_df_as_msg_to_user(ctx, df[(df[COL_USER_ID] == user_id)])
+    inventory.engine.apply_remove(plan)
+    if plan.item is None:
+        _reply(ctx, 'All your records have been removed')
+    else:
+        await _send_df_as_msg_to_user(ctx, _get_user_view_df(inventory, role, user_id))
 
-def _get_first_guild():
-    # This bot can't be run in more than one guild (server), otherwise it gets really screwed up.
-    if len(bot.guilds) > 1:
-        raise RuntimeError('This bot can server only one server/guild. Found "{0}"'.format(len(bot.guilds)))
-    return bot.guilds[0]
+def _get_guild_inventory(ctx, writer_only=True):
+    """
+    Find the inventory of the guild a command is issued for. Commands in an inventory channel belong to its guild.
+    Commands in a DM channel belong to the one guild served by this bot that the user is a member of.
+    The result is remembered in the context, so that it survives 'sudo', 'drop', etc. swapping the message author.
+    Unless writer_only is False, hot standby processes bail out with NotWriterError. The writer handles the command.
+    """
+    inventory = getattr(ctx, 'guild_inventory', None)
+    if inventory:
+        return inventory
 
-async def _map_dm_user_to_member(user):
+    if ctx.guild:
+        inventory = GUILD_INVENTORIES.get(ctx.guild.id)
+    else:
+        user_id = ctx.message.author.id
+        candidates = [inv for inv in GUILD_INVENTORIES.values() if inv.guild.get_member(user_id)]
+        if len(candidates) > 1:
+            raise AmbiguousGuildError()
+        inventory = candidates[0] if candidates else None
+
+    if inventory is None:
+        raise RuntimeError('User "{0}" not a member of any guild served by this bot'.format(ctx.message.author))
+    if writer_only and not inventory.is_writer:
+        # Another process is the writer for this guild. It takes care of this command.
+        raise NotWriterError()
+    ctx.guild_inventory = inventory
+    return inventory
+
+async def _map_dm_user_to_member(guild, user):
     # If a 'user' comes from a DM channel, it has a "User" class, not associated to any guild nor roles.
     # Otherwise, user is of "Member" class, with a list of associated roles.
-    if isinstance(user, discord.Member):
+    if isinstance(user, discord.Member) and user.guild.id == guild.id:
         return user
 
-    if isinstance(user, discord.User):
-        guild = _get_first_guild()
+    if isinstance(user, (discord.User, discord.Member)):
         member = guild.get_member(user.id)
         if member:
             return member
-        raise RuntimeError('User "{0}" not a member of my associated guild'.format(user))
+        raise RuntimeError('User "{0}" not a member of guild "{1}"'.format(user, guild.name))
 
     raise RuntimeError('Unexpected type for "{0}"'.format(user))
 
-async def _map_dm_user_ids_to_members(user_ids):
-    guild = _get_first_guild()
+async def _map_dm_user_ids_to_members(guild, user_ids):
     return {user_id: guild.get_member(user_id) for user_id in set(user_ids)}
 
-async def _map_user_ids_to_display_names(ids, pad_for_print=True):
+async def _map_user_ids_to_display_names(guild, ids, pad_for_print=True):
     # If a user id isn't found to be associated to this guild, it will not be included in the returned map.
-    guild = _get_first_guild()
     mapped = {}
     for the_id in ids:
         member = guild.get_member(the_id)
@@ -1004,33 +1808,32 @@ async def _map_user_ids_to_display_names(ids, pad_for_print=True):
                 if pad_for_print else member.display_name
     return mapped
 
-async def _map_user_id_column_to_display_names(df):
+async def _get_display_names(guild, dfs, pad_for_print=True):
+    """maps the user ids found in some dataframes to display names. Looked up on the event loop, for a worker to use."""
     ids = set()
-    for user_col_name in USER_ID_COLUMNS:
-        if user_col_name in df:
-            ids = ids.union(df[user_col_name].unique().tolist())
-    mapped = await _map_user_ids_to_display_names(ids)
+    for df in dfs:
+        for user_col_name in USER_ID_COLUMNS:
+            if user_col_name in df:
+                ids = ids.union(df[user_col_name].unique().tolist())
+    return await _map_user_ids_to_display_names(guild, ids, pad_for_print)
+
+async def _map_user_id_column_to_display_names(guild, df):
+    mapped = await _get_display_names(guild, [df])
     return df.replace(mapped)
 
-async def _add_user_display_name_columns(df):
+def _add_user_display_name_columns(df, mapped):
     columns = {}
-    ids = set()
     for user_col_name in USER_ID_COLUMNS:
         if user_col_name in df:
             columns[USER_ID_TO_NAME_MAP[user_col_name]] = ''
-            ids = ids.union(df[user_col_name].unique().tolist())
-    mapped = await _map_user_ids_to_display_names(ids)
-
     if len(df) == 0:
         return df.assign(**columns)
 
-    mapped = await _map_user_ids_to_display_names(ids, pad_for_print=False)
     new_columns = {}
     for user_col_name in USER_ID_COLUMNS:
         if user_col_name in df:
             name_column = USER_ID_TO_NAME_MAP[user_col_name]
-            new_column = df.apply(lambda row: mapped[row[user_col_name]], axis=1)
-            new_columns[name_column] = new_column.values
+            new_columns[name_column] = [mapped[user_id] for user_id in df[user_col_name]]
 
     print(new_columns)
 
@@ -1049,84 +1852,182 @@ You can open this in Excel to look at tables.
 """
     print('Command: excel ({0})'.format(ctx.message.author.display_name))
 
-    file = await _generate_inventory_csv_file()
-    await ctx.message.author.send("Inventory report in Excel-compatible CSV format:", file=file)
+    file = await _generate_inventory_csv_file(_get_guild_inventory(ctx))
+    _reply(ctx.message.author, "Inventory report in Excel-compatible CSV format:", file=file)
 
     if ctx.message.channel.type != discord.ChannelType.private:
-        await ctx.send('CSV file sent to your DM channel.')
+        _reply(ctx, 'CSV file sent to your DM channel.')
+
+IMPORT_CSV_COLUMNS = [COL_USER_NAME, COL_ITEM, COL_VARIANT, COL_COUNT]
+IMPORT_MAX_ERRORS_SHOWN = CONFIG.import_max_errors_shown
+
+def _validate_import_df(guild, import_df):
+    """
+    Validate all rows of an imported CSV table in one pass. User names (or user ids) are mapped to guild members,
+    item and variant aliases to full names. Returns (maker inventory rows to import, list of errors).
+    """
+    missing = [col for col in IMPORT_CSV_COLUMNS if col not in import_df]
+    if missing:
+        return None, ["missing column(s): {0}. Expected columns: {1}".format(
+            ', '.join(missing), ', '.join(IMPORT_CSV_COLUMNS))]
+
+    df = import_df[IMPORT_CSV_COLUMNS].fillna('').astype(str).apply(lambda col: col.str.strip())
+
+    user_ids = {}
+    for user in df[COL_USER_NAME].unique():
+        member = guild.get_member(int(user)) if user.isdigit() else guild.get_member_named(user)
+        if member:
+            user_ids[user] = member.id
+    users = df[COL_USER_NAME].map(user_ids)
+
+    alias_maps = get_catalog().alias_maps
+    items = df[COL_ITEM].str.lower().map(alias_maps)
+    # Items with no variants have a blank variant
+    variants = df[COL_VARIANT].where(df[COL_VARIANT] != '', ' ').str.lower().map(alias_maps)
+    combos = pd.MultiIndex.from_tuples(get_catalog().all_item_variant_combos)
+    is_valid_combo = pd.MultiIndex.from_arrays([items.fillna(''), variants.fillna('')]).isin(combos)
+
+    counts = pd.to_numeric(df[COL_COUNT], errors='coerce')
+    is_valid_count = counts.notna() & (counts >= 0) & (counts == counts.round())
+
+    errors = []
+    bad_rows = users.isna() | ~is_valid_combo | ~is_valid_count
+    for i in bad_rows[bad_rows].index:
+        row = df.loc[i]
+        if pd.isna(users[i]):
+            reason = "unknown user '{0}'".format(row[COL_USER_NAME])
+        elif not is_valid_combo[i]:
+            reason = "unknown item and variant '{0} {1}'".format(row[COL_ITEM], row[COL_VARIANT])
+        else:
+            reason = "count '{0}' is not a number of items".format(row[COL_COUNT])
+        errors.append("line {0}: {1}".format(i + 2, reason))  # line 1 is the header
+    if errors:
+        return None, errors
+
+    imported = pd.DataFrame({
+        COL_USER_ID: users.astype(int).values,
+        COL_ITEM: items.values,
+        COL_VARIANT: variants.values,
+        COL_COUNT: counts.astype(int).values,
+        COL_UPDATE_TIME: datetime.utcnow(),
+    }, columns=PERSONAL_DF_COLUMNS)
+    imported.drop_duplicates(subset=PERSONAL_PRIMARY_KEY, keep='last', inplace=True)
+    return imported.set_index(keys=PERSONAL_PRIMARY_KEY, drop=False), []
 
 @bot.command(
-    brief="Report total inventory in the system",
-    description="Report inventory of items by all users, broken down by item, variant and user:")
-async def report(ctx, item: str = None, variant: str = None):
+    name='import',
+    brief="Load maker counts from a CSV spreadsheet",
+    description="Load maker counts from an attached CSV spreadsheet:")
+async def import_csv(ctx):
     """
-'item' and 'variant' are optional. Use them to limit the types of items to report.
+Only admins can import. Attach a CSV file to the 'import' message. The first line must be the header \
+'user,item,variant,count'. Each following line sets the current count of one item of one maker, \
+same as 'sudo <user> count <count> <item> <variant>'. 'user' is a display name or a user id. \
+Aliases such as 'ver' and 'pet' can be used. Leave variant blank for items with no variants.
 
-We encourage people to ask for reports by talking directly to Count Bot from their own DM channel. \
-This way the long report does not spam everyone in the inventory channel. \
-Every time a report command is used, a brief summary is posted in the inventory, \
-and the actual report is sent to the user's own DM channel, regardless of whether the report was requested \
-from the inventory channel or DM channel.
+All lines are checked first. If any line is wrong, nothing is imported. \
+Otherwise all counts are recorded at once, as a single sync point in the inventory channel.
 """
-    print('Command: report {0} {1} ({2})'.format(item, variant, ctx.message.author.display_name))
+    print('Command: import ({0})'.format(ctx.message.author.display_name))
 
-    num_records = [len(inventory_df) for inventory_df in INVENTORY_BY_USER_ROLE.values()]
-    if not num_records:
-        await ctx.send('There are no records in the system yet.')
+    inventory = _get_guild_inventory(ctx)
+    is_admin = await _user_has_role(inventory.guild, ctx.message.author, inventory.config.admin_role_name)
+    if not is_admin:
+        _reply(ctx, "❌  You need the admin role to do this. Please ask to be made an admin.")
+        return
+
+    if not ctx.message.attachments:
+        _reply(ctx, "❌  Please attach a CSV file to the 'import' command. See help.")
+        await ctx.send_help(ctx.command)
         return
 
-    async def filter_df(df, item, variant):
+    attachment = ctx.message.attachments[0]
+    try:
+        import_df = pd.read_csv(io.BytesIO(await attachment.read()), dtype=str, skipinitialspace=True)
+    except (ValueError, UnicodeDecodeError) as error:
+        _reply(ctx, "❌  Cannot read '{0}' as a CSV file: {1}".format(attachment.filename, error))
+        return
+
+    imported, errors = _validate_import_df(inventory.guild, import_df)
+    if errors:
+        shown = '\n'.join(errors[:IMPORT_MAX_ERRORS_SHOWN])
+        more = '\n... and {0} more'.format(len(errors) - IMPORT_MAX_ERRORS_SHOWN) \
+            if len(errors) > IMPORT_MAX_ERRORS_SHOWN else ''
+        _reply(ctx, "❌  Nothing imported. Found {0} problem(s) in '{1}':```{2}{3}```".format(
+            len(errors), attachment.filename, shown, more))
+        return
+
+    # Imported counts replace current counts of the same maker, item and variant.
+    makers_df = inventory.inventory_by_user_role[USER_ROLE_MAKERS]
+    makers_df = pd.concat([makers_df[~makers_df.index.isin(imported.index)], imported])
+    makers_df.sort_index(inplace=True)
+    new_inventory_by_user_role = OrderedDict(inventory.inventory_by_user_role)
+    new_inventory_by_user_role[USER_ROLE_MAKERS] = makers_df
+
+    # The sync point is the one transaction record of the import.
+    # Only update memory DF after we have persisted the sync point to the inventory channel.
+    reason = '{0}: import {1} counts from {2}'.format(ctx.message.author.mention, len(imported), attachment.filename)
+    await _post_sync_point_to_trans_log(inventory, reason, inventory_by_user_role=new_inventory_by_user_role)
+    inventory.store.replace_frame(USER_ROLE_MAKERS, makers_df)
+    inventory.digest.set_totals(inventory.store.get_totals())
+
+    _reply(ctx, "Imported {0} counts. Sync point posted to channel '{1}'.".format(
+        len(imported), inventory.config.inventory_channel))
+
+REPORT_TIME_FORMATS = ('%Y-%m-%d %H:%M:%S', '%Y-%m-%d %H:%M', '%Y-%m-%d')
+
+def _parse_report_time(text):
+    """Parse the UTC time given to 'report --at'. Returns None if it is not understood."""
+    text = text.replace('T', ' ').strip()
+    if text.upper().endswith('UTC'):
+        text = text[:-3].strip()
+    for time_format in REPORT_TIME_FORMATS:
+        try:
+            return datetime.strptime(text, time_format)
+        except ValueError:
+            pass
+    return None
+
+def _render_report(inventory_by_user_role, totals_by_role, names, item=None, variant=None):
+    """
+    The summary table and the detailed breakdowns of 'report', as text. This is the CPU-heavy part of the report.
+    It runs in a worker thread, on a snapshot of the inventory. 'names' maps user ids to display names.
+    Totals are added up from the dataframes if 'totals_by_role' is None.
+    """
+    def filter_df(df, item, variant):
         if item:
-            item = await _resolve_item_name(ctx, item)
-            if not item:
-                return pd.DataFrame().reindex_like(df)
             df = df[df[COL_ITEM] == item]
-
         if variant:
-            # If variant exists, then item is also specified
-            variant = await _resolve_variant_name(ctx, item, variant)
-            if not variant:
-                return pd.DataFrame().reindex_like(df)
             df = df[df[COL_VARIANT] == variant]
         return df
 
-    filtered = OrderedDict([(role_name, await filter_df(inventory_df, item, variant))
-        for role_name, inventory_df in INVENTORY_BY_USER_ROLE.items()])
-    num_records = [len(df) for df in filtered.values()]
-    if not num_records:
-        await ctx.send('No records found for specified item/variant')
-        return
+    filtered = OrderedDict([(role_name, filter_df(inventory_df, item, variant))
+        for role_name, inventory_df in inventory_by_user_role.items()])
 
-    async def regroup_df(df):
-        mapped = await _map_user_id_column_to_display_names(df)
-        renamed = mapped.rename(columns={COL_USER_ID: COL_USER_NAME})
+    def regroup_df(df):
+        renamed = df.replace(names).rename(columns={COL_USER_ID: COL_USER_NAME})
         if COL_SECOND_USER_ID in renamed:
             renamed = renamed.rename(columns={COL_SECOND_USER_ID: COL_COLLECTOR_NAME})
         repivoted = renamed.set_index(keys=[COL_ITEM, COL_VARIANT], drop=True)
         groups = repivoted.groupby([COL_ITEM, COL_VARIANT], sort=True)
         return groups
 
-    maker_groups = await regroup_df(filtered[USER_ROLE_MAKERS])
-    dropbox_groups = await regroup_df(filtered[USER_ROLE_DROPBOXES])
-    collector_groups = await regroup_df(filtered[USER_ROLE_COLLECTORS])
-
-    def get_group(g, key):
-        if key in g.groups:
-            return g.get_group(key)
-        return None
+    maker_groups = regroup_df(filtered[USER_ROLE_MAKERS])
+    dropbox_groups = regroup_df(filtered[USER_ROLE_DROPBOXES])
+    collector_groups = regroup_df(filtered[USER_ROLE_COLLECTORS])
 
     # Compute total summaries for item/variant
 
+    if totals_by_role is None:
+        totals_by_role = _get_frame_totals(inventory_by_user_role)
     total_table = pd.DataFrame(columns=[COL_ITEM, COL_VARIANT, "TOTAL", "maker", "dropbox", "collector"])
 
-    for (com_item, com_variant) in ALL_ITEM_VARIANT_COMBOS:
-        maker_table = get_group(maker_groups, (com_item, com_variant))
-        dropbox_table = get_group(dropbox_groups, (com_item, com_variant))
-        collector_table = get_group(collector_groups, (com_item, com_variant))
-
-        maker_total = maker_table[COL_COUNT].sum() if maker_table is not None else 0
-        dropbox_total = dropbox_table[COL_COUNT].sum() if dropbox_table is not None else 0
-        collector_total = collector_table[COL_COUNT].sum() if collector_table is not None else 0
+    for (com_item, com_variant) in get_catalog().all_item_variant_combos:
+        if (item and com_item != item) or (variant and com_variant != variant):
+            continue
+        maker_total = totals_by_role[USER_ROLE_MAKERS].get((com_item, com_variant), 0)
+        dropbox_total = totals_by_role[USER_ROLE_DROPBOXES].get((com_item, com_variant), 0)
+        collector_total = totals_by_role[USER_ROLE_COLLECTORS].get((com_item, com_variant), 0)
         grand_total = maker_total + dropbox_total + collector_total
         if not grand_total:
             continue
@@ -1164,24 +2065,306 @@ from the inventory channel or DM channel.
             # FIXME - check that breakdown is less than 2,000 chars. Trim it and add disclaimer about chopped-off content.
             detailed_breakdowns.append(breakdown)
 
+    return total_table.to_string(index=False), detailed_breakdowns
+
+@bot.command(
+    brief="Report total inventory in the system",
+    description="Report inventory of items by all users, broken down by item, variant and user:")
+async def report(ctx, *args: str):
+    """
+'item' and 'variant' are optional. Use them to limit the types of items to report.
+
+We encourage people to ask for reports by talking directly to Count Bot from their own DM channel. \
+This way the long report does not spam everyone in the inventory channel. \
+Every time a report command is used, a brief summary is posted in the inventory, \
+and the actual report is sent to the user's own DM channel, regardless of whether the report was requested \
+from the inventory channel or DM channel.
+
+Admins can also ask what the inventory looked like at some time in the past, given in UTC:
+  report --at 2020-05-12 18:00
+  report visor --at 2020-05-12
+"""
+    args = list(args)
+    at_text = None
+    if '--at' in args:
+        at_index = args.index('--at')
+        at_text = ' '.join(args[at_index + 1:])
+        del args[at_index:]
+    if len(args) > 2:
+        raise commands.errors.BadArgument()
+    item, variant = (args + [None, None])[:2]
+    print('Command: report {0} {1} {2}({3})'.format(item, variant, '--at {0} '.format(at_text) if at_text else '',
+                                                   ctx.message.author.display_name))
+
+    inventory = _get_guild_inventory(ctx)
+    if item:
+        item = await _resolve_item_name(ctx, item)
+        if not item:
+            return
+    if variant:
+        # If variant exists, then item is also specified
+        variant = await _resolve_variant_name(ctx, item, variant)
+        if not variant:
+            return
+
+    title = ''
+    if at_text is not None:
+        if not await _user_has_role(inventory.guild, ctx.message.author, inventory.config.admin_role_name):
+            _reply(ctx, "❌  You need the admin role to do this. Please ask to be made an admin.")
+            return
+        when = _parse_report_time(at_text)
+        if when is None:
+            _reply(ctx, "❌  Cannot read '{0}' as a time. Use UTC, like '2020-05-12 18:00'. See help.".format(at_text))
+            return
+        try:
+            inventory_by_user_role = await _retrieve_inventory_at(inventory, when)
+        except ReplayError as e:
+            _reply(ctx, "❌  Cannot rebuild the inventory at {0:%Y-%m-%d %H:%M:%S} UTC: {1}".format(when, e))
+            return
+        totals_by_role = None
+        title = "Inventory at {0:%Y-%m-%d %H:%M:%S} UTC. ".format(when)
+    else:
+        # Live totals come from the store, which may add them up in SQL
+        inventory_by_user_role, totals_by_role = inventory.store.get_snapshot()
+
+    num_records = [len(inventory_df) for inventory_df in inventory_by_user_role.values()]
+    if not num_records:
+        _reply(ctx, 'There are no records in the system yet.')
+        return
+
+    names = await _get_display_names(inventory.guild, inventory_by_user_role.values())
+    summary, detailed_breakdowns = await _run_in_worker(
+        _render_report, inventory_by_user_role, totals_by_role, names, item, variant)
+
     if ctx.message.channel.type == discord.ChannelType.private and not DEBUG_PRETEND_DM_IS_INVENTORY:
-        msg = "Summary:\n```{0}```".format(total_table.to_string(index=False))
-        await ctx.send(msg)
+        msg = title + "Summary:\n```{0}```".format(summary)
+        _reply(ctx, msg)
 
         # I have to break up different roles. Each Discord message has a server-side hardl imit of 2,000.
         for detail_by_role in detailed_breakdowns:
-            await ctx.send(detail_by_role)
+            _reply(ctx, detail_by_role)
     else:
-        msg = "Summary shown here. Detailed report sent to your DM channel.\n```{0}```".format(total_table.to_string(index=False))
-        await ctx.send(msg)
+        msg = title + "Summary shown here. Detailed report sent to your DM channel.\n```{0}```".format(summary)
+        _reply(ctx, msg)
 
         # I have to break up different roles. Each Discord message has a server-side hardl imit of 2,000.
         for detail_by_role in detailed_breakdowns:
-            msg = "Detailed breakdown: {0} {1}\n".format(item or '', variant or '')
-            await ctx.message.author.send(msg + detail_by_role)
+            msg = title + "Detailed breakdown: {0} {1}\n".format(item or '', variant or '')
+            _reply(ctx.message.author, msg + detail_by_role)
+
+def _get_memory_report(inventory):
+    """What the inventory of a guild, and the bot process as a whole, hold in memory. One line per fact."""
+    def size(num_bytes):
+        return humanize.naturalsize(num_bytes) if num_bytes is not None else 'unknown'
+
+    lines = []
+    usage = inventory.store.get_memory_usage()
+    for role_name, table in inventory.engine.tables.items():
+        lines.append('{0:<11} {1:>7} rows {2:>10}'.format(
+            role_name, len(table), size(usage[role_name]) if usage[role_name] is not None else 'on disk'))
+    file_name = getattr(inventory.store, 'file_name', None)
+    if file_name:
+        lines.append('SQLite file: {0}'.format(size(os.path.getsize(file_name))))
+    lines.append('Drop record index: {0} messages, {1}'.format(
+        len(inventory.dropbox_messages), size(get_deep_size(inventory.dropbox_messages))))
+    cache = inventory.history_cache
+    if cache is not None:
+        lines.append('History cache: {0} messages, {1} attachments of {2}'.format(
+            len(cache.messages), len(cache.attachments), size(sum(len(data) for data in cache.attachments.values()))))
+    lines.append('Members cached: {0} in this guild, {1} users in all guilds'.format(
+        len(inventory.guild.members), len(bot.users)))
+    lines.append('Process RSS: {0}, peak {1}'.format(size(get_current_rss()), size(get_peak_rss())))
+    return lines
+
+# Allocation snapshots of 'memory snapshot'. Tracing is off until the first one.
+MEMORY_SNAPSHOTS = AllocationSnapshots(top=8)  # Fits in one Discord message
+
+@bot.command(
+    brief="Admin checks how much memory the bot uses",
+    description="Report the memory held by inventory tables and by the bot process:")
+async def memory(ctx, mode: str = None):
+    """
+Only admins can do this.
 
-async def _user_has_role(user, role_name):
-    member = await _map_dm_user_to_member(user)
+memory - rows and memory of each inventory table, cached members, and memory of the bot process
+memory snapshot - start tracing memory allocations. Each later snapshot shows what grew since the one before.
+memory stop - stop tracing memory allocations. Tracing slows down the bot.
+"""
+    print('Command: memory {0} ({1})'.format(mode, ctx.message.author.display_name))
+
+    inventory = _get_guild_inventory(ctx)
+    if not await _user_has_role(inventory.guild, ctx.message.author, inventory.config.admin_role_name):
+        _reply(ctx, "❌  You need the admin role to do this. Please ask to be made an admin.")
+        return
+
+    if mode is None:
+        _reply(ctx, "```{0}```".format('\n'.join(_get_memory_report(inventory))))
+    elif mode == 'snapshot':
+        first = MEMORY_SNAPSHOTS.previous is None
+        lines = MEMORY_SNAPSHOTS.take()
+        title = "Biggest allocations since tracing started:" if first else "Biggest growth since the last snapshot:"
+        _reply(ctx, "{0}```{1}```".format(title, '\n'.join(lines) or '(nothing)'))
+    elif mode == 'stop':
+        MEMORY_SNAPSHOTS.stop()
+        _reply(ctx, "Stopped tracing memory allocations.")
+    else:
+        raise commands.errors.BadArgument()
+
+VERIFY_MAX_MISMATCHES_SHOWN = 20
+
+@bot.command(
+    brief="Admin checks the newest sync point against the transaction log",
+    description="Check that the transaction log leads from the second newest sync point to the newest one:")
+async def verify(ctx):
+    """
+Only admins can do this. Count Bot rebuilds the inventory from the sync point before the newest one, \
+and the transaction records between them, and compares it with the newest sync point. Zero counts are not compared.
+"""
+    print('Command: verify ({0})'.format(ctx.message.author.display_name))
+
+    inventory = _get_guild_inventory(ctx)
+    if not await _user_has_role(inventory.guild, ctx.message.author, inventory.config.admin_role_name):
+        _reply(ctx, "❌  You need the admin role to do this. Please ask to be made an admin.")
+        return
+
+    newer, older, mismatches = await _verify_sync_points(inventory)
+    if newer is None or older is None:
+        _reply(ctx, "There are not two good sync points in the newest {0} messages. Nothing to compare.".format(
+            MSG_HISTORY_TROLLING_LIMIT))
+    elif not mismatches:
+        _reply(ctx, "✔️  Sync point of {0:%Y-%m-%d %H:%M:%S} UTC matches the one of {1:%Y-%m-%d %H:%M:%S} UTC "
+                    "plus the transactions in between.".format(newer.created_at, older.created_at))
+    else:
+        shown = '\n'.join(mismatches[:VERIFY_MAX_MISMATCHES_SHOWN])
+        more = '\n... and {0} more'.format(len(mismatches) - VERIFY_MAX_MISMATCHES_SHOWN) \
+            if len(mismatches) > VERIFY_MAX_MISMATCHES_SHOWN else ''
+        _reply(ctx, "❌  Sync point of {0:%Y-%m-%d %H:%M:%S} UTC does not match the one of {1:%Y-%m-%d %H:%M:%S} UTC "
+                    "plus the transactions in between:```{2}{3}```".format(newer.created_at, older.created_at, shown, more))
+
+@bot.command(
+    brief="Show what one user has in all roles",
+    description="Show the maker inventory, collection and dropbox records of one user:")
+async def inspect(ctx, member: discord.Member):
+    """
+'member' may be @alias (in the inventory room) or 'alias' alone (in DM channels). Note that 'alias' is case-sensitive.
+Unlike 'report', this only looks up the records of one user. It does not go through the whole inventory.
+
+inspect @Freddie - what Freddie made, dropped off, collected, and has in his dropbox
+"""
+    print('Command: inspect {0} ({1})'.format(member, ctx.message.author.display_name))
+
+    inventory = _get_guild_inventory(ctx)
+    name = member.display_name
+    maker_df = _get_user_view_df(inventory, USER_ROLE_MAKERS, member.id)
+    dropped_df = _get_user_view_df(inventory, USER_ROLE_DROPBOXES, member.id)
+    collector_df = _get_user_view_df(inventory, USER_ROLE_COLLECTORS, member.id)
+    dropbox_rows = inventory.engine.get_collector_dropbox_rows(member.id)
+
+    await _send_df_as_msg_to_user(ctx, maker_df, prefix="Maker inventory of {0}:".format(name))
+    if len(dropped_df):
+        await _send_dropbox_df_as_msg_to_maker(ctx, dropped_df, prefix="Items {0} dropped off:".format(name))
+
+    is_collector = await _user_has_role(inventory.guild, member, inventory.config.collector_role_name)
+    if is_collector or len(collector_df) or dropbox_rows:
+        await _send_df_as_msg_to_user(ctx, collector_df, prefix="Collection of {0}:".format(name))
+        await _send_dropbox_df_as_msg_to_collector(ctx, _inventory_rows_to_df(dropbox_rows),
+                                                   prefix="Dropbox of {0}:".format(name))
+
+CHANGES_MAX_SHOWN = 30  # Keeps the reply under the 2,000 character limit of a Discord message
+CHANGES_DEFAULT_HOURS = 24  # How far back 'changes' looks the first time a user runs it
+
+def _parse_changes_since(text, now):
+    """Parse the time given to 'changes': hours or days ago like '6h' or '2d', or a UTC time like 'report --at'."""
+    match = re.fullmatch(r'(\d+)\s*([hd])', text.strip().lower())
+    if match:
+        return now - timedelta(hours=int(match.group(1)) * (24 if match.group(2) == 'd' else 1))
+    return _parse_report_time(text)
+
+async def _get_changes_from_trans_log(inventory, since):
+    """
+    The changes posted after 'since', oldest first, read from the transaction log. The log is read newest first, and
+    only back to 'since', so if the limit is hit, the newest changes are the ones kept. Returns the changes, and whether
+    the limit was hit.
+    """
+    ch = inventory.get_inventory_channel()
+    changes = []
+    messages_read = 0
+    reached_since = False
+    # Not history(after=since). Newest first, discord.py fetches the whole limit and only then filters by 'after'.
+    async for msg in ch.history(limit=MSG_HISTORY_TROLLING_LIMIT):
+        if msg.created_at <= since:
+            reached_since = True
+            break
+        messages_read += 1
+        text = _get_trans_log_text(msg)
+        if text is not None:
+            records = _decode_trans_log_records(msg, text)
+            changes.extend(Change(msg.created_at, msg.id, record) for record in reversed(records))
+    changes.reverse()
+    return changes, not reached_since and messages_read >= MSG_HISTORY_TROLLING_LIMIT
+
+def _format_change(change, names):
+    record = change.record
+    if record.role_name == USER_ROLE_DROPBOXES:
+        what = 'dropbox of {0}: {1} {2} {3}'.format(
+            names.get(record.collector_id, record.collector_id), record.command.split()[-1], record.item, record.variant)
+    else:
+        # An empty command is 'remove all'
+        what = '{0} {1} {2}'.format(record.command, record.item, record.variant) if record.command else 'remove all'
+        if record.role_name == USER_ROLE_COLLECTORS:
+            what = 'collect ' + what
+    return '{0:%m-%d %H:%M} {1} {2}'.format(change.time, names.get(record.member_id, record.member_id), what)
+
+@bot.command(
+    brief="Show what changed in the inventory since you last checked",
+    description="Show the inventory transactions posted since some time, oldest first:")
+async def changes(ctx, *args: str):
+    """
+With no argument, shows what changed since you last ran 'changes', or in the last day the first time. Otherwise give hours or days ago, or a time in UTC, like 'report --at'.
+
+changes           - what changed since you last checked
+changes 6h        - what changed in the last 6 hours
+changes 2d        - what changed in the last 2 days
+changes 2020-05-12 18:00
+"""
+    since_text = ' '.join(args)
+    print('Command: changes {0} ({1})'.format(since_text, ctx.message.author.display_name))
+
+    inventory = _get_guild_inventory(ctx)
+    now = datetime.utcnow()
+    author_id = ctx.message.author.id
+    if since_text:
+        since = _parse_changes_since(since_text, now)
+        if since is None:
+            _reply(ctx, "❌  Cannot read '{0}' as a time. Use '6h', '2d', or UTC like '2020-05-12 18:00'. See help.".format(
+                since_text))
+            return
+    else:
+        since = inventory.changes_viewed.get(author_id, now - timedelta(hours=CHANGES_DEFAULT_HOURS))
+
+    # Recent changes are answered from memory. Older ones are read back from the transaction log.
+    found = inventory.change_feed.get_changes_since(since)
+    truncated = False
+    if found is None:
+        found, truncated = await _get_changes_from_trans_log(inventory, since)
+    inventory.changes_viewed[author_id] = now
+
+    if not found:
+        _reply(ctx, "No changes since {0:%Y-%m-%d %H:%M} UTC.".format(since))
+        return
+
+    ids = set(change.record.member_id for change in found) | \
+        set(change.record.collector_id for change in found if change.record.collector_id)
+    names = await _map_user_ids_to_display_names(inventory.guild, ids, pad_for_print=False)
+    lines = [_format_change(change, names) for change in found[-CHANGES_MAX_SHOWN:]]
+    more = '... and {0} older\n'.format(len(found) - CHANGES_MAX_SHOWN) if len(found) > CHANGES_MAX_SHOWN else ''
+    if truncated:
+        more = '... only the newest {0} messages of the log were read\n'.format(MSG_HISTORY_TROLLING_LIMIT) + more
+    _reply(ctx, "{0} changes since {1:%Y-%m-%d %H:%M} UTC:```{2}{3}```".format(
+        len(found), since, more, '\n'.join(lines)))
+
+async def _user_has_role(guild, user, role_name):
+    member = await _map_dm_user_to_member(guild, user)
     return bool(discord.utils.get(member.roles, name=role_name))
 
 @bot.command(
@@ -1209,15 +2392,16 @@ sudo <user> excel
     sudo_author = ctx.message.author
     print('Command: sudo {0} {1} {2} ({3})'.format(member, command, args, sudo_author.display_name))
 
-    is_admin = await _user_has_role(sudo_author, ADMIN_ROLE_NAME)
+    inventory = _get_guild_inventory(ctx)
+    is_admin = await _user_has_role(inventory.guild, sudo_author, inventory.config.admin_role_name)
     if not is_admin:
-        await ctx.send("❌  You need the admin role to do this. Please ask to be made an admin.")
+        _reply(ctx, "❌  You need the admin role to do this. Please ask to be made an admin.")
         return
 
     if command == 'id':
         # Unadvertised 'sudo Freddie id' - return internal Discord user id
         # Useful for adding admins
-        await ctx.send("{0}, # {1}".format(member.id, member.display_name))
+        _reply(ctx, "{0}, # {1}".format(member.id, member.display_name))
         return
 
     elif command == 'collect':
@@ -1225,15 +2409,15 @@ sudo <user> excel
             command = command + ' ' + args[0]
             args = args[1:]
 
-        is_collector = await _user_has_role(member, COLLECTOR_ROLE_NAME)
+        is_collector = await _user_has_role(inventory.guild, member, inventory.config.collector_role_name)
         if not is_collector:
-            await ctx.send("❌  '{0}' needs to have the collector role, for this sudo collect command to work.".format(member))
+            _reply(ctx, "❌  '{0}' needs to have the collector role, for this sudo collect command to work.".format(member))
             raise NotEntitledError()
 
     if command not in ('count', 'remove', 'add', 'reset',
                        'collect', 'collect count', 'collect remove', 'collect add', 'collect reset', 'collect from',
                        'drop', 'confirm', 'excel'):
-        await ctx.send("❌  command '{0}' not supported by sudo".format(command))
+        _reply(ctx, "❌  command '{0}' not supported by sudo".format(command))
         return
 
     ctx.message.author = member
@@ -1242,11 +2426,11 @@ sudo <user> excel
     # This means that commands supported by 'sudo' must do explict conversion of int arguments, and the like.
     await cmd(ctx, *args)
 
-def _get_role_by_name(role_name):
-    for role in _get_first_guild().roles:
+def _get_role_by_name(guild, role_name):
+    for role in guild.roles:
         if role.name == role_name:
             return role
-    raise RuntimeError('Role name "{0}" not found in the associated server/guild'.format(role_name))
+    raise RuntimeError('Role name "{0}" not found in server/guild "{1}"'.format(role_name, guild.name))
 
 @bot.command(
     brief="Find out who is serving what role",
@@ -1262,15 +2446,19 @@ The argument [are] is always ignored. It's just there so you can ask:
     print('Command: who {0} {1} ({2})'.format(are, role, ctx.message.author.display_name))
 
     if role == 'you' or not role:
-        await ctx.send("Count Bot Johnny 5 at your service. ||Run by ({0}) with pid ({1}) V{2}||".format(
-            getpass.getuser(), os.getpid(), CODE_VERSION))
-
-    elif role in USER_ROLE_HUMAN_TO_DISCORD_LABEL_MAP:
-        role = _get_role_by_name(USER_ROLE_HUMAN_TO_DISCORD_LABEL_MAP[role])
+        inventory = GUILD_INVENTORIES.get(ctx.guild.id) if ctx.guild else None
+        standing = ' hot standby' if inventory and not inventory.is_writer else ''
+        _reply(ctx, "Count Bot Johnny 5 at your service. ||Run by ({0}) with pid ({1}) V{2}{3}||".format(
+            getpass.getuser(), os.getpid(), CODE_VERSION, standing))
+
+    elif role in USER_ROLE_HUMAN_TO_GUILD_CONFIG_FIELD_MAP:
+        inventory = _get_guild_inventory(ctx)
+        role_name = getattr(inventory.config, USER_ROLE_HUMAN_TO_GUILD_CONFIG_FIELD_MAP[role])
+        role = _get_role_by_name(inventory.guild, role_name)
         members = role.members
         names = sorted([member.display_name for member in members])
         output = '  ' + '\n  '.join(names)
-        await ctx.send("```{0}```".format(output))
+        _reply(ctx, "```{0}```".format(output))
 
 @bot.command(
     brief="Admin instructs an extraneous bot to bow out",
@@ -1282,13 +2470,21 @@ Only admins can kill a bot. Use 'who are you' to find the pid of the right bot i
     sudo_author = ctx.message.author
     print('Command: kamikaze {0} ({1})'.format(pid, sudo_author.display_name))
 
-    is_admin = await _user_has_role(sudo_author, ADMIN_ROLE_NAME)
+    inventory = _get_guild_inventory(ctx, writer_only=False)
+    is_admin = await _user_has_role(inventory.guild, sudo_author, inventory.config.admin_role_name)
     if not is_admin:
-        await ctx.send("❌  You are not an admin. Please ask to be made an admin first.")
+        _reply(ctx, "❌  You are not an admin. Please ask to be made an admin first.")
         return
 
     if os.getpid() == pid:
-        await ctx.send("👋  So long, and thanks for all the fish.")
+        _reply(ctx, "👋  So long, and thanks for all the fish.")
+        await OUTBOX.flush()
+        # Release leases, so that hot standbys take over right away instead of waiting for the leases to expire
+        for inventory in GUILD_INVENTORIES.values():
+            _stop_lease_keeper(inventory)
+            _stop_digest_poster(inventory)
+            if inventory.is_writer:
+                await inventory.lease.release(LEASE_HOLDER_ID)
         await bot.close()
     # Do not respond to incorrect PIDs. The point of this command is to kill extraneous bots.
     # Good bots do not need to respond at all.
@@ -1300,6 +2496,72 @@ async def hello(ctx):
     cmd = bot.get_command('who')
     await cmd(ctx, 'are', 'you')
 
+def _find_item_variants_missing_from_catalog(catalog):
+    """
+    Item and variant combinations that the catalog does not know about, but that are recorded in any inventory, or in
+    its transaction log since the last sync point. Replay decodes the log with the catalog. An item that is dropped,
+    or that gains or loses its variants, would no longer decode.
+    """
+    in_use = set()
+    for inventory in GUILD_INVENTORIES.values():
+        for inventory_df in inventory.inventory_by_user_role.values():
+            in_use.update(zip(inventory_df[COL_ITEM], inventory_df[COL_VARIANT]))
+        in_use.update(inventory.logged_item_variants)
+    return sorted(in_use - set(catalog.all_item_variant_combos))
+
+@bot.group(
+    brief="Show items and variants that can be counted",
+    description="Show items and variants that can be counted:",
+    invoke_without_command=True)
+async def catalog(ctx):
+    """
+Items and their variants are listed in the configuration file of the bot. \
+After editing the configuration file, an admin can load the new catalog with 'catalog reload'.
+"""
+    print('Command: catalog ({0})'.format(ctx.message.author.display_name))
+    _get_guild_inventory(ctx)
+
+    current = get_catalog()
+    lines = ['{0:12}{1}'.format(item, ' or '.join(current.variant_choices[item])) for item in current.item_choices]
+    _reply(ctx, "```{0}```".format('\n'.join(lines)))
+
+@catalog.command(
+    name='reload',
+    brief="Reload items and variants from the configuration file",
+    description="Reload items and variants from the configuration file:")
+async def catalog_reload(ctx):
+    """
+Only admins can reload the catalog. Every bot process, writer or hot standby, reloads its own configuration file. \
+The catalog is not reloaded if it drops an item or variant that is still recorded in the inventory, \
+or in the transaction log since the last sync point. Remove these records first. Records in the log are kept until \
+the next sync point, e.g. the one the bot posts when it restarts.
+"""
+    print('Command: catalog reload ({0})'.format(ctx.message.author.display_name))
+
+    inventory = _get_guild_inventory(ctx, writer_only=False)
+    is_admin = await _user_has_role(inventory.guild, ctx.message.author, inventory.config.admin_role_name)
+    if not is_admin:
+        if inventory.is_writer:
+            _reply(ctx, "❌  You need the admin role to do this. Please ask to be made an admin.")
+        return
+
+    standing = '' if inventory.is_writer else ' (hot standby {0})'.format(os.getpid())
+    try:
+        new_catalog = _load_catalog()
+    except (ValueError, AttributeError) as error:
+        _reply(ctx, "❌  Catalog not reloaded{0}. The configuration file is not right: {1}".format(standing, error))
+        return
+
+    missing = _find_item_variants_missing_from_catalog(new_catalog)
+    if missing:
+        _reply(ctx, "❌  Catalog not reloaded{0}. These are still recorded in the inventory or its log: {1}".format(
+            standing, ', '.join('{0} {1}'.format(item, variant).strip() for item, variant in missing)))
+        return
+
+    set_catalog(new_catalog)
+    _reply(ctx, "Catalog reloaded{0}: {1} items, {2} item and variant combinations.".format(
+        standing, len(new_catalog.item_choices), len(new_catalog.all_item_variant_combos)))
+
 @bot.group(
     brief="Tools for collectors to move maker items into collections",
     description="Tools for collectors to move maker items into collections:",
@@ -1313,9 +2575,10 @@ If you run collect without a subcommand, it shows you your currection collection
     collect_author = ctx.message.author
     print('Command: collect (group check) ({0})'.format(collect_author.display_name))
 
-    is_collector = await _user_has_role(collect_author, COLLECTOR_ROLE_NAME)
+    inventory = _get_guild_inventory(ctx)
+    is_collector = await _user_has_role(inventory.guild, collect_author, inventory.config.collector_role_name)
     if not is_collector:
-        await ctx.send("❌  You need to have the collector role. Please ask to be made a collector.")
+        _reply(ctx, "❌  You need to have the collector role. Please ask to be made a collector.")
         raise NotEntitledError()
 
     if ctx.subcommand_passed is None:
@@ -1326,7 +2589,7 @@ If you run collect without a subcommand, it shows you your currection collection
     name='count',
     brief="A collector re-counts items in her collection",
     description="A collector recounts items in her collection:")
-async def collect_count(ctx, num: int = None, item: str = None, variant: str = None):
+async def collect_count(ctx, num: str = None, item: str = None, variant: str = None, *more: str):
     """
 This is similar to 'count' that makers use to re-count items they have made. \
 With 'collect count', a collect can fix mistakes in previous collections by simply setting a new collection count.
@@ -1336,8 +2599,14 @@ Type 'help count' to see descriptions of [item] and [variant], and how you can u
 collect count - shows everything in this collector's inventory.
 collect count 20 - used when a collector has only one item type in collection.
 collect count 20 prusa - used when a collector has only one variant of prusa.
+collect count 12 ver pla, 30 pru pet - update several counts in the collection at once.
 """
-    print('Command: collect count {0} {1} {2} ({3})'.format(num, item, variant, ctx.message.author.display_name))
+    print('Command: collect count {0} {1} {2} {3} ({4})'.format(
+        num, item, variant, more, ctx.message.author.display_name))
+    count_list, num = _parse_count_args(num, item, variant, more)
+    if count_list:
+        await _count_many(ctx, count_list, role=USER_ROLE_COLLECTORS)
+        return
     await _count(ctx, num, item, variant, role=USER_ROLE_COLLECTORS)
 
 @collect.command(
@@ -1419,7 +2688,7 @@ collect from @Freddie 50 earsaver: some items such as ear-savers have no variant
         maker, num, item, variant, collector_author.display_name))
     await _collect_from(ctx, maker, num, item, variant)
 
-async def _collect_from(ctx, maker: discord.Member, num: int, item: str, variant: str = None, trial_run_only=False):
+async def _collect_from(ctx, maker: discord.Member, num: int, item: str, variant: str = None):
     collector_author = ctx.message.author
 
     if isinstance(maker, str):
@@ -1433,26 +2702,16 @@ async def _collect_from(ctx, maker: discord.Member, num: int, item: str, variant
         # This is needed for 'sudo' command to invoke this function without the benefit of built-in convertors.
         num = int(num)
 
-    if num == 0:
-        await ctx.send("❌  Collecting 0 items is not a very useful exercise.")
-        return
-
-    # Make a trial run to bail out early if args are incorrect, so that we can guarantee the success of the
+    # Validate both sides of the transfer up front, so that we can guarantee the success of the
     # actual transfer which consists of two separate commands, in a pseudo-atomic fashion.
-    ctx.message.author = maker
-    if None is await _count(ctx, -num, item, variant, delta=True, role=USER_ROLE_MAKERS, trial_run_only=True):
-        return
-    ctx.message.author = collector_author
-    if None is await _count(ctx, num, item, variant, delta=True, role=USER_ROLE_COLLECTORS, trial_run_only=True):
+    try:
+        plan = _get_guild_inventory(ctx).engine.plan_collect_from(maker.id, collector_author.id, num, item, variant)
+    except InventoryError as error:
+        await _send_inventory_error(ctx, error)
         return
 
-    if trial_run_only:
-        return num, item, variant
-
-    ctx.message.author = maker
-    await _count(ctx, -num, item, variant, delta=True, role=USER_ROLE_MAKERS)
-    ctx.message.author = collector_author
-    await _count(ctx, num, item, variant, delta=True, role=USER_ROLE_COLLECTORS)
+    await _commit_count_plan(ctx, plan.maker_plan, maker)
+    await _commit_count_plan(ctx, plan.collector_plan, collector_author)
 
 @bot.command(
     brief="A maker drops items into a collector's drop box",
@@ -1461,8 +2720,8 @@ async def drop(ctx, collector: discord.Member, num: str, item: str = None, varia
     """
 This transfers items out of a maker's inventory, but not quite into a collector's inventory, \
 unlike the command 'collect from'. The items are temporarily housed in a collector's drop box. \
-Once the collector confirms the drop-off using an OK 👌 reaction, then the bot moves these items \
-from the drop box into the collector's inventory.
+Once the collector confirms the drop-off, by reacting with 💯 to the drop record in the inventory channel \
+or with the 'confirm' command, the bot moves these items from the drop box into the collector's inventory.
 
 Type 'help count' to see descriptions of [item] and [variant], and how you can use shorter aliases to reference them.
 
@@ -1483,12 +2742,12 @@ drop @Katy -10 ver pet - take back 10 Verkstans
         try:
             num = int(num)
         except:
-            await ctx.send("❌  'all' or a number is expected. Got '{0}'. See help.".format(num))
+            _reply(ctx, "❌  'all' or a number is expected. Got '{0}'. See help.".format(num))
             await ctx.send_help(ctx.command)
             return
 
     if num == 0:
-        await ctx.send("❌  Dropping off 0 items is not a very useful exercise.")
+        _reply(ctx, "❌  Dropping off 0 items is not a very useful exercise.")
         return
 
     if isinstance(collector, str):
@@ -1498,66 +2757,40 @@ drop @Katy -10 ver pet - take back 10 Verkstans
         collector = await converter.convert(ctx, collector_input)
         print("converted '{0}' to '{1}'".format(collector_input, collector))
 
-    is_collector = await _user_has_role(collector, COLLECTOR_ROLE_NAME)
+    inventory = _get_guild_inventory(ctx)
+    is_collector = await _user_has_role(inventory.guild, collector, inventory.config.collector_role_name)
     if not is_collector:
-        await ctx.send("❌  '{0}' needs to be a collector for this drop to be successful.".format(collector))
+        _reply(ctx, "❌  '{0}' needs to be a collector for this drop to be successful.".format(collector))
         raise NotEntitledError()
 
-    # Make a trial run to bail out early if args are incorrect, so that we can guarantee the success of the
-    # actual transfer which consists of two separate commands, in a pseudo-atomic fashion.
-    ctx.message.author = maker
-    result = await _count(ctx, -num, item, variant, delta=True, role=USER_ROLE_MAKERS, trial_run_only=True)
-    if result is None:
+    # Validate the maker side, and the 'collect from' that some collector will eventually need to do, up front.
+    # This way we can guarantee the success of the actual transfer which consists of two separate commands,
+    # in a pseudo-atomic fashion.
+    try:
+        plan = inventory.engine.plan_drop(maker.id, collector.id, num, item, variant)
+    except InventoryError as error:
+        await _send_inventory_error(ctx, error)
         return
-    _current_maker_count, confirmed_item, confirmed_variant = result
-
-    if num >= 0:
-        # Let the 'collect from' command check for the validity of this proposed transaction.
-        # After all, some collector will eventually need to 'collect' these items.
-        ctx.message.author = collector
-        if None is await _collect_from(ctx, maker, num, confirmed_item, confirmed_variant, trial_run_only=True):
-            return
-
-    # Take current count of dropbox entry for this maker-collector-item-variant combination
-
-    df = INVENTORY_BY_USER_ROLE[USER_ROLE_DROPBOXES]
-    maker_user_id = maker.id
-    collector_user_id = collector.id
-
-    current_dropped_count = 0
-    cond = (df[COL_USER_ID] == maker_user_id) & (df[COL_ITEM] == confirmed_item) & \
-           (df[COL_VARIANT] == confirmed_variant) & (df[COL_SECOND_USER_ID] == collector_user_id)
-    rows = df[cond]
-    if len(rows) == 1:
-        row = rows.iloc[0]
-        current_dropped_count = row[COL_COUNT]
-    new_dropbox_count = num + current_dropped_count
-
-    if new_dropbox_count < 0:
-        ctx.message.author = maker
-        await ctx.send("❌  Dropbox count would become negative after this operation: '{0}'.".format(new_dropbox_count))
-        raise NotEntitledError()
 
     # -- OK. Let's do it
 
     # Update maker inventory side of the transaction
-    ctx.message.author = maker
-    await _count(ctx, -num, confirmed_item, confirmed_variant, delta=True, role=USER_ROLE_MAKERS)
+    await _commit_count_plan(ctx, plan.maker_plan, maker)
 
     # Update dropbox side of the transaction
-    ctx.message.author = maker
-    txt = '{0} {1} {2} {3}'.format(collector.mention, new_dropbox_count, confirmed_item, confirmed_variant)
-    await _post_user_record_to_trans_log(ctx, 'drop', txt)
-
-    if new_dropbox_count != 0:
-        df.loc[(maker_user_id, confirmed_item, confirmed_variant, collector_user_id)] = \
-            [maker_user_id, confirmed_item, confirmed_variant, collector_user_id, new_dropbox_count, datetime.utcnow()]
-    else:
-        df.drop((maker_user_id, confirmed_item, confirmed_variant, collector_user_id), inplace=True)
+    maker_plan = plan.maker_plan
+    txt = '{0} {1} {2} {3}'.format(collector.mention, plan.new_count, maker_plan.item, maker_plan.variant)
+    message = await _post_user_record_to_trans_log(ctx, 'drop', txt, member=maker)
 
     # Only update memory DF after we have persisted the message to the inventory channel.
-    msg_prefix = "previous count: {0}  delta: {1}".format(current_dropped_count, num)
-    await _send_dropbox_df_as_msg_to_maker(ctx, df[(df[COL_USER_ID] == maker_user_id)], prefix=msg_prefix)
+    inventory.engine.apply_dropbox_count(plan, datetime.utcnow())
+    if message is not None:
+        record = TransLogRecord(USER_ROLE_DROPBOXES, maker.id, collector.id, maker_plan.item, maker_plan.variant,
+                                'count {0}'.format(plan.new_count))
+        _index_dropbox_message(inventory.dropbox_messages, message.id, record, plan.previous_count)
+    msg_prefix = "previous count: {0}  delta: {1}".format(plan.previous_count, num)
+    await _send_dropbox_df_as_msg_to_maker(ctx, _get_user_view_df(inventory, USER_ROLE_DROPBOXES, maker.id),
+                                           prefix=msg_prefix)
 
 @bot.command(
     brief="A collector confirms dropped items",
@@ -1574,21 +2807,20 @@ confirm @Anthony - move only items from Antony to the collection
     collector = ctx.message.author
     print('Command: confirm {0} ({1})'.format(maker, collector.display_name))
 
-    is_collector = await _user_has_role(collector, COLLECTOR_ROLE_NAME)
+    inventory = _get_guild_inventory(ctx)
+    is_collector = await _user_has_role(inventory.guild, collector, inventory.config.collector_role_name)
     if not is_collector:
-        await ctx.send("❌  You need to have the collector role to use the 'confirm' command.")
+        _reply(ctx, "❌  You need to have the collector role to use the 'confirm' command.")
         raise NotEntitledError()
 
-    dropbox_df = INVENTORY_BY_USER_ROLE[USER_ROLE_DROPBOXES]
-    dropbox_cond = dropbox_df[COL_SECOND_USER_ID] == collector.id
+    rows = inventory.engine.get_collector_dropbox_rows(collector.id)
 
     if maker is None:
-        await _send_dropbox_df_as_msg_to_collector(ctx, dropbox_df[dropbox_cond], prefix="Items in your dropbox from makers:")
+        await _send_dropbox_df_as_msg_to_collector(ctx, _inventory_rows_to_df(rows), prefix="Items in your dropbox from makers:")
         return
 
-    dropbox_found_num = sum(dropbox_cond)
-    if not dropbox_found_num:
-        await ctx.send("You have no items in your dropbox")
+    if not rows:
+        _reply(ctx, "You have no items in your dropbox")
         return
 
     if maker != 'all':
@@ -1597,47 +2829,38 @@ confirm @Anthony - move only items from Antony to the collection
         maker = await converter.convert(ctx, maker_input)
         print("converted '{0}' to '{1}'".format(maker_input, maker))
 
-        dropbox_cond = dropbox_cond & (dropbox_df[COL_USER_ID] == maker.id)
-        dropbox_found_num = sum(dropbox_cond)
-
-        if not dropbox_found_num:
-            await ctx.send("You have no items in your dropbox from maker '{0}'.".format(maker))
+        rows = inventory.engine.get_collector_dropbox_rows(collector.id, maker.id)
+        if not rows:
+            _reply(ctx, "You have no items in your dropbox from maker '{0}'.".format(maker))
             return
 
-    df = dropbox_df[dropbox_cond]
-    remapped = df.loc[:, [COL_USER_ID, COL_ITEM, COL_VARIANT, COL_COUNT]]
-    sorted_df= remapped.sort_index(axis='index')
-
-    entries = []
-    maker_ids = set()
-    for _index, row in sorted_df.iterrows():
-        maker_id = row[COL_USER_ID]
-        item = row[COL_ITEM]
-        variant = row[COL_VARIANT]
-        item_count = row[COL_COUNT]
-        entries.append([maker_id, item, variant, item_count])
-        maker_ids.add(maker_id)
+    mapped_makers = await _map_dm_user_ids_to_members(inventory.guild, [row.key[0] for row in rows])
 
-    mapped_makers = await _map_dm_user_ids_to_members(maker_ids)
+    await _send_dropbox_df_as_msg_to_collector(ctx, _inventory_rows_to_df(rows), prefix="Collecting these items from the dropbox...")
+    await _collect_dropbox_rows(ctx, inventory, collector, rows, mapped_makers)
 
-    ctx.message.author = collector
-    await _send_dropbox_df_as_msg_to_collector(ctx, dropbox_df[dropbox_cond], prefix="Collecting these items from the dropbox...")
-
-    for maker_id, item, variant, item_count in entries:
+    _reply(ctx, "Finished collecting all items from your dropbox. Current collection:")
+    await _count(ctx, role=USER_ROLE_COLLECTORS)
 
-        # Remove the dropbox entry
-        dropbox_df.drop((maker_id, item, variant, collector.id), inplace=True)
-        ctx.message.author = mapped_makers[maker_id]
-        txt = '{0} {1} {2} {3}'.format(collector.mention, 0, item, variant)
-        await _post_user_record_to_trans_log(ctx, 'drop', txt)
+async def _collect_dropbox_rows(ctx, inventory, collector, rows, mapped_makers):
+    """
+    Move dropbox entries of a collector into the collector's inventory. The collector is the author of ctx.
+    Each row holds the count to move, which may be less than the whole entry.
+    """
+    for row in rows:
+        maker_id, item, variant, _collector_id = row.key
+
+        # Take the items out of the dropbox entry. The entry is removed once it is empty.
+        left = inventory.engine.tables[USER_ROLE_DROPBOXES].get_count(row.key) - row.count
+        txt = '{0} {1} {2} {3}'.format(collector.mention, left, item, variant)
+        # The record must name the maker of the entry, even one who has left the guild. Otherwise replay would
+        # decode the drop as the collector's own.
+        maker = mapped_makers[maker_id] or discord.Object(id=maker_id)
+        await _post_user_record_to_trans_log(ctx, 'drop', txt, member=maker)
+        inventory.engine.take_from_dropbox(row.key, row.count, datetime.utcnow())
 
         # Increment the collection inventory
-        ctx.message.author = collector
-        await _count(ctx, item_count, item, variant, delta=True, role=USER_ROLE_COLLECTORS, display_result=False)
-
-    ctx.message.author = collector
-    await ctx.send("Finished collecting all items from your dropbox. Current collection:")
-    await _count(ctx, role=USER_ROLE_COLLECTORS)
+        await _count(ctx, row.count, item, variant, delta=True, role=USER_ROLE_COLLECTORS, display_result=False)
 
 if __name__ == '__main__':
     bot.run(get_bot_token())
@@ -0,0 +1,196 @@
+"""
+Digests of a guild's inventory, posted on a schedule: total counts, and what changed since the last digest.
+
+Collectors plan pickups from these instead of running 'report' over and over. A digest is not computed from the
+whole inventory. InventoryDigest keeps running totals of each item and variant per role, and the changes since the
+last digest. DigestTable wraps an inventory table, and tells the digest about every count that a write changes.
+Code that replaces whole tables, such as rebuilding from the transaction log, hands the new totals to set_totals().
+A digest too long for one Discord message is split into several, each table continued under its own heading.
+
+This module is pure Python. It imports neither discord.py nor pandas.
+"""
+import math
+
+from collections import OrderedDict
+from datetime import datetime, timedelta
+from typing import List, Optional
+
+from outbox import MAX_MESSAGE_LENGTH
+from inventory_schema import USER_ROLE_MAKERS, USER_ROLE_COLLECTORS, USER_ROLE_DROPBOXES, USER_ROLES_IN_ORDER
+
+__all__ = {
+    "InventoryDigest",
+    "DigestTable",
+    "get_next_digest_time",
+}
+
+_ROLE_COLUMNS = OrderedDict([(USER_ROLE_MAKERS, 'maker'), (USER_ROLE_DROPBOXES, 'dropbox'),
+                             (USER_ROLE_COLLECTORS, 'collector')])
+
+
+def get_next_digest_time(now: datetime, interval_hours: float) -> datetime:
+    """
+    The first digest time after 'now', a naive UTC datetime. Digest times are whole multiples of the interval since
+    the epoch, so a daily digest is posted at midnight UTC and an hourly one on the hour.
+    """
+    interval = timedelta(hours=interval_hours)
+    epoch = datetime(1970, 1, 1)
+    return epoch + interval * (math.floor((now - epoch) / interval) + 1)
+
+
+class InventoryDigest:
+    def __init__(self):
+        self.totals = None  # maps role name to {(item, variant): total}. None until set_totals() is first called.
+        self.changes = {}  # maps (role name, item, variant) to how much its total changed since the last digest
+        self.since = None  # When the last digest was taken
+        self._taken = None  # (since, changes) of the last digest taken, until the next one. See untake().
+
+    def set_totals(self, totals_by_role, now: Optional[datetime] = None):
+        """
+        Replace the running totals, e.g. with those of an inventory rebuilt from the transaction log. The first
+        call sets the baseline. Later calls count the differences as changes, e.g. the counts of an import.
+        """
+        totals = OrderedDict((role_name, dict((key, int(total)) for key, total in totals_by_role[role_name].items()
+                                              if total))
+                             for role_name in USER_ROLES_IN_ORDER)
+        if self.totals is None:
+            self.since = now or datetime.utcnow()
+        else:
+            for role_name in USER_ROLES_IN_ORDER:
+                old, new = self.totals[role_name], totals[role_name]
+                for key in set(old) | set(new):
+                    self._add_change(role_name, key, new.get(key, 0) - old.get(key, 0))
+        self.totals = totals
+
+    def add_change(self, role_name, item, variant, delta):
+        """One count of a role table went up or down by 'delta'. Ignored until the baseline is set."""
+        if self.totals is None or not delta:
+            return
+        role_totals = self.totals[role_name]
+        total = role_totals.get((item, variant), 0) + delta
+        if total:
+            role_totals[(item, variant)] = total
+        else:
+            role_totals.pop((item, variant), None)
+        self._add_change(role_name, (item, variant), delta)
+
+    def _add_change(self, role_name, key, delta):
+        change_key = (role_name,) + key
+        change = self.changes.get(change_key, 0) + delta
+        if change:
+            self.changes[change_key] = change
+        else:
+            self.changes.pop(change_key, None)
+
+    def take(self, now: Optional[datetime] = None, max_length=MAX_MESSAGE_LENGTH) -> Optional[List[str]]:
+        """
+        The messages of a digest, in Discord markdown, each at most max_length characters. Changes are then cleared
+        for the next digest. Returns None if nothing changed since the last digest, or if the baseline is not set yet.
+        """
+        now = now or datetime.utcnow()
+        since, changes = self.since, self.changes
+        self.since, self.changes = now, {}
+        self._taken = since, changes
+        if self.totals is None or not changes:
+            return None
+
+        keys = sorted(set(key for role_totals in self.totals.values() for key in role_totals))
+        total_lines = [('item', 'variant', 'TOTAL') + tuple(_ROLE_COLUMNS.values())]
+        for key in keys:
+            counts = [self.totals[role_name].get(key, 0) for role_name in _ROLE_COLUMNS]
+            total_lines.append(key + (sum(counts),) + tuple(counts))
+
+        change_lines = [('{0:+d}'.format(change), item, variant, _ROLE_COLUMNS[role_name])
+                        for (role_name, item, variant), change in sorted(changes.items(), key=_change_order)]
+
+        heading = "Digest of inventory changes since {0:%Y-%m-%d %H:%M} UTC:".format(since)
+        total_table = _format_table(total_lines)
+        blocks = _format_blocks(heading, [], _format_table(change_lines), max_length) + \
+            _format_blocks("Totals:", total_table[:1], total_table[1:], max_length)
+        messages = [blocks[0]]
+        for block in blocks[1:]:
+            if len(messages[-1]) + 1 + len(block) <= max_length:
+                messages[-1] += '\n' + block
+            else:
+                messages.append(block)
+        return messages
+
+    def untake(self):
+        """
+        Put back the changes of the last digest taken, e.g. when it could not be posted. They go into the next digest,
+        together with the changes made since.
+        """
+        if self._taken is None:
+            return
+        since, changes = self._taken
+        self._taken = None
+        self.since = since
+        for (role_name, *key), change in changes.items():
+            self._add_change(role_name, tuple(key), change)
+
+
+def _change_order(change_item):
+    (role_name, item, variant), _change = change_item
+    return item, variant, list(_ROLE_COLUMNS).index(role_name)
+
+
+def _format_table(lines):
+    """Lines of text, with the values of each column right-aligned."""
+    widths = [max(len(str(line[i])) for line in lines) for i in range(len(lines[0]))]
+    return [' '.join(str(value).rjust(width) for value, width in zip(line, widths)) for line in lines]
+
+
+def _format_blocks(heading, header, rows, max_length):
+    """
+    A heading, and table lines in a code block, split into several blocks of at most max_length characters if needed.
+    Each block repeats the 'header' lines of the table. Blocks after the first have the heading marked '(continued)'.
+    """
+    blocks = []
+    block_heading, block_rows = heading, []
+    for row in rows:
+        if block_rows and len(_format_block(block_heading, header + block_rows + [row])) > max_length:
+            blocks.append(_format_block(block_heading, header + block_rows))
+            block_heading, block_rows = heading + ' (continued)', []
+        block_rows.append(row)
+    blocks.append(_format_block(block_heading, header + block_rows))
+    return blocks
+
+
+def _format_block(heading, lines):
+    return "{0}\n```{1}```".format(heading, '\n'.join(lines))
+
+
+class DigestTable:
+    """An inventory table that tells an InventoryDigest about the counts it changes. Reads go to the table."""
+
+    def __init__(self, table, role_name, digest):
+        self.table = table
+        self.role_name = role_name
+        self.digest = digest
+
+    def __getattr__(self, name):
+        return getattr(self.table, name)
+
+    def __len__(self):
+        return len(self.table)
+
+    def upsert(self, key, count, update_time):
+        previous_count = self.table.get_count(key)
+        self.table.upsert(key, count, update_time)
+        self.digest.add_change(self.role_name, key[1], key[2], count - previous_count)
+
+    def drop(self, key):
+        previous_count = self.table.get_count(key)
+        self.table.drop(key)
+        self.digest.add_change(self.role_name, key[1], key[2], -previous_count)
+
+    def drop_user(self, user_id):
+        rows = self.table.get_user_rows(user_id)
+        self.table.drop_user(user_id)
+        for row in rows:
+            self.digest.add_change(self.role_name, row.key[1], row.key[2], -row.count)
+
+    @classmethod
+    def wrap_tables(cls, tables, digest):
+        """The tables of a store, keyed by role name, wrapped for the inventory engine."""
+        return OrderedDict((role_name, cls(table, role_name, digest)) for role_name, table in tables.items())
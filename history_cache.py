@@ -0,0 +1,116 @@
+"""
+In-memory cache of inventory channel history, for point-in-time queries such as 'report --at'.
+
+Each query walks the transaction log back from some point in time to the nearest sync point before it. Nearby
+queries walk over mostly the same messages. HistoryCache keeps one contiguous run of channel messages, oldest first,
+and only fetches the pages a query needs beyond that run. Sync point attachments are cached too, by message id.
+The run is at most max_messages long. Extending it forgets messages at the other end, and the attachments of these.
+
+Messages posted by the bot in the transaction log are never edited, so cached messages do not go stale.
+This module does not import discord.py. A channel is anything with an async history() like discord.py's.
+"""
+from datetime import datetime
+from typing import Optional
+
+__all__ = {
+    "HistoryCache",
+}
+
+
+class HistoryCache:
+    def __init__(self, channel, page_size=100, max_messages=20000):
+        self.channel = channel
+        self.page_size = page_size
+        self.max_messages = max_messages
+        self.messages = []  # Contiguous channel history, oldest first
+        self.reached_beginning = False  # Whether messages[0] is the first message of the channel
+        self.covered_until = None  # The run holds every message posted before this time
+        self.attachments = {}  # maps message id to the bytes of its first attachment, for messages in the run
+        self.pages_fetched = 0
+
+    async def _fetch_page(self, before) -> list:
+        """One page of history right before a message or a datetime, oldest first."""
+        self.pages_fetched += 1
+        page = [msg async for msg in self.channel.history(limit=self.page_size, before=before)]
+        page.reverse()
+        return page
+
+    async def _extend_to(self, when):
+        """Make sure the cache holds the messages right before 'when'."""
+        if self.covered_until is not None and when <= self.covered_until:
+            return
+
+        page = await self._fetch_page(when)
+        if self.messages and page and page[0].id <= self.messages[-1].id:
+            # The page overlaps the cached run. Only keep what is newer.
+            newest_id = self.messages[-1].id
+            self.messages.extend(msg for msg in page if msg.id > newest_id)
+        elif page or not self.messages:
+            # Nothing in common with the cached run. Start a new one.
+            self.messages = page
+            self.reached_beginning = len(page) < self.page_size
+        # Messages yet to be posted are not covered, even if 'when' is in the future
+        self.covered_until = min(when, datetime.utcnow())
+
+        if len(self.messages) > self.max_messages:
+            # Forget the oldest messages. This keeps the run contiguous.
+            del self.messages[:len(self.messages) - self.max_messages]
+            self.reached_beginning = False
+        self._forget_attachments()
+
+    async def _extend_back(self) -> int:
+        """Fetch one page older than the cached run. Returns how many messages it added, 0 at the beginning."""
+        if self.reached_beginning:
+            return 0
+        page = await self._fetch_page(self.messages[0] if self.messages else None)
+        self.reached_beginning = len(page) < self.page_size
+        self.messages[:0] = page
+
+        if len(self.messages) > self.max_messages:
+            # Forget the newest messages. The run then only covers the time before the newest one left.
+            del self.messages[max(self.max_messages, len(page)):]
+            self.covered_until = self.messages[-1].created_at
+            self._forget_attachments()
+        return len(page)
+
+    def _forget_attachments(self):
+        """Forget the attachments of messages that are no longer in the run."""
+        if not self.messages:
+            self.attachments.clear()
+            return
+        oldest_id, newest_id = self.messages[0].id, self.messages[-1].id
+        for message_id in [message_id for message_id in self.attachments
+                           if not oldest_id <= message_id <= newest_id]:
+            del self.attachments[message_id]
+
+    async def history_before(self, when, limit: Optional[int] = None):
+        """
+        Channel messages posted before 'when', newest first. Like channel.history(). 'when' is a naive UTC datetime,
+        or a message that an earlier query returned, e.g. a sync point to skip.
+        """
+        if isinstance(when, datetime):
+            await self._extend_to(when)
+            index = len(self.messages)
+            while index and self.messages[index - 1].created_at >= when:
+                index -= 1
+        else:
+            await self._extend_to(when.created_at)
+            index = len(self.messages)
+            while index and self.messages[index - 1].id >= when.id:
+                index -= 1
+
+        yielded = 0
+        while limit is None or yielded < limit:
+            if not index:
+                index = await self._extend_back()
+                if not index:
+                    return
+            index -= 1
+            yielded += 1
+            yield self.messages[index]
+
+    async def read_attachment(self, msg):
+        """The bytes of the first attachment of a message. Only downloaded once."""
+        if msg.id not in self.attachments:
+            self.attachments[msg.id] = await msg.attachments[0].read()
+        return self.attachments[msg.id]
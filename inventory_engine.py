@@ -0,0 +1,423 @@
+"""
+Inventory engine of Count Bot: the rules behind count, add, remove, drop, 'collect from' and confirm.
+
+The engine knows nothing about Discord. It takes user ids, item and variant names as typed by users, and returns
+typed plans, or raises InventoryError with a message meant for the user. Commands are carried out in two steps,
+so that the Discord commands can persist a transaction record before memory is updated:
+   plan = engine.plan_count(...)     # validate, resolve aliases, compute the new count. Nothing is changed.
+   engine.apply_count(plan, time)    # update the inventory tables
+
+Tables are looked up by user role. The bot keeps its tables in pandas dataframes (see DataFrameInventoryTable in
+count_bot.py). MemoryInventoryTable keeps rows in plain dicts, for batch jobs, tests and benchmarks.
+
+This module is pure Python. It imports neither discord.py nor pandas. Run it to benchmark the engine:
+   python inventory_engine.py [number of operations]
+"""
+import sys
+import time
+
+from datetime import datetime
+from typing import NamedTuple, Optional
+
+from bot_catalog import get_catalog
+from inventory_schema import USER_ROLE_MAKERS, USER_ROLE_COLLECTORS, USER_ROLE_DROPBOXES, USER_ROLES_IN_ORDER
+
+__all__ = {
+    "InventoryError",
+    "NegativeCountError",
+    "InventoryRow",
+    "CountPlan",
+    "RemovePlan",
+    "TransferPlan",
+    "DropPlan",
+    "MemoryInventoryTable",
+    "InventoryEngine",
+    "resolve_item_name",
+    "resolve_variant_name",
+    "parse_count_list",
+}
+
+
+class InventoryError(Exception):
+    """
+    A command that cannot be carried out. 'message' is meant for the user. 'rows' are the inventory rows that
+    explain the problem, if any. 'show_help' asks for the help page of the command to be shown.
+    """
+
+    def __init__(self, message, rows=None, show_help=False):
+        super().__init__(message)
+        self.message = message
+        self.rows = rows
+        self.show_help = show_help
+
+
+class NegativeCountError(InventoryError):
+    pass
+
+
+class InventoryRow(NamedTuple):
+    key: tuple  # (user id, item, variant), plus second user id in transaction tables such as dropboxes
+    count: int
+    update_time: Optional[datetime]
+
+
+class CountPlan(NamedTuple):
+    role_name: str
+    user_id: int
+    item: str
+    variant: str
+    previous_count: int
+    total: int
+
+
+class RemovePlan(NamedTuple):
+    role_name: str
+    user_id: int
+    item: Optional[str]  # None when all items of the user are removed
+    variant: Optional[str]
+
+
+class TransferPlan(NamedTuple):
+    maker_plan: CountPlan
+    collector_plan: CountPlan
+
+
+class DropPlan(NamedTuple):
+    maker_plan: CountPlan
+    collector_id: int
+    previous_count: int  # previous count in the dropbox
+    new_count: int
+
+    @property
+    def dropbox_key(self):
+        return self.maker_plan.user_id, self.maker_plan.item, self.maker_plan.variant, self.collector_id
+
+
+def resolve_item_name(item):
+    catalog = get_catalog()
+    item_name = catalog.alias_maps.get(item.lower())
+    if not item_name:
+        raise InventoryError("❌  Item '{0}' is not something I know about. See help.".format(item), show_help=True)
+    if item_name not in catalog.item_choices:
+        raise InventoryError("❌  '{0}' is not valid item. See help.".format(item_name), show_help=True)
+    return item_name
+
+
+def resolve_variant_name(item, variant):
+    catalog = get_catalog()
+    variant_name = catalog.alias_maps.get(variant.lower())
+    if not variant_name:
+        raise InventoryError("❌  Variant '{0}' is not something I know about. See help.".format(variant),
+                             show_help=True)
+    variants = catalog.variant_choices.get(item)
+    if variant_name not in variants:
+        raise InventoryError("❌  '{0}' is not valid variant of item '{1}'. See help.".format(variant_name, item),
+                             show_help=True)
+    return variant_name
+
+
+def parse_count_list(text):
+    """
+    Parse several counts separated by commas, such as '12 ver pla, 30 pru petg, 5 ear', into a list of
+    (count, item, variant) tuples. Item and variant are left unresolved, and may be None.
+    """
+    counts = []
+    for segment in text.split(','):
+        words = segment.split()
+        if not 1 <= len(words) <= 3 or not words[0].lstrip('-').isdigit():
+            raise InventoryError("❌  '{0}' is not a count such as '12 ver pla'. See help.".format(segment.strip()),
+                                 show_help=True)
+        words += [None] * (3 - len(words))
+        counts.append((int(words[0]), words[1], words[2]))
+    return counts
+
+
+class MemoryInventoryTable:
+    """Inventory table kept in a dict keyed by primary key, with indexes by user and by second user."""
+
+    def __init__(self, rows=()):
+        self._rows = {}
+        self._keys_by_user = {}
+        self._keys_by_second_user = {}
+        for row in rows:
+            self.upsert(row.key, row.count, row.update_time)
+
+    def __len__(self):
+        return len(self._rows)
+
+    def rows(self):
+        return sorted(self._rows.values())
+
+    def has_row(self, key):
+        return key in self._rows
+
+    def get_count(self, key):
+        row = self._rows.get(key)
+        return row.count if row else 0
+
+    def get_user_rows(self, user_id):
+        return sorted(self._rows[key] for key in self._keys_by_user.get(user_id, ()))
+
+    def get_second_user_rows(self, second_user_id):
+        return sorted(self._rows[key] for key in self._keys_by_second_user.get(second_user_id, ()))
+
+    def upsert(self, key, count, update_time):
+        if key not in self._rows:
+            self._keys_by_user.setdefault(key[0], set()).add(key)
+            if len(key) > 3:
+                self._keys_by_second_user.setdefault(key[3], set()).add(key)
+        self._rows[key] = InventoryRow(key, count, update_time)
+
+    def drop(self, key):
+        del self._rows[key]
+        self._discard_index_key(self._keys_by_user, key[0], key)
+        if len(key) > 3:
+            self._discard_index_key(self._keys_by_second_user, key[3], key)
+
+    def drop_user(self, user_id):
+        for key in list(self._keys_by_user.get(user_id, ())):
+            self.drop(key)
+
+    @staticmethod
+    def _discard_index_key(index, index_key, key):
+        keys = index[index_key]
+        keys.discard(key)
+        if not keys:
+            del index[index_key]
+
+
+class InventoryEngine:
+    """Inventory rules over a set of tables, one per user role."""
+
+    def __init__(self, tables):
+        self.tables = tables
+
+    @classmethod
+    def in_memory(cls):
+        return cls({role_name: MemoryInventoryTable() for role_name in USER_ROLES_IN_ORDER})
+
+    def get_user_rows(self, role_name, user_id):
+        return self.tables[role_name].get_user_rows(user_id)
+
+    def get_collector_dropbox_rows(self, collector_id, maker_id=None):
+        rows = self.tables[USER_ROLE_DROPBOXES].get_second_user_rows(collector_id)
+        if maker_id is not None:
+            rows = [row for row in rows if row.key[0] == maker_id]
+        return rows
+
+    def plan_count(self, role_name, user_id, total, item=None, variant=None, delta=False) -> CountPlan:
+        """
+        Plan for count, add and reset. Item and variant can be left out if the user's records narrow them down
+        to a single row.
+        """
+        table = self.tables[role_name]
+
+        if not item or not variant:
+            # Note that if item is None, then variant must also be None
+
+            # The user is updating count without fully specifying both item and variant args.
+            # Do a search to see if it is possible to narrow down recorded items to just one item.
+            user_rows = table.get_user_rows(user_id)
+            candidates = user_rows
+
+            if not item:
+                if not user_rows:
+                    raise InventoryError('❌  You have not recorded any item types yet. '
+                                         'Cannot update count without a specific item.', show_help=True)
+                elif len(user_rows) > 1:
+                    raise InventoryError("❌  Found more than one type of item. Please be more specific with item "
+                                         "type. Or use 'reset' to remove item types. See help.",
+                                         rows=user_rows, show_help=True)
+            else:
+                item = resolve_item_name(item)
+                candidates = [row for row in user_rows if row.key[1] == item]
+
+                # Some items have no variants
+                if get_catalog().variant_choices.get(item) == [" "]:
+                    variant = " "
+                elif not candidates:
+                    raise InventoryError("❌  You have no recorded variant of type '{0}'. "
+                                         "Please specify a variant.".format(item), rows=candidates, show_help=True)
+                elif len(candidates) > 1:
+                    raise InventoryError("❌  Found more than one variant of item. Please be more specific with "
+                                         "variant name. Or use 'reset' to remove item types. See help.",
+                                         rows=candidates, show_help=True)
+
+            if len(candidates) == 1:
+                # There is only one row in the record. Retrieve item and variant names from the single record.
+                item, variant = candidates[0].key[1:3]
+
+        item = resolve_item_name(item)
+        variant = resolve_variant_name(item, variant)
+
+        current_count = table.get_count((user_id, item, variant))
+        if delta:
+            # this is not an update of current count, but a delta addition to current count.
+            total += current_count
+
+        if total < 0:
+            raise NegativeCountError("❌  This results in a negative count of '{0}'. Current '{1}' count is {2}.".format(
+                total, role_name, current_count))
+
+        return CountPlan(role_name, user_id, item, variant, current_count, total)
+
+    def plan_counts(self, role_name, user_id, counts) -> list:
+        """
+        Plan for several counts of one user in one command, from (count, item, variant) tuples.
+        All of them are validated before anything changes. An item and variant may only be counted once.
+        """
+        plans = []
+        for total, item, variant in counts:
+            plan = self.plan_count(role_name, user_id, total, item, variant)
+            if any((p.item, p.variant) == (plan.item, plan.variant) for p in plans):
+                item_variant = '{0} {1}'.format(plan.item, plan.variant).strip()
+                raise InventoryError("❌  '{0}' is counted more than once. See help.".format(item_variant),
+                                     show_help=True)
+            plans.append(plan)
+        return plans
+
+    def apply_count(self, plan: CountPlan, update_time):
+        self.tables[plan.role_name].upsert((plan.user_id, plan.item, plan.variant), plan.total, update_time)
+
+    def plan_remove(self, role_name, user_id, item=None, variant=None) -> RemovePlan:
+        """Plan for remove. 'remove all' removes every item of the user."""
+        table = self.tables[role_name]
+        user_rows = table.get_user_rows(user_id)
+
+        if not user_rows:
+            raise InventoryError('❌  You have not recorded any item types. There is nothing to remove.')
+
+        if item == 'all':
+            return RemovePlan(role_name, user_id, None, None)
+
+        if not item and not variant:
+            if len(user_rows) > 1:
+                raise InventoryError("❌  Found more than one types of items. Please be more specific. See help.",
+                                     rows=user_rows, show_help=True)
+            item, variant = user_rows[0].key[1:3]
+
+        if item and not variant:
+            item = resolve_item_name(item)
+            candidates = [row for row in user_rows if row.key[1] == item]
+            if len(candidates) > 1:
+                raise InventoryError("❌  Found more than one variant of item '{0}'. "
+                                     "Please be more specific. See help.".format(item),
+                                     rows=candidates, show_help=True)
+            elif not candidates:
+                raise InventoryError("❌  You have no more items of this type to remove.")
+            variant = candidates[0].key[2]
+
+        item = resolve_item_name(item)
+        variant = resolve_variant_name(item, variant)
+
+        if not table.has_row((user_id, item, variant)):
+            raise InventoryError("❌  You have no more items of this type to remove.")
+
+        return RemovePlan(role_name, user_id, item, variant)
+
+    def apply_remove(self, plan: RemovePlan):
+        table = self.tables[plan.role_name]
+        if plan.item is None:
+            table.drop_user(plan.user_id)
+        else:
+            table.drop((plan.user_id, plan.item, plan.variant))
+
+    def plan_collect_from(self, maker_id, collector_id, num, item, variant=None) -> TransferPlan:
+        """Plan for a collector taking num items from a maker. Both sides are validated before anything changes."""
+        if num == 0:
+            raise InventoryError("❌  Collecting 0 items is not a very useful exercise.")
+
+        maker_plan = self.plan_count(USER_ROLE_MAKERS, maker_id, -num, item, variant, delta=True)
+        collector_plan = self.plan_count(USER_ROLE_COLLECTORS, collector_id, num, item, variant, delta=True)
+        return TransferPlan(maker_plan, collector_plan)
+
+    def plan_drop(self, maker_id, collector_id, num, item=None, variant=None) -> DropPlan:
+        """Plan for a maker dropping num items into the dropbox of a collector. num may be negative to take back."""
+        maker_plan = self.plan_count(USER_ROLE_MAKERS, maker_id, -num, item, variant, delta=True)
+
+        if num >= 0:
+            # Check the validity of the 'collect from' that some collector will eventually need to do.
+            self.plan_collect_from(maker_id, collector_id, num, maker_plan.item, maker_plan.variant)
+
+        dropbox_key = (maker_id, maker_plan.item, maker_plan.variant, collector_id)
+        current_dropped_count = self.tables[USER_ROLE_DROPBOXES].get_count(dropbox_key)
+        new_dropbox_count = num + current_dropped_count
+
+        if new_dropbox_count < 0:
+            raise NegativeCountError("❌  Dropbox count would become negative after this operation: '{0}'.".format(
+                new_dropbox_count))
+
+        return DropPlan(maker_plan, collector_id, current_dropped_count, new_dropbox_count)
+
+    def apply_dropbox_count(self, plan: DropPlan, update_time):
+        """Update the dropbox side of a drop. The maker side is applied separately with apply_count()."""
+        table = self.tables[USER_ROLE_DROPBOXES]
+        if plan.new_count != 0:
+            table.upsert(plan.dropbox_key, plan.new_count, update_time)
+        else:
+            # Do not record '0' count in transaction tables such as drop-box
+            table.drop(plan.dropbox_key)
+
+    def empty_dropbox(self, dropbox_key):
+        """Remove a dropbox entry whose items a collector has confirmed. See also plan_count() for the collector."""
+        self.tables[USER_ROLE_DROPBOXES].drop(dropbox_key)
+
+    def take_from_dropbox(self, dropbox_key, count, update_time):
+        """A collector confirmed 'count' items of a dropbox entry. The entry is removed once it is empty."""
+        table = self.tables[USER_ROLE_DROPBOXES]
+        left = table.get_count(dropbox_key) - count
+        if left:
+            table.upsert(dropbox_key, left, update_time)
+        else:
+            table.drop(dropbox_key)
+
+    def apply_trans_log_record(self, record, update_time):
+        """
+        Apply one transaction record, as decoded by trans_log.decode_trans_log_record(). Hot standbys use this to
+        follow the posts of the writer process.
+        """
+        table = self.tables[record.role_name]
+
+        if (record.item, record.variant) == ('remove', 'all'):
+            table.drop_user(record.member_id)
+            return
+
+        if record.collector_id is None:
+            key = (record.member_id, record.item, record.variant)
+        else:
+            key = (record.member_id, record.item, record.variant, record.collector_id)
+
+        count = int(record.command.split()[1]) if record.command.startswith('count') else None
+        if count is None or (count == 0 and record.collector_id is not None):
+            # Removed rows, and emptied dropbox entries, are dropped from the inventory
+            if table.has_row(key):
+                table.drop(key)
+        else:
+            table.upsert(key, count, update_time)
+
+
+def benchmark(num_operations=1000000):
+    """Drive cycles of count, add, drop and confirm through an in-memory engine. Returns elapsed seconds."""
+    engine = InventoryEngine.in_memory()
+    update_time = datetime.utcnow()
+    collector_id = 1
+    start = time.perf_counter()
+    for i in range(num_operations // 4):
+        maker_id = 100 + i % 1000
+        engine.apply_count(engine.plan_count(USER_ROLE_MAKERS, maker_id, 20, 'pru', 'pet'), update_time)
+        engine.apply_count(engine.plan_count(USER_ROLE_MAKERS, maker_id, 5, delta=True), update_time)
+        plan = engine.plan_drop(maker_id, collector_id, 10)
+        engine.apply_count(plan.maker_plan, update_time)
+        engine.apply_dropbox_count(plan, update_time)
+        for row in engine.get_collector_dropbox_rows(collector_id, maker_id):
+            engine.empty_dropbox(row.key)
+            engine.apply_count(engine.plan_count(USER_ROLE_COLLECTORS, collector_id, row.count, *row.key[1:3],
+                                                 delta=True), update_time)
+    return time.perf_counter() - start
+
+
+if __name__ == '__main__':
+    num_operations = int(sys.argv[1]) if len(sys.argv) > 1 else 1000000
+    elapsed = benchmark(num_operations)
+    print('{0} operations in {1:.3f} sec ({2:.0f} operations/sec)'.format(
+        num_operations, elapsed, num_operations / elapsed))
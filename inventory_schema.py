@@ -0,0 +1,70 @@
+"""
+Column names, primary keys and user roles of Count Bot inventory tables, as persisted in CSV sync points.
+
+This module is pure Python. It imports neither discord.py nor pandas.
+"""
+
+__all__ = {
+    "COL_USER_ID",
+    "COL_USER_NAME",
+    "COL_ITEM",
+    "COL_VARIANT",
+    "COL_COUNT",
+    "COL_UPDATE_TIME",
+    "COL_HUMAN_INTERVAL",
+    "COL_SECOND_USER_ID",
+    "COL_SECOND_USER_NAME",
+    "COL_MAKER_NAME",
+    "COL_COLLECTOR_NAME",
+    "USER_ID_COLUMNS",
+    "USER_ID_TO_NAME_MAP",
+    "PERSONAL_PRIMARY_KEY",
+    "PERSONAL_DF_COLUMNS",
+    "TRANSACTION_PRIMARY_KEY",
+    "TRANSACTION_DF_COLUMNS",
+    "USER_ROLE_MAKERS",
+    "USER_ROLE_COLLECTORS",
+    "USER_ROLE_DROPBOXES",
+    "USER_ROLES_IN_ORDER",
+}
+
+COL_USER_ID = 'user_id'
+COL_USER_NAME = 'user'
+COL_ITEM = 'item'
+COL_VARIANT = 'variant'
+COL_COUNT = 'count'
+
+# DiscordPy returns 'naive' datetime in UTC, not 'aware' datetime.
+# For conformity I just use naive UTC datetime as well. These are stored into CSV files also in naive UTC datetime.
+COL_UPDATE_TIME = 'update_time'
+COL_HUMAN_INTERVAL = 'updated'
+
+COL_SECOND_USER_ID = 'second_user_id'
+COL_SECOND_USER_NAME = 'second_user'
+
+COL_MAKER_NAME = 'maker'
+COL_COLLECTOR_NAME = 'collector'
+
+USER_ID_COLUMNS = (COL_USER_ID, COL_SECOND_USER_ID)
+USER_ID_TO_NAME_MAP = {
+    COL_USER_ID: COL_USER_NAME,
+    COL_SECOND_USER_ID: COL_SECOND_USER_NAME,
+}
+
+# Personal inventories are where a user alone is part of the primary key.
+# This includes maker inventories and collector inventories.
+PERSONAL_PRIMARY_KEY = [COL_USER_ID, COL_ITEM, COL_VARIANT]
+PERSONAL_DF_COLUMNS = PERSONAL_PRIMARY_KEY + [COL_COUNT, COL_UPDATE_TIME]
+
+# A transaction inventory is where we record a transaction between two users.
+# So both users need to be part of the primary key.
+TRANSACTION_PRIMARY_KEY = PERSONAL_PRIMARY_KEY + [COL_SECOND_USER_ID]
+TRANSACTION_DF_COLUMNS = TRANSACTION_PRIMARY_KEY + [COL_COUNT, COL_UPDATE_TIME]
+
+USER_ROLE_MAKERS = 'makers'  # Stores what makers have made, but not yet passed onto collectors
+USER_ROLE_COLLECTORS = 'collectors'  # Stores what collectors have collected from makers
+USER_ROLE_DROPBOXES = 'dropboxes'  # Dropboxes serving as intermediate buffer between makers and collectors
+
+# DO NOT CHANGE THE ORDER OF ITEMS IN THIS LIST WITHOUT CAREFUL CONSIDERATION.
+# The order of items in this list is important. It is used to persist CSV tables into CSV sync point
+USER_ROLES_IN_ORDER = [USER_ROLE_MAKERS, USER_ROLE_COLLECTORS, USER_ROLE_DROPBOXES]
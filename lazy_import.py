@@ -0,0 +1,37 @@
+"""
+Deferred imports of heavy dependencies.
+
+Importing pandas alone takes about half a second. Modules that only need it on some code paths bind it with
+lazy_import() instead: the real import happens on first attribute access, e.g. the first pd.DataFrame() call.
+LazyLoader does not lock that first access, so a module that other threads may touch is loaded with load_now()
+first, in the main thread.
+"""
+import importlib.util
+import sys
+
+__all__ = {
+    "lazy_import",
+    "load_now",
+}
+
+
+def lazy_import(module_name):
+    """Returns a module object that is only executed when one of its attributes is first accessed."""
+    if module_name in sys.modules:
+        return sys.modules[module_name]
+
+    spec = importlib.util.find_spec(module_name)
+    if spec is None:
+        raise ModuleNotFoundError("No module named '{0}'".format(module_name), name=module_name)
+    loader = importlib.util.LazyLoader(spec.loader)
+    spec.loader = loader
+    module = importlib.util.module_from_spec(spec)
+    sys.modules[module_name] = module
+    loader.exec_module(module)
+    return module
+
+
+def load_now(module):
+    """Finish the import of a module returned by lazy_import(), if it is not done yet. Returns the module."""
+    module.__dict__  # Any attribute access executes a lazy module
+    return module
@@ -0,0 +1,146 @@
+"""
+Leader election for Count Bot processes sharing one bot account.
+
+Every process logged in with the same bot token receives the same Discord events. Only one of them may act as the
+writer of a guild's transaction log. The others are hot standbys: they keep a replayed inventory warm, and take over
+once the writer stops renewing its lease.
+
+A lease is a (holder, expiry) record. ChannelLease keeps it in a pinned bot message of the inventory channel, so
+processes on different hosts can coordinate without any storage of their own. FileLease keeps it in a local file
+guarded by a file lock. It is a stand-in for tests, and for several processes running on the same host.
+"""
+import asyncio
+import fcntl
+import getpass
+import json
+import os
+import socket
+import time
+
+from typing import NamedTuple, Optional
+
+from bot_config import get_config
+
+__all__ = {
+    "LeaseState",
+    "ChannelLease",
+    "FileLease",
+    "get_lease_holder_id",
+}
+
+LEASE_DURATION_SECONDS = get_config().lease_duration_seconds  # A writer that does not renew within this period is presumed dead
+LEASE_SETTLE_SECONDS = 1.0  # After taking over a lease, wait this long and read back to detect a racing standby
+LEASE_TEXT_PREFIX = '🔒 Bot lease: '
+
+
+class LeaseState(NamedTuple):
+    holder: str
+    expires_at: float  # seconds since epoch
+
+
+def get_lease_holder_id():
+    """Identify this process, in the same spirit as the spoiler text printed by 'who are you'."""
+    return '{0}@{1}/{2}'.format(getpass.getuser(), socket.gethostname(), os.getpid())
+
+
+def _is_free_for(state: Optional[LeaseState], holder, now):
+    return state is None or state.holder == holder or state.expires_at <= now
+
+
+class ChannelLease:
+    """Lease record kept in a pinned message posted by the bot in the inventory channel."""
+
+    def __init__(self, channel, bot_user):
+        self.channel = channel
+        self.bot_user = bot_user
+
+    @staticmethod
+    def format_lease_text(state: LeaseState):
+        return '{0}{1} until {2:.0f}'.format(LEASE_TEXT_PREFIX, state.holder, state.expires_at)
+
+    @staticmethod
+    def parse_lease_text(text) -> Optional[LeaseState]:
+        if not text.startswith(LEASE_TEXT_PREFIX):
+            return None
+        holder, _until, expires_at = text[len(LEASE_TEXT_PREFIX):].rsplit(maxsplit=2)
+        return LeaseState(holder, float(expires_at))
+
+    async def _find_lease_message(self):
+        # Pins are returned newest first. If two processes raced to create a lease message, the newest one counts.
+        for msg in await self.channel.pins():
+            if msg.author == self.bot_user and msg.content.startswith(LEASE_TEXT_PREFIX):
+                return msg
+        return None
+
+    async def read(self) -> Optional[LeaseState]:
+        msg = await self._find_lease_message()
+        return self.parse_lease_text(msg.content) if msg else None
+
+    async def try_acquire(self, holder, now=None):
+        """Take or renew the lease. Returns True if this holder is the writer until the new expiry."""
+        now = now or time.time()
+        msg = await self._find_lease_message()
+        state = self.parse_lease_text(msg.content) if msg else None
+        if not _is_free_for(state, holder, now):
+            return False
+
+        text = self.format_lease_text(LeaseState(holder, now + LEASE_DURATION_SECONDS))
+        if msg:
+            await msg.edit(content=text)
+        else:
+            msg = await self.channel.send(text)
+            await msg.pin()
+
+        if state and state.holder == holder:
+            return True
+
+        # Two standbys may both find an expired lease and overwrite it. The last writer wins. Read it back.
+        await asyncio.sleep(LEASE_SETTLE_SECONDS)
+        state = await self.read()
+        return state is not None and state.holder == holder
+
+    async def release(self, holder):
+        msg = await self._find_lease_message()
+        state = self.parse_lease_text(msg.content) if msg else None
+        if state and state.holder == holder:
+            await msg.edit(content=self.format_lease_text(LeaseState(holder, 0)))
+
+
+class FileLease:
+    """Lease record kept in a local JSON file. Read-modify-write cycles are serialized with an exclusive file lock."""
+
+    def __init__(self, path):
+        self.path = path
+
+    def _locked_update(self, update):
+        with open(self.path + '.lock', 'a') as lock_file:
+            fcntl.flock(lock_file, fcntl.LOCK_EX)
+            try:
+                state = None
+                if os.path.isfile(self.path):
+                    with open(self.path) as f:
+                        state = LeaseState(**json.load(f))
+                new_state = update(state)
+                if new_state is not None:
+                    with open(self.path, 'w') as f:
+                        json.dump(new_state._asdict(), f)
+                return new_state or state
+            finally:
+                fcntl.flock(lock_file, fcntl.LOCK_UN)
+
+    async def read(self) -> Optional[LeaseState]:
+        return self._locked_update(lambda state: None)
+
+    async def try_acquire(self, holder, now=None):
+        now = now or time.time()
+
+        def update(state):
+            if not _is_free_for(state, holder, now):
+                return None
+            return LeaseState(holder, now + LEASE_DURATION_SECONDS)
+
+        state = self._locked_update(update)
+        return state.holder == holder and state.expires_at > now
+
+    async def release(self, holder):
+        self._locked_update(lambda state: LeaseState(holder, 0) if state and state.holder == holder else None)
@@ -0,0 +1,107 @@
+"""
+Memory statistics of the bot process, for the admin 'memory' command and the start-up log.
+
+Peak RSS comes from getrusage(), which does not exist on Windows. Current RSS is read from /proc on Linux only.
+Allocation snapshots use tracemalloc. It only sees what is allocated after tracing starts, and it slows down the
+process while it is on, so it is only started on demand.
+
+This module is pure Python. It imports neither discord.py nor pandas.
+"""
+import os
+import sys
+import tracemalloc
+import types
+
+try:
+    import resource
+except ImportError:  # Windows
+    resource = None
+
+__all__ = {
+    "get_peak_rss",
+    "get_current_rss",
+    "get_deep_size",
+    "AllocationSnapshots",
+}
+
+
+def get_peak_rss():
+    """Peak resident set size of this process in bytes, or None if it is not known on this platform."""
+    if resource is None:
+        return None
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # Linux reports KiB, macOS reports bytes
+    return peak if sys.platform == 'darwin' else peak * 1024
+
+
+def get_current_rss():
+    """Current resident set size of this process in bytes, or None if it is not known on this platform."""
+    try:
+        with open('/proc/self/statm') as f:
+            return int(f.read().split()[1]) * os.sysconf('SC_PAGE_SIZE')
+    except (OSError, ValueError, AttributeError):
+        return None
+
+
+def get_deep_size(obj, seen=None):
+    """
+    Bytes held by obj, and by the dicts, lists, tuples, sets, strings and numbers inside it. The attributes of class
+    instances are walked too, whether they are kept in __dict__ or in __slots__.
+    Objects shared by several containers, such as interned strings, are only counted once.
+    """
+    seen = set() if seen is None else seen
+    if id(obj) in seen:
+        return 0
+    seen.add(id(obj))
+
+    size = sys.getsizeof(obj)
+    if isinstance(obj, dict):
+        size += sum(get_deep_size(key, seen) + get_deep_size(value, seen) for key, value in obj.items())
+    elif isinstance(obj, (list, tuple, set, frozenset)):
+        size += sum(get_deep_size(item, seen) for item in obj)
+    elif not isinstance(obj, (type, types.ModuleType, types.FunctionType, types.MethodType)):
+        if hasattr(obj, '__dict__'):
+            size += get_deep_size(obj.__dict__, seen)
+        for name in _get_slot_names(type(obj)):
+            if hasattr(obj, name):
+                size += get_deep_size(getattr(obj, name), seen)
+    return size
+
+
+def _get_slot_names(cls):
+    """Names of the attributes that a class and its bases keep in __slots__."""
+    names = []
+    for klass in cls.__mro__:
+        slots = klass.__dict__.get('__slots__', ())
+        names.extend(name for name in ((slots,) if isinstance(slots, str) else slots)
+                     if name not in ('__dict__', '__weakref__'))
+    return names
+
+
+class AllocationSnapshots:
+    """
+    tracemalloc snapshots taken on demand. The first snapshot lists the biggest allocation sites. Each later one
+    lists what grew most since the snapshot before it.
+    """
+
+    def __init__(self, top=10):
+        self.top = top
+        self.previous = None
+
+    def take(self) -> list:
+        """Start tracing if needed, and take a snapshot. Returns one line per allocation site."""
+        if not tracemalloc.is_tracing():
+            tracemalloc.start()
+            self.previous = None
+
+        snapshot = tracemalloc.take_snapshot().filter_traces([tracemalloc.Filter(False, tracemalloc.__file__)])
+        if self.previous is None:
+            stats = snapshot.statistics('lineno')
+        else:
+            stats = snapshot.compare_to(self.previous, 'lineno')
+        self.previous = snapshot
+        return [str(stat) for stat in stats[:self.top]]
+
+    def stop(self):
+        tracemalloc.stop()
+        self.previous = None
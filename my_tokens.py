@@ -1,8 +1,13 @@
 import os
+import sys
 import json
 
+from bot_config import CONFIG_FILE_NAME, get_config, read_config_file
+
 __all__ = {
     "get_bot_token",
+    "get_guild_configs",
+    "get_catalog_config",
 }
 
 
@@ -12,20 +17,44 @@ def is_configured():
     We do not check in the configuration file into git. The configuration file contains tokens
     that must be shared outside the code.
     """
-    return os.path.isfile('_discord_config_no_commit.txt')
+    return os.path.isfile(CONFIG_FILE_NAME)
 
 
 def get_bot_token():
-    if not is_configured():
-        print('This bot is being run in a new production environment')
-        print('Please supply discord bot token')
-        bot_token = input('Bot token ID (Will be stored in plaintext in config file):')
-        f = open('_discord_config_no_commit.txt', 'w')
-        f.write(str(json.dumps({'TOKEN': bot_token})) + "\n")
-        f.close()
-    else:
-        f = open('_discord_config_no_commit.txt', 'r')
-        first = f.readline()
-        bot_token = json.loads(first.replace("\\n", ""))['TOKEN']
-        f.close()
+    """
+    The bot token, from the configuration file or the COUNT_BOT_TOKEN env var. When neither has it and the bot is
+    run from a terminal, ask for it once and store it in a new configuration file.
+    """
+    bot_token = get_config().token
+    if bot_token:
+        return bot_token
+    if is_configured() or not sys.stdin.isatty():
+        raise RuntimeError('No bot token. Set TOKEN in {0}, or the COUNT_BOT_TOKEN env var'.format(CONFIG_FILE_NAME))
+
+    print('This bot is being run in a new production environment')
+    print('Please supply discord bot token')
+    bot_token = input('Bot token ID (Will be stored in plaintext in config file):')
+    f = open(CONFIG_FILE_NAME, 'w')
+    f.write(str(json.dumps({'TOKEN': bot_token})) + "\n")
+    f.close()
     return bot_token
+
+
+def get_guild_configs():
+    """
+    Optional per-guild configuration, stored in the configuration file under the 'GUILDS' key:
+      {"TOKEN": "...", "GUILDS": {"<guild id>": {"inventory_channel": "...", "admin_role_name": "...", ...}}}
+    Returns a dict keyed by integer guild id. Guilds not listed use the bot's default configuration.
+    """
+    return {int(guild_id): config for guild_id, config in get_config().guilds.items()}
+
+
+def get_catalog_config():
+    """
+    Optional item/variant catalog, stored in the configuration file under the 'CATALOG' key:
+      {"TOKEN": "...", "CATALOG": {"verkstan": {"description": "3D Verkstan head band", "variants": ["PETG", "PLA"]},
+                                   "earsaver": {"description": "Ear saver", "variants": []}, ...}}
+    Returns None if there is no catalog in the configuration file.
+    Unlike the rest of the configuration, the file is read again on every call, so the catalog can be reloaded live.
+    """
+    return read_config_file().get('CATALOG')
@@ -0,0 +1,123 @@
+"""
+Outbound message scheduler of Count Bot.
+
+discord.py waits out rate limits (HTTP 429) inside send(). When a command handler awaits every reply, a burst of
+commands stalls the handlers themselves, and transaction log writes wait behind cosmetic replies.
+
+The Outbox keeps one queue per destination channel, drained by its own task:
+- Transaction log writes and sync points are durable. They jump ahead of pending replies, and the caller awaits
+  them, so a record is posted before the in-memory inventory is changed.
+- Replies are fire-and-forget. A reply is merged into the pending reply ahead of it while the two fit in one
+  Discord message. So the more a channel is held back by rate limits, the fewer messages it takes to catch up.
+  Beyond max_pending_replies, the oldest pending replies are dropped.
+
+This module does not import discord.py. A destination is anything with an async send(), like a discord.py
+Messageable.
+"""
+import asyncio
+
+from collections import deque
+
+__all__ = {
+    "PRIORITY_TRANS_LOG",
+    "PRIORITY_REPLY",
+    "MAX_MESSAGE_LENGTH",
+    "Outbox",
+}
+
+PRIORITY_TRANS_LOG = 0
+PRIORITY_REPLY = 1
+MAX_MESSAGE_LENGTH = 2000  # Discord rejects longer messages
+
+
+class _Entry:
+    __slots__ = ('destination', 'content', 'kwargs', 'future')
+
+    def __init__(self, destination, content, kwargs, future=None):
+        self.destination = destination
+        self.content = content
+        self.kwargs = kwargs
+        self.future = future
+
+    def can_absorb(self, other):
+        return (not self.kwargs and not other.kwargs and isinstance(self.content, str)
+                and isinstance(other.content, str)
+                and len(self.content) + 1 + len(other.content) <= MAX_MESSAGE_LENGTH)
+
+
+def _destination_key(destination):
+    """Messages to one channel share a queue, whether sent through the channel itself or a command context."""
+    channel = getattr(destination, 'channel', destination)
+    return getattr(channel, 'id', None) or id(channel)
+
+
+class Outbox:
+    def __init__(self, max_pending_replies=50):
+        self.max_pending_replies = max_pending_replies
+        self.queues = {}  # maps destination key to one deque per priority
+        self.workers = {}  # maps destination key to the task draining its queues
+        self.sent_count = 0
+        self.coalesced_count = 0
+        self.dropped_count = 0
+
+    def post_reply(self, destination, content=None, **kwargs):
+        """Queue a cosmetic reply. Replies without attachments or embeds may be merged with other replies."""
+        key = _destination_key(destination)
+        replies = self._get_queues(key)[PRIORITY_REPLY]
+        entry = _Entry(destination, content, kwargs)
+        if replies and replies[-1].can_absorb(entry):
+            replies[-1].content += '\n' + entry.content
+            self.coalesced_count += 1
+        else:
+            replies.append(entry)
+            if len(replies) > self.max_pending_replies:
+                dropped = replies.popleft()
+                self.dropped_count += 1
+                print('Outbox: dropped reply to {0}: {1:.60}'.format(key, str(dropped.content)))
+        self._ensure_worker(key)
+
+    async def post_durable(self, destination, content=None, **kwargs):
+        """Queue a transaction log write ahead of all pending replies, and wait until it is posted."""
+        key = _destination_key(destination)
+        future = asyncio.get_running_loop().create_future()
+        self._get_queues(key)[PRIORITY_TRANS_LOG].append(_Entry(destination, content, kwargs, future))
+        self._ensure_worker(key)
+        return await future
+
+    async def flush(self):
+        """Wait until every queued message has been posted."""
+        while self.workers:
+            await asyncio.gather(*self.workers.values(), return_exceptions=True)
+
+    def pending_count(self):
+        return sum(len(queue) for queues in self.queues.values() for queue in queues)
+
+    def _get_queues(self, key):
+        if key not in self.queues:
+            self.queues[key] = (deque(), deque())  # indexed by PRIORITY_TRANS_LOG and PRIORITY_REPLY
+        return self.queues[key]
+
+    def _ensure_worker(self, key):
+        worker = self.workers.get(key)
+        if worker is None or worker.done() or worker.get_loop() is not asyncio.get_running_loop():
+            self.workers[key] = asyncio.ensure_future(self._drain(key))
+
+    async def _drain(self, key):
+        queues = self.queues[key]
+        try:
+            while any(queues):
+                entry = next(queue for queue in queues if queue).popleft()
+                try:
+                    message = await entry.destination.send(entry.content, **entry.kwargs)
+                except Exception as error:
+                    if entry.future is None:
+                        print('Outbox: failed to post reply to {0}: {1!r}'.format(key, error))
+                    elif not entry.future.done():
+                        entry.future.set_exception(error)
+                else:
+                    self.sent_count += 1
+                    if entry.future is not None and not entry.future.done():
+                        entry.future.set_result(message)
+        finally:
+            if self.workers.get(key) is asyncio.current_task():
+                del self.workers[key]
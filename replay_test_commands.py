@@ -0,0 +1,307 @@
+"""
+Offline command replayer for Count Bot.
+
+test_commands.txt is a manual script of commands that used to be typed by hand into a live Discord server.
+This harness feeds these commands through the real 'bot' command dispatcher, using fake guild, channel, member
+and message objects. A stand-in inventory channel captures everything the bot posts, so the captured transaction
+log can then be replayed through _retrieve_inventory_df_from_transaction_log(). The rebuilt inventory must match
+the inventory the commands left in memory.
+
+Run it directly:
+   python replay_test_commands.py [test_commands.txt]
+"""
+import asyncio
+import discord
+import os
+import re
+import sys
+import time
+
+from datetime import datetime
+from types import SimpleNamespace
+from discord.ext import commands
+
+import leader_lease
+from count_bot import bot, on_ready, _retrieve_inventory_df_from_transaction_log, _stop_lease_keeper, \
+    GUILD_INVENTORIES, BOOTSTRAP_CLASS_BY_USER_ROLE, INVENTORY_CHANNEL, ADMIN_ROLE_NAME, COLLECTOR_ROLE_NAME, COL_COUNT
+
+TEST_COMMANDS_FILE_NAME = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'test_commands.txt')
+
+# The members referenced in test_commands.txt. Freddie is the one typing the commands.
+FAKE_GUILD_ID = 1000
+FAKE_BOT_USER_ID = 1
+FAKE_MEMBERS = [
+    # (user id, user name, role names)
+    (2001, 'Freddie',       (ADMIN_ROLE_NAME, COLLECTOR_ROLE_NAME)),
+    (2002, 'justin',        (COLLECTOR_ROLE_NAME,)),
+    (2003, 'maggotbrain',   ()),
+    (2004, 'jds2001',       ()),
+    (2005, 'timothyjryan',  ()),
+]
+FAKE_AUTHOR_NAME = 'Freddie'
+
+MENTION_PATTERN = re.compile(r'<@!?([0-9]+)>')
+
+
+class FakeUser:
+    def __init__(self, user_id, name, is_bot=False):
+        self.id = user_id
+        self.name = name
+        self.discriminator = '0001'
+        self.bot = is_bot
+
+    @property
+    def display_name(self):
+        return self.name
+
+    @property
+    def mention(self):
+        return '<@{0}>'.format(self.id)
+
+    def __str__(self):
+        return '{0}#{1}'.format(self.name, self.discriminator)
+
+
+class FakeRole:
+    def __init__(self, guild, name):
+        self.guild = guild
+        self.name = name
+
+    @property
+    def members(self):
+        return [m for m in self.guild.members if self in m.roles]
+
+
+class FakeMember(discord.Member):
+    """Passes the isinstance() checks in count_bot, without a gateway connection behind it."""
+
+    def __init__(self, guild, user_id, name, role_names):
+        self._state = guild._state
+        self._user = FakeUser(user_id, name)
+        self.guild = guild
+        self.nick = None
+        self.role_names = role_names
+        self.dm_log = []
+
+    @property
+    def roles(self):
+        return [role for role in self.guild.roles if role.name in self.role_names]
+
+    async def send(self, content=None, *, file=None, **kwargs):
+        self.dm_log.append(content)
+
+
+class FakeAttachment:
+    def __init__(self, file):
+        self.filename = file.filename
+        self._data = file.fp.read()
+        if isinstance(self._data, str):
+            self._data = self._data.encode('utf-8')
+        self.size = len(self._data)
+
+    async def read(self):
+        return self._data
+
+
+class FakeMessage:
+    def __init__(self, channel, author, content, attachments=()):
+        self._state = channel.guild._state
+        self.id = len(channel.messages) + 1
+        self.channel = channel
+        self.guild = channel.guild
+        self.author = author
+        self.content = content
+        self.attachments = list(attachments)
+        # Like Discord, users who have left the guild are still mentioned, as users rather than members
+        self.mentions = [channel.guild.get_member(int(m)) or FakeUser(int(m), m)
+                         for m in MENTION_PATTERN.findall(content)]
+        self.created_at = datetime.utcnow()
+        self.pinned = False
+
+    async def edit(self, content=None, **kwargs):
+        self.content = content
+
+    async def pin(self):
+        self.pinned = True
+
+
+class FakeInventoryChannel:
+    """Stand-in for the inventory channel. Captures every message posted to it, in chronological order."""
+
+    def __init__(self, guild, name):
+        self.id = guild.id + 1
+        self.guild = guild
+        self.name = name
+        self.type = discord.ChannelType.text
+        self.messages = []
+
+    def post(self, author, content, attachments=()):
+        msg = FakeMessage(self, author, content, attachments)
+        self.messages.append(msg)
+        return msg
+
+    async def send(self, content=None, *, file=None, **kwargs):
+        attachments = [FakeAttachment(file)] if file else []
+        return self.post(self.guild.me, content or '', attachments)
+
+    async def history(self, limit=100, before=None, after=None, oldest_first=None):
+        # Channel history is returned in reverse chronological order, unless 'after' is given.
+        # Like discord.py, 'before' and 'after' are either a message or a datetime. Also like discord.py, the limit
+        # counts messages from the end that is read first. The bound at the other end only filters these.
+        if oldest_first is None:
+            oldest_first = after is not None
+        messages = self.messages
+        if oldest_first:
+            messages = _filter_history(messages, after=after)
+            messages = messages[:limit] if limit is not None else messages
+            messages = _filter_history(messages, before=before)
+        else:
+            messages = _filter_history(messages, before=before)
+            messages = messages[-limit:] if limit is not None else messages
+            messages = _filter_history(messages, after=after)
+        for msg in (messages if oldest_first else reversed(messages)):
+            yield msg
+
+    async def pins(self):
+        return [m for m in reversed(self.messages) if m.pinned]
+
+
+def _filter_history(messages, before=None, after=None):
+    if isinstance(after, datetime):
+        messages = [m for m in messages if m.created_at > after]
+    elif after is not None:
+        messages = [m for m in messages if m.id > after.id]
+    if isinstance(before, datetime):
+        messages = [m for m in messages if m.created_at < before]
+    elif before is not None:
+        messages = [m for m in messages if m.id < before.id]
+    return messages
+
+
+class FakeGuild:
+    def __init__(self, bot_user, guild_id=FAKE_GUILD_ID):
+        self.id = guild_id
+        self.name = 'offline-replay-{0}'.format(guild_id)
+        self.shard_id = None
+        self.me = bot_user
+        self._state = SimpleNamespace(member_cache_flags=SimpleNamespace(joined=False))
+        self.roles = [FakeRole(self, ADMIN_ROLE_NAME), FakeRole(self, COLLECTOR_ROLE_NAME)]
+        self.members = [FakeMember(self, *m) for m in FAKE_MEMBERS]
+        self.channels = [FakeInventoryChannel(self, INVENTORY_CHANNEL)]
+
+    def get_member(self, user_id):
+        return discord.utils.get(self.members, id=user_id)
+
+    def get_member_named(self, name):
+        return discord.utils.find(lambda m: m.name == name or m.nick == name, self.members)
+
+    async def query_members(self, query=None, **kwargs):
+        return []
+
+
+class FakeContext(commands.Context):
+    """Replies go straight into the channel the command came from, instead of through the Discord HTTP API."""
+
+    async def send(self, content=None, **kwargs):
+        return await self.channel.send(content, **kwargs)
+
+
+def install_fake_guilds(guild_ids=(FAKE_GUILD_ID,)):
+    """Make the bot believe it is logged in and serving these guilds. All guilds share the same fake members."""
+    bot_user = FakeUser(FAKE_BOT_USER_ID, 'Count Bot', is_bot=True)
+    guilds = [FakeGuild(bot_user, guild_id) for guild_id in guild_ids]
+    bot._connection.user = bot_user
+    bot._connection._guilds.clear()
+    for inventory in GUILD_INVENTORIES.values():
+        _stop_lease_keeper(inventory)
+    GUILD_INVENTORIES.clear()
+    leader_lease.LEASE_SETTLE_SECONDS = 0  # There is only one process. No one to race with.
+    for guild in guilds:
+        bot._connection._add_guild(guild)
+    return guilds
+
+
+def read_test_commands(file_name=TEST_COMMANDS_FILE_NAME):
+    """
+    Commands are non-indented lines. Lines starting with '.' are section titles, and indented lines are notes.
+    """
+    with open(file_name) as f:
+        lines = f.read().splitlines()
+    return [line.strip() for line in lines if line.strip() and not line.startswith(('.', ' ', '-'))]
+
+
+async def _drain_scheduled_events():
+    # Errors are handled by bot listeners which are scheduled as separate tasks. Let them finish.
+    # Lease keepers run forever. Leave them alone.
+    skipped = {asyncio.current_task()} | {inventory.lease_task for inventory in GUILD_INVENTORIES.values()}
+    pending = [t for t in asyncio.all_tasks() if t not in skipped and not t.done()]
+    if pending:
+        await asyncio.gather(*pending, return_exceptions=True)
+
+
+async def run_command(guild, line, author_name=FAKE_AUTHOR_NAME, files=()):
+    """Post one command line, with optional discord.File attachments, into the inventory channel of a guild."""
+    attachments = [FakeAttachment(file) for file in files]
+    message = guild.channels[0].post(guild.get_member_named(author_name), line, attachments)
+    ctx = await bot.get_context(message, cls=FakeContext)
+    await bot.invoke(ctx)
+    await _drain_scheduled_events()
+
+
+def inventory_state(inventory):
+    state = {}
+    for role_name, df in inventory.inventory_by_user_role.items():
+        primary_key = BOOTSTRAP_CLASS_BY_USER_ROLE[role_name].primary_key
+        rows = df[primary_key + [COL_COUNT]].itertuples(index=False, name=None)
+        state[role_name] = sorted(tuple(row[:-1]) + (int(row[-1]),) for row in rows)
+    return state
+
+
+async def replay_test_commands(command_lines):
+    """
+    Drive the bot with command lines, then rebuild the inventory from the captured transaction log.
+    Returns (live state, rebuilt state, internal errors, elapsed seconds).
+    """
+    guild, = install_fake_guilds()
+
+    internal_errors = []
+
+    async def record_internal_errors(ctx, error):
+        if isinstance(error, commands.errors.CommandInvokeError):
+            internal_errors.append((ctx.message.content, error.original))
+
+    bot.add_listener(record_internal_errors, 'on_command_error')
+    try:
+        await on_ready()
+
+        start = time.perf_counter()
+        for line in command_lines:
+            await run_command(guild, line)
+        elapsed = time.perf_counter() - start
+    finally:
+        bot.remove_listener(record_internal_errors, 'on_command_error')
+
+    inventory = GUILD_INVENTORIES[guild.id]
+    live_state = inventory_state(inventory)
+    await _retrieve_inventory_df_from_transaction_log(inventory)
+    rebuilt_state = inventory_state(inventory)
+    return live_state, rebuilt_state, internal_errors, elapsed
+
+
+def main(file_name=TEST_COMMANDS_FILE_NAME):
+    command_lines = read_test_commands(file_name)
+    live_state, rebuilt_state, internal_errors, elapsed = bot.loop.run_until_complete(
+        replay_test_commands(command_lines))
+
+    for content, error in internal_errors:
+        print('Internal error in command "{0}": {1!r}'.format(content, error))
+    print('Replayed {0} commands in {1:.3f} sec ({2:.1f} commands/sec)'.format(
+        len(command_lines), elapsed, len(command_lines) / elapsed))
+
+    assert not internal_errors, 'commands failed with internal errors'
+    assert live_state == rebuilt_state, 'inventory rebuilt from the transaction log does not match'
+    print('Inventory rebuilt from the transaction log matches')
+
+
+if __name__ == '__main__':
+    main(*sys.argv[1:])
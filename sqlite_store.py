@@ -0,0 +1,144 @@
+"""
+Inventory tables kept in a local SQLite database file, one file per guild.
+
+This is the persistent alternative to the in-memory pandas dataframes. Its tables implement the same interface as
+inventory_engine.MemoryInventoryTable, so the inventory engine runs on top of them unchanged. Changes are committed
+together with the id of the newest transaction log message they include. On restart the bot opens the file and
+only replays the transaction log messages posted after that one.
+
+This module is pure Python. It imports neither discord.py nor pandas.
+"""
+import sqlite3
+
+from collections import OrderedDict
+from datetime import datetime
+from typing import Optional
+
+from inventory_engine import InventoryRow
+from inventory_schema import PERSONAL_PRIMARY_KEY, TRANSACTION_PRIMARY_KEY, COL_COUNT, COL_UPDATE_TIME, \
+    COL_SECOND_USER_ID, COL_ITEM, COL_VARIANT, USER_ROLE_DROPBOXES, USER_ROLES_IN_ORDER
+
+__all__ = {
+    "SqliteInventoryTable",
+    "SqliteInventoryStore",
+}
+
+
+def _to_db_time(update_time):
+    return update_time.isoformat(sep=' ') if update_time is not None else None
+
+
+def _from_db_time(text):
+    return datetime.fromisoformat(text) if text is not None else None
+
+
+def _db_key(key):
+    # User ids may come in as numpy integers, read from a dataframe index. SQLite only takes Python ints.
+    return tuple(part if isinstance(part, str) else int(part) for part in key)
+
+
+class SqliteInventoryTable:
+    """One role table of the inventory. Keys are primary keys of the role, as in the dataframes."""
+
+    def __init__(self, conn, role_name):
+        self.conn = conn
+        self.role_name = role_name
+        self.primary_key = TRANSACTION_PRIMARY_KEY if role_name == USER_ROLE_DROPBOXES else PERSONAL_PRIMARY_KEY
+        columns = self.primary_key + [COL_COUNT, COL_UPDATE_TIME]
+        key_match = ' AND '.join('{0} = ?'.format(column) for column in self.primary_key)
+        order = ', '.join(self.primary_key)
+
+        self._select_sql = 'SELECT {0} FROM {1}'.format(', '.join(columns), role_name)
+        self._order_sql = ' ORDER BY {0}'.format(order)
+        self._key_match_sql = key_match
+        self._upsert_sql = 'INSERT OR REPLACE INTO {0} ({1}) VALUES ({2})'.format(
+            role_name, ', '.join(columns), ', '.join('?' * len(columns)))
+
+    def create_schema(self):
+        column_types = {COL_COUNT: 'INTEGER NOT NULL', COL_UPDATE_TIME: 'TEXT', COL_ITEM: 'TEXT NOT NULL',
+                        COL_VARIANT: 'TEXT NOT NULL'}
+        columns = ', '.join('{0} {1}'.format(column, column_types.get(column, 'INTEGER NOT NULL'))
+                            for column in self.primary_key + [COL_COUNT, COL_UPDATE_TIME])
+        self.conn.execute('CREATE TABLE IF NOT EXISTS {0} ({1}, PRIMARY KEY ({2})) WITHOUT ROWID'.format(
+            self.role_name, columns, ', '.join(self.primary_key)))
+        if COL_SECOND_USER_ID in self.primary_key:
+            self.conn.execute('CREATE INDEX IF NOT EXISTS {0}_by_{1} ON {0} ({1})'.format(
+                self.role_name, COL_SECOND_USER_ID))
+
+    def _select(self, where='', params=()):
+        cursor = self.conn.execute(self._select_sql + where + self._order_sql, params)
+        return [InventoryRow(tuple(row[:-2]), row[-2], _from_db_time(row[-1])) for row in cursor]
+
+    def __len__(self):
+        return self.conn.execute('SELECT COUNT(*) FROM {0}'.format(self.role_name)).fetchone()[0]
+
+    def rows(self):
+        return self._select()
+
+    def has_row(self, key):
+        sql = 'SELECT 1 FROM {0} WHERE {1}'.format(self.role_name, self._key_match_sql)
+        return self.conn.execute(sql, _db_key(key)).fetchone() is not None
+
+    def get_count(self, key):
+        sql = 'SELECT {0} FROM {1} WHERE {2}'.format(COL_COUNT, self.role_name, self._key_match_sql)
+        row = self.conn.execute(sql, _db_key(key)).fetchone()
+        return row[0] if row else 0
+
+    def get_user_rows(self, user_id):
+        return self._select(' WHERE {0} = ?'.format(self.primary_key[0]), (int(user_id),))
+
+    def get_second_user_rows(self, second_user_id):
+        return self._select(' WHERE {0} = ?'.format(COL_SECOND_USER_ID), (int(second_user_id),))
+
+    def upsert(self, key, count, update_time):
+        self.conn.execute(self._upsert_sql, _db_key(key) + (int(count), _to_db_time(update_time)))
+
+    def drop(self, key):
+        self.conn.execute('DELETE FROM {0} WHERE {1}'.format(self.role_name, self._key_match_sql), _db_key(key))
+
+    def drop_user(self, user_id):
+        self.conn.execute('DELETE FROM {0} WHERE {1} = ?'.format(self.role_name, self.primary_key[0]), (int(user_id),))
+
+    def replace_rows(self, rows):
+        """Replace the whole table, e.g. with the inventory rebuilt from the transaction log."""
+        self.conn.execute('DELETE FROM {0}'.format(self.role_name))
+        self.conn.executemany(self._upsert_sql, [
+            _db_key(row.key) + (int(row.count), _to_db_time(row.update_time)) for row in rows])
+
+    def get_totals(self):
+        """Total count of each item and variant, computed by SQLite."""
+        sql = 'SELECT {0}, {1}, SUM({2}) FROM {3} GROUP BY {0}, {1}'.format(
+            COL_ITEM, COL_VARIANT, COL_COUNT, self.role_name)
+        return dict(((item, variant), total) for item, variant, total in self.conn.execute(sql))
+
+
+class SqliteInventoryStore:
+    """The inventory tables of one guild in one SQLite file."""
+
+    def __init__(self, file_name):
+        self.file_name = file_name
+        self.conn = sqlite3.connect(file_name)
+        self.tables = OrderedDict((role_name, SqliteInventoryTable(self.conn, role_name))
+                                  for role_name in USER_ROLES_IN_ORDER)
+        self.conn.execute('CREATE TABLE IF NOT EXISTS meta (name TEXT PRIMARY KEY, value TEXT)')
+        for table in self.tables.values():
+            table.create_schema()
+        self.conn.commit()
+
+    @property
+    def last_message_id(self) -> Optional[int]:
+        """The newest transaction log message whose changes are committed. None if the file is new."""
+        row = self.conn.execute("SELECT value FROM meta WHERE name = 'last_message_id'").fetchone()
+        return int(row[0]) if row else None
+
+    def commit(self, last_message_id):
+        if last_message_id is not None:
+            self.conn.execute("INSERT OR REPLACE INTO meta (name, value) VALUES ('last_message_id', ?)",
+                              (str(last_message_id),))
+        self.conn.commit()
+
+    def rollback(self):
+        self.conn.rollback()
+
+    def close(self):
+        self.conn.close()
@@ -1,20 +1,48 @@
 import unittest
 import asyncio
+import os
+import tempfile
+import tracemalloc
+import threading
+import re
+import subprocess
+import io
+import discord
+import sys
+from types import SimpleNamespace
 import pandas as pd
-from unittest.mock import MagicMock
+from unittest.mock import MagicMock, patch
 from count_bot import _count
+from count_bot import _compact_inventory_df_for_sync_point, _render_report, _get_frame_totals, _post_digest, \
+    _get_changes_from_trans_log
+from count_bot import _upsert_inventory_row, _drop_inventory_rows, _get_user_rows
+from count_bot import _retrieve_inventory_df_from_transaction_log, _apply_trans_log_message_to_inventory, \
+    _post_sync_point_to_trans_log, _retrieve_inventory_at, _bootstrap_guild_inventory, _stop_lease_keeper, \
+    ReplayError
+from leader_lease import FileLease, LEASE_DURATION_SECONDS
+from trans_log import decode_trans_log_record, decode_trans_log_records, decode_sync_point_summary, TransLogAction
+from inventory_engine import InventoryEngine, InventoryError, NegativeCountError
+from bot_catalog import Catalog, get_catalog, set_catalog
+from bot_config import BotConfig, load_config
+from outbox import Outbox
+from digest import InventoryDigest, get_next_digest_time
+from change_feed import ChangeFeed
+from history_cache import HistoryCache
 from count_bot import *
 from discord import context_managers
+from replay_test_commands import replay_test_commands, read_test_commands, install_fake_guilds, run_command, \
+    inventory_state, FAKE_GUILD_ID, FakeContext, FakeAttachment, _drain_scheduled_events
 
 
 def mock_maker_df():
     column_names = [COL_USER_ID, COL_ITEM, COL_VARIANT, COL_COUNT]
-    return pd.DataFrame(data=[[123, 'visor', 'verkstan', 25]], columns=column_names)
+    df = pd.DataFrame(data=[[123, 'visor', 'verkstan', 25]], columns=column_names)
+    return df.set_index(keys=PERSONAL_PRIMARY_KEY, drop=False)
 
 
 class TestBot(unittest.TestCase):
     def setUp(self):
-        self.loop = asyncio.get_event_loop()
+        self.loop = asyncio.new_event_loop()
 
     def tearDown(self) -> None:
         self.loop.close()
@@ -23,12 +51,939 @@ class TestBot(unittest.TestCase):
 
         ctx = MagicMock()
         ctx.message.author.id = 123
+        ctx.guild_inventory = GuildInventory(ctx.guild, GuildConfig())
 
-        USER_ROLE_HUMAN_TO_INVENTORY_DF_MAP['makers'] = mock_maker_df()
+        ctx.guild_inventory.inventory_by_user_role[USER_ROLE_MAKERS] = mock_maker_df()
 
         result = self.loop.run_until_complete(_count(ctx, 25, trial_run_only=True))
         self.assertEqual(result, (25, 'visor', 'verkstan'))
 
+    def test_inventory_index_stays_lexsorted(self):
+        df = mock_maker_df()
+        _upsert_inventory_row(df, (456, 'prusa', 'PLA'), [456, 'prusa', 'PLA', 3])
+        _upsert_inventory_row(df, (123, 'prusa', 'PETG'), [123, 'prusa', 'PETG', 7])
+        _upsert_inventory_row(df, (5, 'earsaver', ' '), [5, 'earsaver', ' ', 1])
+        # New rows are sorted into place once, by the next read that slices the index
+        with patch.object(pd.DataFrame, 'sort_index', autospec=True, side_effect=pd.DataFrame.sort_index) as sort_index:
+            self.assertEqual(_get_user_rows(df, 123)[COL_ITEM].tolist(), ['prusa', 'visor'])
+            self.assertEqual(_get_user_rows(df, 5)[COL_ITEM].tolist(), ['earsaver'])
+        self.assertEqual(sort_index.call_count, 1)
+        self.assertTrue(df.index.is_monotonic_increasing)
+        self.assertEqual(len(_get_user_rows(df, 999)), 0)
+
+        _drop_inventory_rows(df, 123)
+        self.assertEqual(df[COL_USER_ID].tolist(), [5, 456])
+
+    def test_compact_sync_point(self):
+        now = datetime.utcnow()
+        old = now - timedelta(days=SYNC_POINT_ZERO_ROW_RETENTION_DAYS + 1)
+        makers = pd.DataFrame(data=[
+            [456, 'prusa', 'PLA', 0, old],
+            [123, 'visor', 'verkstan', 25, old],
+            [123, 'prusa', 'PETG', 0, now],
+            [123, 'visor', 'verkstan', 30, now],
+        ], columns=PERSONAL_DF_COLUMNS)
+        compacted = _compact_inventory_df_for_sync_point(USER_ROLE_MAKERS, makers, now=now)
+        self.assertEqual(compacted[COL_USER_ID].tolist(), [123, 123])
+        self.assertEqual(compacted[COL_ITEM].tolist(), ['prusa', 'visor'])
+        self.assertEqual(compacted[COL_COUNT].tolist(), [0, 30])
+
+        dropboxes = pd.DataFrame(data=[
+            [123, 'prusa', 'PLA', 789, 0, now],
+            [123, 'prusa', 'PETG', 789, 4, now],
+        ], columns=TRANSACTION_DF_COLUMNS)
+        compacted = _compact_inventory_df_for_sync_point(USER_ROLE_DROPBOXES, dropboxes, now=now)
+        self.assertEqual(compacted[COL_COUNT].tolist(), [4])
+
+    def test_replay_test_commands(self):
+        live_state, rebuilt_state, internal_errors, _elapsed = bot.loop.run_until_complete(
+            replay_test_commands(read_test_commands()))
+        self.assertEqual(internal_errors, [])
+        self.assertTrue(live_state[USER_ROLE_COLLECTORS])
+        self.assertEqual(live_state, rebuilt_state)
+
+    def test_guild_inventories_are_separate(self):
+        async def run():
+            guild_a, guild_b = install_fake_guilds(guild_ids=(1000, 3000))
+            await on_ready()
+            await run_command(guild_a, 'count 12 verkstan petg')
+            await run_command(guild_b, 'count 3 pru pla')
+            await run_command(guild_b, 'count 4')
+            return inventory_state(GUILD_INVENTORIES[guild_a.id]), inventory_state(GUILD_INVENTORIES[guild_b.id])
+
+        state_a, state_b = bot.loop.run_until_complete(run())
+        self.assertEqual(state_a[USER_ROLE_MAKERS], [(2001, 'verkstan', 'PETG', 12)])
+        self.assertEqual(state_b[USER_ROLE_MAKERS], [(2001, 'prusa', 'PLA', 4)])
+
+    def test_hot_standby_follows_writer(self):
+        async def run():
+            guild, = install_fake_guilds()
+            await on_ready()
+            standby = GuildInventory(guild, GuildConfig())
+            await _retrieve_inventory_df_from_transaction_log(standby)
+
+            channel = guild.channels[0]
+            for line in read_test_commands():
+                first_new_message = len(channel.messages)
+                await run_command(guild, line)
+                for msg in channel.messages[first_new_message:]:
+                    await _apply_trans_log_message_to_inventory(standby, msg)
+            return inventory_state(GUILD_INVENTORIES[guild.id]), inventory_state(standby)
+
+        writer_state, standby_state = bot.loop.run_until_complete(run())
+        self.assertEqual(writer_state, standby_state)
+
+    def test_import_csv(self):
+        def csv_file(text):
+            return discord.File(io.BytesIO(text.encode('utf-8')), 'stocktake.csv')
+
+        async def run():
+            guild, = install_fake_guilds()
+            await on_ready()
+            standby = GuildInventory(guild, GuildConfig())
+            await _retrieve_inventory_df_from_transaction_log(standby)
+            inventory = GUILD_INVENTORIES[guild.id]
+
+            await run_command(guild, 'count 5 ver pet')
+            await run_command(guild, 'import', files=[csv_file('user,item,variant,count\njustin,pru,pet,7\nnobody,ver,pla,1\n')])
+            rejected_state = inventory_state(inventory)
+
+            channel = guild.channels[0]
+            first_new_message = len(channel.messages)
+            await run_command(guild, 'import', files=[csv_file(
+                'user,item,variant,count\njustin,pru,pet,7\nFreddie,verk,PETG,12\n2003,ear,,4\n')])
+            for msg in channel.messages[first_new_message:]:
+                await _apply_trans_log_message_to_inventory(standby, msg)
+            live_state = inventory_state(inventory)
+
+            await _retrieve_inventory_df_from_transaction_log(inventory)
+            return rejected_state, live_state, inventory_state(inventory), inventory_state(standby)
+
+        rejected_state, live_state, rebuilt_state, standby_state = bot.loop.run_until_complete(run())
+        self.assertEqual(rejected_state[USER_ROLE_MAKERS], [(2001, 'verkstan', 'PETG', 5)])
+        self.assertEqual(live_state[USER_ROLE_MAKERS],
+                         [(2001, 'verkstan', 'PETG', 12), (2002, 'prusa', 'PETG', 7), (2003, 'earsaver', ' ', 4)])
+        self.assertEqual(rebuilt_state, live_state)
+        self.assertEqual(standby_state, live_state)
+
+    def test_count_several_items_at_once(self):
+        async def run():
+            guild, = install_fake_guilds()
+            await on_ready()
+            standby = GuildInventory(guild, GuildConfig())
+            await _retrieve_inventory_df_from_transaction_log(standby)
+            inventory = GUILD_INVENTORIES[guild.id]
+
+            channel = guild.channels[0]
+            first_new_message = len(channel.messages)
+            await run_command(guild, 'count 12 ver pla, 30 pru petg, 5 ear')
+            await run_command(guild, 'count 1 ver pla, 2 xyz')
+            await run_command(guild, 'collect count 4 vis pru,6 ear')
+            # The comma sticks to the total, which stands for the one item counted so far
+            await run_command(guild, 'count 3 pru pla', author_name='maggotbrain')
+            await run_command(guild, 'count 12, 5 ear', author_name='maggotbrain')
+            await run_command(guild, 'count 12x', author_name='maggotbrain')
+            not_a_count = channel.messages[-1].content
+            posts = [msg.content for msg in channel.messages[first_new_message:] if msg.content.startswith('✅ ')]
+            for msg in channel.messages[first_new_message:]:
+                await _apply_trans_log_message_to_inventory(standby, msg)
+            live_state = inventory_state(inventory)
+
+            await _retrieve_inventory_df_from_transaction_log(inventory)
+            return posts, live_state, inventory_state(inventory), inventory_state(standby), not_a_count
+
+        posts, live_state, rebuilt_state, standby_state, not_a_count = bot.loop.run_until_complete(run())
+        self.assertEqual(posts, ['✅ <@2001>: count 12 verkstan PLA, 30 prusa PETG, 5 earsaver',
+                                 '✅ <@2001>: collect count 4 visor prusa, 6 earsaver',
+                                 '✅ <@2003>: count 3 prusa PLA',
+                                 '✅ <@2003>: count 12 prusa PLA, 5 earsaver'])
+        self.assertIn("I don't completely understand", not_a_count)
+        self.assertEqual(live_state[USER_ROLE_MAKERS],
+                         [(2001, 'earsaver', ' ', 5), (2001, 'prusa', 'PETG', 30), (2001, 'verkstan', 'PLA', 12),
+                          (2003, 'earsaver', ' ', 5), (2003, 'prusa', 'PLA', 12)])
+        self.assertEqual(live_state[USER_ROLE_COLLECTORS], [(2001, 'earsaver', ' ', 6), (2001, 'visor', 'prusa', 4)])
+        self.assertEqual(rebuilt_state, live_state)
+        self.assertEqual(standby_state, live_state)
+
+    def test_replay_skips_corrupted_sync_point(self):
+        async def run():
+            guild, = install_fake_guilds()
+            await on_ready()
+            inventory = GUILD_INVENTORIES[guild.id]
+            await run_command(guild, 'count 12 ver pla, 5 ear')
+            await _post_sync_point_to_trans_log(inventory, 'Good')
+            await run_command(guild, 'count 3 ver pla')
+            await _post_sync_point_to_trans_log(inventory, 'Corrupted')
+            await run_command(guild, 'collect count 4 vis pru')
+            live_state = inventory_state(inventory)
+
+            channel = guild.channels[0]
+            good, corrupted = [msg for msg in channel.messages if msg.content.endswith('sync point')]
+            summary = decode_sync_point_summary(corrupted.content)
+            self.assertEqual(summary.row_counts, (2, 0, 0))
+            self.assertEqual(summary.size, corrupted.attachments[0].size)
+
+            # Same size, different content: caught by the checksum, before the CSV is parsed
+            corrupted.attachments[0]._data = corrupted.attachments[0]._data.replace(b',3,', b',9,')
+            # 2 updates since the good sync point, plus the corrupted one, so that a good one replaces it.
+            # Replay jumps over the corrupted sync point to a new window of history, with a trolling limit of its own.
+            with patch('count_bot.MSG_HISTORY_TROLLING_LIMIT', 4):
+                self.assertEqual(await _retrieve_inventory_df_from_transaction_log(inventory), 3)
+            at_now = await _retrieve_inventory_at(inventory, datetime.utcnow() + timedelta(minutes=1))
+            return live_state, inventory_state(inventory), inventory_state(SimpleNamespace(inventory_by_user_role=at_now))
+
+        live_state, rebuilt_state, at_now_state = bot.loop.run_until_complete(run())
+        self.assertEqual(live_state[USER_ROLE_MAKERS], [(2001, 'earsaver', ' ', 5), (2001, 'verkstan', 'PLA', 3)])
+        self.assertEqual(rebuilt_state, live_state)
+        self.assertEqual(at_now_state, live_state)
+
+    def test_replay_skips_unparsable_legacy_sync_point(self):
+        def cut_off(data):
+            return data[:data.index(b'verkstan')]
+
+        def cut_row(data):
+            # The tables are all there, but a row lost its values
+            return re.sub(rb'verkstan,PLA,3,[^\n]*', b'verkstan', data)
+
+        async def run(corrupt):
+            guild, = install_fake_guilds()
+            await on_ready()
+            inventory = GUILD_INVENTORIES[guild.id]
+            await run_command(guild, 'count 12 ver pla, 5 ear')
+            await _post_sync_point_to_trans_log(inventory, 'Good')
+            await run_command(guild, 'count 3 ver pla')
+            await _post_sync_point_to_trans_log(inventory, 'Truncated')
+            await run_command(guild, 'collect count 4 vis pru')
+            live_state = inventory_state(inventory)
+
+            # A sync point from before V0.8, with no summary to check it against, and a truncated attachment
+            truncated = [msg for msg in guild.channels[0].messages if msg.content.endswith('sync point')][-1]
+            truncated.content = re.sub(r' \[V.*\]', '', truncated.content)
+            self.assertIsNone(decode_sync_point_summary(truncated.content))
+            truncated.attachments[0]._data = corrupt(truncated.attachments[0]._data)
+            self.assertEqual(await _retrieve_inventory_df_from_transaction_log(inventory), 3)
+            return live_state, inventory_state(inventory)
+
+        for corrupt in (cut_off, cut_row):
+            live_state, rebuilt_state = bot.loop.run_until_complete(run(corrupt))
+            self.assertEqual(rebuilt_state, live_state)
+
+    def test_replay_gives_up_and_verify_sync_points(self):
+        async def run():
+            guild, = install_fake_guilds()
+            await on_ready()
+            inventory = GUILD_INVENTORIES[guild.id]
+            channel = guild.channels[0]
+            await run_command(guild, 'count 12 ver pla')
+            await _post_sync_point_to_trans_log(inventory, 'First')
+            await run_command(guild, 'count 3 ver pla')
+            await run_command(guild, 'collect count 4 vis pru', author_name='justin')
+            await _post_sync_point_to_trans_log(inventory, 'Second')
+            await run_command(guild, 'verify')
+            verified = channel.messages[-1].content
+
+            # A sync point that does not follow from the log before it
+            frames = OrderedDict(inventory.inventory_by_user_role)
+            frames[USER_ROLE_COLLECTORS] = frames[USER_ROLE_COLLECTORS].assign(**{COL_COUNT: 40})
+            await _post_sync_point_to_trans_log(inventory, 'Wrong', inventory_by_user_role=frames)
+            await run_command(guild, 'verify')
+            mismatched = channel.messages[-1].content
+
+            # The newest sync point is bad, and replay may not fall back over it
+            wrong = channel.messages[-3]
+            wrong.attachments[0]._data = wrong.attachments[0]._data.replace(b',40,', b',41,')
+            with patch('count_bot.REPLAY_MAX_SYNC_POINTS', 1), self.assertRaises(ReplayError):
+                await _retrieve_inventory_df_from_transaction_log(inventory)
+            with patch('count_bot.REPLAY_MAX_SYNC_POINTS', 1):
+                await run_command(guild, 'report --at {0:%Y-%m-%d %H:%M:%S}'.format(
+                    datetime.utcnow() + timedelta(minutes=1)))
+            not_rebuilt = channel.messages[-1].content
+
+            # No sync point within the trolling limit
+            await run_command(guild, 'count 5 ver pla')
+            with patch('count_bot.MSG_HISTORY_TROLLING_LIMIT', 3), self.assertRaises(ReplayError):
+                await _retrieve_inventory_df_from_transaction_log(inventory)
+            return verified, mismatched, not_rebuilt
+
+        verified, mismatched, not_rebuilt = bot.loop.run_until_complete(run())
+        self.assertIn('Cannot rebuild the inventory at', not_rebuilt)
+        self.assertIn('the newest 1 sync points are bad', not_rebuilt)
+        self.assertIn('matches the one of', verified)
+        self.assertIn('does not match', mismatched)
+        self.assertIn('collectors 2002 visor prusa: 40 in sync point, 4 replayed', mismatched)
+
+    def test_replay_from_first_message_past_bad_sync_point(self):
+        async def run():
+            guild, = install_fake_guilds()
+            await on_ready()
+            inventory = GUILD_INVENTORIES[guild.id]
+            channel = guild.channels[0]
+            await run_command(guild, 'count 12 ver pla')
+            await _post_sync_point_to_trans_log(inventory, 'Corrupted')
+            await run_command(guild, 'count 3 ver pla')
+            live_state = inventory_state(inventory)
+
+            # The only sync point is bad, but the log before it goes back to the first message
+            corrupted = [msg for msg in channel.messages if msg.content.endswith('sync point')][-1]
+            corrupted.attachments[0]._data = corrupted.attachments[0]._data.replace(b',12,', b',19,')
+            updates = await _retrieve_inventory_df_from_transaction_log(inventory)
+            return live_state, inventory_state(inventory), updates
+
+        live_state, rebuilt_state, updates = bot.loop.run_until_complete(run())
+        self.assertEqual(live_state[USER_ROLE_MAKERS], [(2001, 'verkstan', 'PLA', 3)])
+        self.assertEqual(rebuilt_state, live_state)
+        # The one row updated, plus the bad sync point, so that a good one replaces it
+        self.assertEqual(updates, 2)
+
+    def test_report_at_past_time(self):
+        async def run():
+            guild, = install_fake_guilds()
+            await on_ready()
+            inventory = GUILD_INVENTORIES[guild.id]
+            channel = guild.channels[0]
+            await run_command(guild, 'count 12 ver pla, 5 ear')
+            await _post_sync_point_to_trans_log(inventory, 'Test')
+            await run_command(guild, 'count 3 ver pla')
+            tuesday_state = inventory_state(inventory)
+            tuesday_message_count = len(channel.messages)
+            await run_command(guild, 'collect from maggotbrain')  # Nothing to collect
+            await run_command(guild, 'remove all')
+            await run_command(guild, 'collect count 4 vis pru')
+
+            # Spread the messages over time, one minute apart
+            start = datetime(2020, 5, 12, 18, 0)
+            for msg in channel.messages:
+                msg.created_at = start + timedelta(minutes=msg.id)
+            tuesday = start + timedelta(minutes=tuesday_message_count, seconds=30)
+
+            at_tuesday = inventory_state(SimpleNamespace(inventory_by_user_role=await _retrieve_inventory_at(
+                inventory, tuesday)))
+            cache = inventory.history_cache
+            pages_fetched, attachments = cache.pages_fetched, dict(cache.attachments)
+            at_start = inventory_state(SimpleNamespace(inventory_by_user_role=await _retrieve_inventory_at(
+                inventory, start)))
+            await _retrieve_inventory_at(inventory, tuesday - timedelta(seconds=10))
+            self.assertEqual((cache.pages_fetched, cache.attachments), (pages_fetched, attachments))
+
+            first_new_message = len(channel.messages)
+            await run_command(guild, 'report --at {0:%Y-%m-%d %H:%M:%S}'.format(tuesday))
+            await run_command(guild, 'report --at last tuesday')
+            await run_command(guild, 'report --at 2020-05-12', author_name='justin')
+            replies = [msg.content for msg in channel.messages[first_new_message:] if msg.author == guild.me]
+            return tuesday_state, inventory_state(inventory), at_tuesday, at_start, replies
+
+        tuesday_state, live_state, at_tuesday, at_start, replies = bot.loop.run_until_complete(run())
+        self.assertEqual(at_tuesday, tuesday_state)
+        self.assertNotEqual(live_state, tuesday_state)
+        self.assertEqual(at_start, {USER_ROLE_MAKERS: [], USER_ROLE_COLLECTORS: [], USER_ROLE_DROPBOXES: []})
+        self.assertTrue(replies[0].startswith('Inventory at 2020-05-12 18:'))
+        self.assertIn('verkstan', replies[0])
+        self.assertTrue(replies[1].startswith("❌  Cannot read 'last tuesday' as a time."))
+        self.assertTrue(replies[2].startswith("❌  You need the admin role"))
+
+    def test_history_cache_stays_bounded(self):
+        async def run():
+            guild, = install_fake_guilds()
+            channel = guild.channels[0]
+            for i in range(30):
+                channel.post(guild.me, 'message {0}'.format(i),
+                             [FakeAttachment(discord.File(io.BytesIO(str(i).encode()), 'sync.csv'))])
+            cache = HistoryCache(channel, page_size=5, max_messages=10)
+
+            # Walking back through the whole channel keeps at most max_messages, and the attachments of these
+            read = []
+            async for msg in cache.history_before(datetime.utcnow()):
+                read.append(msg.id)
+                await cache.read_attachment(msg)
+            cached_ids = [msg.id for msg in cache.messages]
+            attachment_ids = sorted(cache.attachments)
+
+            # The newest messages were forgotten, so they are fetched again
+            pages_fetched = cache.pages_fetched
+            newest = [msg.id async for msg in cache.history_before(datetime.utcnow(), limit=3)]
+            return read, cached_ids, attachment_ids, newest, cache.pages_fetched - pages_fetched
+
+        read, cached_ids, attachment_ids, newest, pages_fetched = bot.loop.run_until_complete(run())
+        self.assertEqual(read, list(range(30, 0, -1)))
+        self.assertEqual(cached_ids, list(range(1, 11)))
+        self.assertEqual(attachment_ids, cached_ids)
+        self.assertEqual(newest, [30, 29, 28])
+        self.assertEqual(pages_fetched, 1)
+
+    def test_user_views_follow_mutations(self):
+        def view_rows(rows):
+            return sorted((row.key, row.count) for row in rows)
+
+        async def run():
+            guild, = install_fake_guilds()
+            await on_ready()
+            inventory = GUILD_INVENTORIES[guild.id]
+            makers = inventory.engine.tables[USER_ROLE_MAKERS]
+            dropboxes = inventory.engine.tables[USER_ROLE_DROPBOXES]
+            await run_command(guild, 'count 12 ver pla')
+            await run_command(guild, 'drop justin 2')
+            await run_command(guild, 'confirm', author_name='justin')
+
+            # The indexes by user id are built. Later commands only update them, and never scan a whole frame.
+            with patch('count_bot._index_keys_by_user', side_effect=AssertionError('index rebuilt')), \
+                    patch('count_bot._get_user_rows', side_effect=AssertionError('frame sliced')), \
+                    patch.object(pd.Series, '__eq__', side_effect=AssertionError('frame scanned')):
+                await run_command(guild, 'count 3 pru pet')
+                await run_command(guild, 'drop justin 1 pru pet')
+                views = (view_rows(makers.get_user_rows(2001)), view_rows(dropboxes.get_second_user_rows(2002)))
+
+                await run_command(guild, 'remove all')
+                removed_view = view_rows(makers.get_user_rows(2001))
+            await _retrieve_inventory_df_from_transaction_log(inventory)
+            # The rebuilt dataframe replaces the old one. It is indexed again.
+            return views, removed_view, makers._user_keys, dropboxes._second_user_keys
+
+        (maker_view, dropbox_view), removed_view, rebuilt_keys, rebuilt_second_keys = bot.loop.run_until_complete(run())
+        self.assertEqual(maker_view, [((2001, 'prusa', 'PETG'), 2), ((2001, 'verkstan', 'PLA'), 10)])
+        self.assertEqual(dropbox_view, [((2001, 'prusa', 'PETG', 2002), 1), ((2001, 'verkstan', 'PLA', 2002), 2)])
+        self.assertEqual(removed_view, [])
+        self.assertEqual(rebuilt_keys, {})
+        self.assertEqual(rebuilt_second_keys, {2002: {(2001, 'prusa', 'PETG', 2002), (2001, 'verkstan', 'PLA', 2002)}})
+
+    def test_sqlite_store_survives_restart(self):
+        def frame_rows(inventory):
+            return dict((role_name, sorted((row.key, row.count) for row in table.rows()))
+                        for role_name, table in inventory.engine.tables.items())
+
+        async def run(storage_dir):
+            guild, = install_fake_guilds()
+            await on_ready()
+            inventory = GUILD_INVENTORIES[guild.id]
+            await run_command(guild, 'count 12 ver pla')
+            await run_command(guild, 'drop justin 2')
+            await run_command(guild, 'confirm', author_name='justin')
+            committed_id = inventory.store.last_message_id
+            totals = inventory.store.get_totals()
+
+            # The process dies before committing the next command. On restart, only that command is replayed.
+            with patch.object(inventory.store, 'commit'):
+                await run_command(guild, 'count 3 pru pet')
+            inventory.store.close()
+            _stop_lease_keeper(inventory)
+            with patch('count_bot._retrieve_inventory_df_from_transaction_log', side_effect=AssertionError('rebuilt')):
+                await _bootstrap_guild_inventory(guild)
+            restarted = GUILD_INVENTORIES[guild.id]
+            rows = frame_rows(restarted)
+            restarted.store.close()
+            _stop_lease_keeper(restarted)
+            dropped = [(item.record.command, item.count) for item in restarted.dropbox_messages.values()]
+            return committed_id, totals, rows, os.listdir(storage_dir), (restarted.logged_item_variants, dropped)
+
+        with tempfile.TemporaryDirectory() as storage_dir:
+            with patch('count_bot.STORAGE_BACKEND', 'sqlite'), patch('count_bot.STORAGE_DIR', storage_dir):
+                committed_id, totals, rows, files, logged = bot.loop.run_until_complete(run(storage_dir))
+        self.assertIsNotNone(committed_id)
+        self.assertEqual(totals[USER_ROLE_MAKERS], {('verkstan', 'PLA'): 10})
+        self.assertEqual(totals[USER_ROLE_DROPBOXES], {('verkstan', 'PLA'): 2})
+        self.assertEqual(rows[USER_ROLE_MAKERS], [((2001, 'prusa', 'PETG'), 3), ((2001, 'verkstan', 'PLA'), 10)])
+        self.assertEqual(rows[USER_ROLE_DROPBOXES], [((2001, 'verkstan', 'PLA', 2002), 2)])
+        self.assertEqual(files, ['count_bot_inventory_{0}.sqlite3'.format(FAKE_GUILD_ID)])
+        self.assertEqual(logged, ({('verkstan', 'PLA'), ('prusa', 'PETG')}, [('count 2', 2)]))
+
+    def test_confirm_drop_with_reaction(self):
+        def reaction(guild, message, user_id, emoji=DROP_CONFIRM_EMOJI):
+            return SimpleNamespace(guild_id=guild.id, channel_id=guild.channels[0].id, message_id=message.id,
+                                   user_id=user_id, member=guild.get_member(user_id), emoji=SimpleNamespace(name=emoji))
+
+        async def run():
+            guild, = install_fake_guilds()
+            await on_ready()
+            inventory = GUILD_INVENTORIES[guild.id]
+            channel = guild.channels[0]
+            await run_command(guild, 'count 12 ver pla')
+            await run_command(guild, 'drop justin 2')
+            first_drop = channel.messages[-3]
+            await run_command(guild, 'drop justin 3 ver pla')
+            second_drop = channel.messages[-3]
+
+            # The index is rebuilt from the log, so reactions work across restarts
+            await _retrieve_inventory_df_from_transaction_log(inventory)
+            indexed = sorted(inventory.dropbox_messages)
+            with patch.object(type(channel), 'fetch_message', create=True, side_effect=AssertionError('fetched')):
+                await on_raw_reaction_add(reaction(guild, first_drop, 2001))  # Not the collector
+                await on_raw_reaction_add(reaction(guild, first_drop, 2002, emoji='👍'))
+                ignored_state = inventory_state(inventory)
+
+                # Each reaction moves the items of its own drop only
+                await on_raw_reaction_add(reaction(guild, second_drop, 2002))
+                await _drain_scheduled_events()
+                second_state = inventory_state(inventory)
+
+                # The maker took one back, so only one of the first drop is left to move
+                await run_command(guild, 'drop justin -1')
+                await on_raw_reaction_add(reaction(guild, first_drop, 2002))
+                await _drain_scheduled_events()
+                collected = [msg.content for msg in channel.messages if 'Collected' in msg.content]
+
+                await run_command(guild, 'drop justin 4')
+                third_drop = channel.messages[-3]
+                await run_command(guild, 'confirm all', author_name='justin')
+                await on_raw_reaction_add(reaction(guild, third_drop, 2002))
+                await _drain_scheduled_events()
+            return (indexed, [first_drop.id, second_drop.id], [ignored_state, second_state, inventory_state(inventory)],
+                    collected, channel.messages)
+
+        indexed, drop_ids, states, collected, messages = bot.loop.run_until_complete(run())
+        ignored_state, second_state, state = states
+        self.assertEqual(indexed, drop_ids)
+        self.assertEqual(ignored_state[USER_ROLE_DROPBOXES], [(2001, 'verkstan', 'PLA', 2002, 5)])
+        self.assertEqual(second_state[USER_ROLE_DROPBOXES], [(2001, 'verkstan', 'PLA', 2002, 2)])
+        self.assertEqual(second_state[USER_ROLE_COLLECTORS], [(2002, 'verkstan', 'PLA', 3)])
+        self.assertEqual(len(collected), 2)
+        self.assertIn('Collected 3 verkstan PLA from the dropbox', collected[0])
+        self.assertIn('Collected 1 verkstan PLA from the dropbox', collected[1])
+        self.assertEqual(state[USER_ROLE_DROPBOXES], [])
+        self.assertEqual(state[USER_ROLE_COLLECTORS], [(2002, 'verkstan', 'PLA', 8)])
+        self.assertIn('already in your collection', messages[-1].content)
+
+    def test_confirm_drop_of_maker_who_left(self):
+        async def run():
+            guild, = install_fake_guilds()
+            await on_ready()
+            inventory = GUILD_INVENTORIES[guild.id]
+            channel = guild.channels[0]
+            await run_command(guild, 'count 5 ver pla', author_name='maggotbrain')
+            await run_command(guild, 'drop justin 2', author_name='maggotbrain')
+            guild.members.remove(guild.get_member(2003))
+            await run_command(guild, 'confirm all', author_name='justin')
+            await _drain_scheduled_events()
+            live_state = inventory_state(inventory)
+            drop_records = [msg.content for msg in channel.messages if msg.content.startswith('✅ <@2003>: drop')]
+            await _retrieve_inventory_df_from_transaction_log(inventory)
+            return live_state, inventory_state(inventory), drop_records
+
+        live_state, replayed_state, drop_records = bot.loop.run_until_complete(run())
+        self.assertEqual(live_state[USER_ROLE_DROPBOXES], [])
+        self.assertEqual(live_state[USER_ROLE_COLLECTORS], [(2002, 'verkstan', 'PLA', 2)])
+        self.assertEqual(drop_records[-1], '✅ <@2003>: drop <@2002> 0 verkstan PLA')
+        self.assertEqual(replayed_state, live_state)
+
+    def test_inspect_one_user(self):
+        async def run():
+            guild, = install_fake_guilds()
+            await on_ready()
+            channel = guild.channels[0]
+            await run_command(guild, 'count 12 ver pla')
+            await run_command(guild, 'drop justin 2')
+            await run_command(guild, 'collect count 5 pru pet', author_name='justin')
+
+            # Only the rows of the user are read, through the per-user views
+            with patch('count_bot.DataFrameInventoryTable.rows', side_effect=AssertionError('full table read')):
+                first_new_message = len(channel.messages)
+                await run_command(guild, 'inspect justin')
+                justin = [msg.content for msg in channel.messages[first_new_message + 1:]]
+                first_new_message = len(channel.messages)
+                await run_command(guild, 'inspect maggotbrain')
+                maggotbrain = [msg.content for msg in channel.messages[first_new_message + 1:]]
+            return '\n'.join(justin), '\n'.join(maggotbrain)
+
+        justin, maggotbrain = bot.loop.run_until_complete(run())
+        self.assertIn('Maker inventory of justin:```(no inventory records)```', justin)
+        self.assertIn('Collection of justin:', justin)
+        self.assertRegex(justin, r'5\s+prusa\s+PETG')
+        self.assertRegex(justin, r'Dropbox of justin:```\s*maker\s+item\s+variant\s+count.*\n\s*Freddie\s+verkstan\s+PLA\s+2')
+        self.assertEqual(maggotbrain, 'Maker inventory of maggotbrain:```(no inventory records)```')
+
+    def test_report_renders_in_worker(self):
+        rendering = threading.Event()
+        finish_rendering = threading.Event()
+
+        def slow_render_report(*args):
+            rendering.set()
+            finish_rendering.wait(timeout=10)
+            return _render_report(*args)
+
+        async def run():
+            guild, = install_fake_guilds()
+            await on_ready()
+            channel = guild.channels[0]
+            await run_command(guild, 'count 12 ver pla')
+            with patch('count_bot._render_report', side_effect=slow_render_report):
+                # Commands are invoked without run_command(), which would wait for all other tasks to finish
+                async def invoke(line):
+                    message = channel.post(guild.get_member_named('Freddie'), line, [])
+                    await bot.invoke(await bot.get_context(message, cls=FakeContext))
+
+                report_task = asyncio.ensure_future(invoke('report'))
+                while not rendering.is_set() and not report_task.done():
+                    await asyncio.sleep(0.01)
+                # The event loop keeps serving commands while the report is rendered, from a snapshot
+                await invoke('count 20 ver pla')
+                finish_rendering.set()
+                await report_task
+                await _drain_scheduled_events()
+            return [msg.content for msg in channel.messages]
+
+        messages = bot.loop.run_until_complete(run())
+        count_record = next(i for i, msg in enumerate(messages) if msg == '✅ <@2001>: count 20 verkstan PLA')
+        summary = next(i for i, msg in enumerate(messages) if 'Summary shown here' in msg)
+        self.assertLess(count_record, summary)
+        self.assertRegex(messages[summary], r'verkstan\s+PLA\s+12\s+12')
+
+    def test_copy_on_write_snapshot(self):
+        async def run():
+            guild, = install_fake_guilds()
+            await on_ready()
+            await run_command(guild, 'count 12 ver pla')
+            inventory = GUILD_INVENTORIES[guild.id]
+            makers_df = inventory.inventory_by_user_role[USER_ROLE_MAKERS]
+
+            frames, totals = inventory.store.get_snapshot()
+            self.assertIsNone(totals)
+            self.assertIs(frames[USER_ROLE_MAKERS], makers_df)  # Nothing is copied up front
+
+            await run_command(guild, 'count 20 ver pla')
+            await run_command(guild, 'count 5 pru pet')
+            copied_df = inventory.inventory_by_user_role[USER_ROLE_MAKERS]
+            self.assertIsNot(copied_df, makers_df)
+            self.assertEqual(makers_df[COL_COUNT].tolist(), [12])
+            self.assertEqual(sorted(copied_df[COL_COUNT].tolist()), [5, 20])
+
+            # Only the first write after a snapshot copies, and tables nobody wrote to are still shared
+            self.assertIs(inventory.inventory_by_user_role[USER_ROLE_DROPBOXES], frames[USER_ROLE_DROPBOXES])
+            await run_command(guild, 'count 6 pru pet')
+            self.assertIs(inventory.inventory_by_user_role[USER_ROLE_MAKERS], copied_df)
+            self.assertEqual(_get_frame_totals(frames)[USER_ROLE_MAKERS], {('verkstan', 'PLA'): 12})
+
+        bot.loop.run_until_complete(run())
+
+    def test_digest(self):
+        async def run():
+            guild, = install_fake_guilds()
+            await on_ready()
+            channel = guild.channels[0]
+            inventory = GUILD_INVENTORIES[guild.id]
+            await run_command(guild, 'count 12 ver pla')
+            await _post_digest(inventory)
+            await run_command(guild, 'drop justin 2')
+            await run_command(guild, 'confirm', author_name='justin')
+            await run_command(guild, 'count 5 pru pet')
+            await run_command(guild, 'remove pru pet')
+            await _drain_scheduled_events()
+
+            # Totals are kept up to date by each write. They agree with adding up the whole inventory.
+            totals = inventory.store.get_totals()
+            nonzero = dict((role_name, dict((key, total) for key, total in role_totals.items() if total))
+                           for role_name, role_totals in totals.items())
+            self.assertEqual(dict(inventory.digest.totals), nonzero)
+
+            first_new_message = len(channel.messages)
+            await _post_digest(inventory)
+            await _post_digest(inventory)  # Nothing changed since. Nothing is posted.
+            await _drain_scheduled_events()
+            return [msg.content for msg in channel.messages[first_new_message:]]
+
+        first_digest_time = datetime.utcnow()
+        digests = bot.loop.run_until_complete(run())
+        self.assertEqual(len(digests), 1)
+        changes, totals = digests[0].split('Totals:')
+        self.assertRegex(changes, r'-2\s+verkstan\s+PLA\s+maker\n\s*\+2\s+verkstan\s+PLA\s+dropbox```')
+        self.assertNotIn('prusa', changes)
+        self.assertRegex(totals, r'verkstan\s+PLA\s+12\s+10\s+2\s+0')
+        since = datetime.strptime(re.search(r'since (.*) UTC', changes).group(1), '%Y-%m-%d %H:%M')
+        self.assertGreaterEqual(since, first_digest_time.replace(second=0, microsecond=0))
+
+        # A long digest is split into messages that fit, each table continued under its heading
+        digest = InventoryDigest()
+        digest.set_totals({USER_ROLE_MAKERS: {}, USER_ROLE_COLLECTORS: {}, USER_ROLE_DROPBOXES: {}})
+        for i in range(40):
+            digest.add_change(USER_ROLE_MAKERS, 'item{0:02}'.format(i), 'PLA', i + 1)
+        not_posted = digest.take(max_length=300)
+        digest.untake()  # The digest could not be posted. Its changes go into the next one.
+        messages = digest.take(max_length=300)
+        self.assertEqual(messages, not_posted)
+        self.assertTrue(all(len(msg) <= 300 for msg in messages))
+        self.assertGreater(len(messages), 2)
+        self.assertIn('Totals: (continued)\n```  item variant TOTAL', messages[-1])
+        rows = [line for msg in messages for line in msg.split('\n') if 'PLA' in line]
+        self.assertEqual(len(rows), 80)
+
+        self.assertEqual(get_next_digest_time(datetime(2020, 5, 12, 18, 30), 24), datetime(2020, 5, 13))
+        self.assertEqual(get_next_digest_time(datetime(2020, 5, 12, 18, 0), 1), datetime(2020, 5, 12, 19))
+
+    def test_changes_since(self):
+        async def run(max_changes):
+            guild, = install_fake_guilds()
+            await on_ready()
+            channel = guild.channels[0]
+            inventory = GUILD_INVENTORIES[guild.id]
+            inventory.change_feed = ChangeFeed(max_changes, started=datetime.utcnow() - timedelta(days=1))
+            await run_command(guild, 'count 12 ver pla')
+            await run_command(guild, 'drop justin 2')
+            await run_command(guild, 'collect count 5 pru pet', author_name='justin')
+            await run_command(guild, 'remove all')
+
+            # Reading the log is cut off at the oldest messages, so that the newest changes are shown
+            with patch('count_bot.MSG_HISTORY_TROLLING_LIMIT', 6):
+                limited, truncated = await _get_changes_from_trans_log(inventory, datetime.utcnow() - timedelta(hours=1))
+
+            # Only the messages newer than 'since' are read, however far back the log goes
+            history = type(channel).history
+            fetched = []
+            async def counted_history(self, *args, **kwargs):
+                async for msg in history(self, *args, **kwargs):
+                    fetched.append(msg)
+                    yield msg
+            with patch.object(type(channel), 'history', counted_history):
+                recent, _truncated = await _get_changes_from_trans_log(inventory, channel.messages[-3].created_at)
+            read_back = (len(fetched), [change.record.command for change in recent])
+
+            replies = []
+            for line in ('changes 1h', 'changes'):
+                first_new_message = len(channel.messages)
+                await run_command(guild, line)
+                replies.append(channel.messages[first_new_message + 1].content)
+            return replies, ([change.record.command for change in limited], truncated), read_back
+
+        # The feed holds all changes. The transaction log is not read.
+        with patch('count_bot._get_changes_from_trans_log', side_effect=AssertionError('log read')):
+            from_feed, _limited, _read_back = bot.loop.run_until_complete(run(100))
+        # The feed only holds the newest two. The rest are read back from the transaction log.
+        from_log, limited, read_back = bot.loop.run_until_complete(run(2))
+        self.assertEqual(limited, (['count 5', ''], True))
+        self.assertEqual(read_back, (3, ['']))
+
+        self.assertEqual(from_feed[0].split(':', 2)[2], from_log[0].split(':', 2)[2])
+        lines = from_feed[0].split('```')[1].split('\n')
+        self.assertEqual([line[12:] for line in lines], [
+            'Freddie count 12 verkstan PLA',
+            'Freddie count 10 verkstan PLA',
+            'Freddie dropbox of justin: 2 verkstan PLA',
+            'justin collect count 5 prusa PETG',
+            'Freddie remove all'])
+        self.assertTrue(from_feed[0].startswith('5 changes since'))
+        # Nothing changed since the user last checked
+        self.assertTrue(from_feed[1].startswith('No changes since'))
+
+        feed = ChangeFeed(2, started=datetime(2020, 5, 12))
+        feed.append(datetime(2020, 5, 12, 1), 1, ['a'])
+        feed.append(datetime(2020, 5, 12, 2), 2, ['b', 'c'])
+        self.assertEqual([change.record for change in feed.get_changes_since(datetime(2020, 5, 12, 1))], ['b', 'c'])
+        self.assertIsNone(feed.get_changes_since(datetime(2020, 5, 12)))
+
+    def test_memory_report(self):
+        async def run():
+            guild, = install_fake_guilds()
+            await on_ready()
+            channel = guild.channels[0]
+            await run_command(guild, 'count 12 ver pla')
+            await run_command(guild, 'memory')
+            report = channel.messages[-1].content
+            await run_command(guild, 'memory snapshot')
+            await run_command(guild, 'count 3 pru pet')
+            await run_command(guild, 'memory snapshot')
+            growth = channel.messages[-1].content
+            await run_command(guild, 'memory stop')
+            await run_command(guild, 'memory', author_name='justin')
+            return report, growth, channel.messages[-1].content
+
+        try:
+            report, growth, not_admin = bot.loop.run_until_complete(run())
+        finally:
+            if tracemalloc.is_tracing():
+                MEMORY_SNAPSHOTS.stop()
+        self.assertRegex(report, r'makers\s+1 rows\s+\d')
+        self.assertRegex(report, r'Process RSS: .*, peak \d')
+        self.assertIn('Members cached: 5 in this guild', report)
+        self.assertIn('Biggest growth since the last snapshot:', growth)
+        self.assertFalse(tracemalloc.is_tracing())
+        self.assertIn('You need the admin role', not_admin)
+
+    def test_catalog_reload(self):
+        catalog_config = {
+            'verkstan': {'description': '3D Verkstan head band', 'variants': ['PETG', 'PLA']},
+            'assembly': {'description': 'Assembled face shield', 'variants': []},
+        }
+
+        async def run():
+            guild, = install_fake_guilds()
+            await on_ready()
+            inventory = GUILD_INVENTORIES[guild.id]
+            await run_command(guild, 'count 2 ver pla')
+            with patch('count_bot.get_catalog_config', return_value=catalog_config):
+                await run_command(guild, 'catalog reload')
+            await run_command(guild, 'count 3 assem')
+            live_state = inventory_state(inventory)
+
+            # The built-in catalog has no 'assembly'. It cannot be reloaded while assemblies are recorded.
+            await run_command(guild, 'catalog reload')
+            await _retrieve_inventory_df_from_transaction_log(inventory)
+            rebuilt_state = inventory_state(inventory)
+
+            # Nor while they are in the log since the last sync point, as replay would no longer decode them
+            await run_command(guild, 'remove assem')
+            giving_variants = dict(catalog_config, assembly={'description': 'Face shield', 'variants': ['clear']})
+            with patch('count_bot.get_catalog_config', return_value=giving_variants):
+                await run_command(guild, 'catalog reload')
+            return live_state, rebuilt_state, guild.channels[0].messages[-1].content
+
+        default_catalog = get_catalog()
+        try:
+            live_state, rebuilt_state, refused = bot.loop.run_until_complete(run())
+            self.assertEqual(live_state[USER_ROLE_MAKERS], [(2001, 'assembly', ' ', 3), (2001, 'verkstan', 'PLA', 2)])
+            self.assertEqual(rebuilt_state, live_state)
+            self.assertIn('assembly', get_catalog().item_choices)
+            self.assertIn('assembly', get_catalog().items_with_no_variants)
+            self.assertNotIn('prusa', get_catalog().alias_maps)
+            self.assertIn('Catalog not reloaded. These are still recorded in the inventory or its log: assembly',
+                          refused)
+        finally:
+            set_catalog(default_catalog)
+
+        for bad_config in ({'verkstan': {'variants': ['PLA plus']}},
+                           {'visor': {'variants': ['prusa', 'verkstan']}, 'prusa': {'variants': []}}):
+            with self.assertRaises(ValueError):
+                Catalog.from_config(bad_config)
+
+    def test_load_config(self):
+        with tempfile.TemporaryDirectory() as temp_dir:
+            file_name = os.path.join(temp_dir, 'config.txt')
+            with open(file_name, 'w') as f:
+                f.write('{"TOKEN": "abc", "MSG_HISTORY_TROLLING_LIMIT": 8000, "DEBUG": true, "DEBUG_MEMBER_ID": 2001, '
+                        '"GUILDS": {"1000": {"inventory_channel": "stock"}}}\n')
+            config = load_config(file_name, environ={'COUNT_BOT_MSG_HISTORY_TROLLING_LIMIT': '9000',
+                                                     'COUNT_BOT_DEBUG_PRETEND_DM_IS_INVENTORY': 'no'})
+            self.assertEqual((config.token, config.msg_history_trolling_limit), ('abc', 9000))
+            self.assertEqual((config.debug_disable_startup_inventory_sync, config.debug_pretend_dm_is_inventory),
+                             (True, False))
+            self.assertEqual(config.guilds, {"1000": {"inventory_channel": "stock"}})
+            self.assertEqual(load_config(os.path.join(temp_dir, 'missing.txt'), environ={}), BotConfig(
+                debug_disable_startup_inventory_sync=False, debug_disable_inventory_posts_from_dm=False,
+                debug_pretend_dm_is_inventory=False))
+
+            with self.assertRaises(ValueError):
+                load_config(file_name, environ={'COUNT_BOT_MSG_HISTORY_TROLLING_LIMIT': 'lots'})
+            with open(file_name, 'w') as f:
+                f.write('{"MSG_HISTORY_TROLLING_LIMT": 8000}\n')
+            with self.assertRaises(ValueError):
+                load_config(file_name, environ={})
+
+    def test_outbox_puts_trans_log_first_and_coalesces_replies(self):
+        class SlowChannel:
+            id = 42
+
+            def __init__(self):
+                self.posts = []
+
+            async def send(self, content=None, **kwargs):
+                await asyncio.sleep(0.01)  # As if held back by a rate limit
+                self.posts.append(content)
+                return len(self.posts)
+
+        async def run():
+            outbox = Outbox(max_pending_replies=3)
+            channel = SlowChannel()
+            outbox.post_reply(channel, 'reply 1')
+            await asyncio.sleep(0)  # 'reply 1' is being sent
+            outbox.post_reply(channel, 'reply 2')
+            outbox.post_reply(channel, 'reply 3')
+            outbox.post_reply(channel, 'table', file='report.csv')
+            outbox.post_reply(channel, 'x' * 1999)
+            outbox.post_reply(channel, 'reply 4')
+            message = await outbox.post_durable(channel, '✅ record')
+            await outbox.flush()
+            return message, channel.posts, outbox
+
+        message, posts, outbox = self.loop.run_until_complete(run())
+        self.assertEqual(message, 2)
+        self.assertEqual(posts, ['reply 1', '✅ record', 'table', 'x' * 1999, 'reply 4'])
+        self.assertEqual((outbox.coalesced_count, outbox.dropped_count, outbox.pending_count()), (1, 1, 0))
+
+    def test_help_goes_through_outbox(self):
+        async def run():
+            guild, = install_fake_guilds()
+            await on_ready()
+            author = guild.get_member_named('maggotbrain')
+            with patch.object(OUTBOX, 'post_reply', wraps=OUTBOX.post_reply) as post_reply:
+                await run_command(guild, 'count 12x', author_name='maggotbrain')
+                await OUTBOX.flush()
+            return [(call.args[0], call.args[1]) for call in post_reply.call_args_list], author
+
+        replies, author = bot.loop.run_until_complete(run())
+        # The help text is queued after the reply that points to it, and sent to the author's DM channel
+        self.assertIn("I don't completely understand", replies[0][1])
+        self.assertIs(replies[1][0], author)
+        self.assertIn('count', replies[1][1])
+        self.assertEqual(author.dm_log, [content for destination, content in replies[1:]])
+
+    def test_file_lease(self):
+        with tempfile.TemporaryDirectory() as temp_dir:
+            lease = FileLease(os.path.join(temp_dir, 'lease.json'))
+            run = self.loop.run_until_complete
+            self.assertTrue(run(lease.try_acquire('writer', now=100)))
+            self.assertFalse(run(lease.try_acquire('standby', now=110)))
+            self.assertTrue(run(lease.try_acquire('writer', now=120)))
+            self.assertFalse(run(lease.try_acquire('standby', now=130)))
+            self.assertTrue(run(lease.try_acquire('standby', now=120 + LEASE_DURATION_SECONDS)))
+            self.assertFalse(run(lease.try_acquire('writer', now=125 + LEASE_DURATION_SECONDS)))
+
+    def test_decode_trans_log_record(self):
+        record = decode_trans_log_record('✅ <@!2001>: drop <@2002> 3 prusa PLA', [2002, 2001])
+        self.assertEqual(record, (USER_ROLE_DROPBOXES, 2001, 2002, 'prusa', 'PLA', 'count 3'))
+        record = decode_trans_log_record('✅ <@2003>: count 5 earsaver', [2003])
+        self.assertEqual(record, (USER_ROLE_MAKERS, 2003, None, 'earsaver', ' ', 'count 5'))
+
+        # Replay keeps one action per key, and keys share the interned item and variant names of the records
+        other = decode_trans_log_record('✅ <@2004>: count 2 ' + ''.join(['ear', 'saver']), [2004])
+        self.assertIs(other.item, record.item)
+        action = TransLogAction(5, datetime.utcnow())
+        self.assertFalse(hasattr(action, '__dict__'))
+        self.assertEqual(action, TransLogAction(5, action.update_time))
+        self.assertEqual(get_deep_size(action),
+                         sys.getsizeof(action) + sys.getsizeof(5) + sys.getsizeof(action.update_time))
+
+        # Records that no longer decode with the catalog in use are skipped, not replayed
+        catalog = Catalog.from_config({'verkstan': {'variants': ['PETG', 'PLA']}})
+        with patch('trans_log.get_catalog', return_value=catalog):
+            self.assertIsNone(decode_trans_log_record('✅ <@2003>: count 5 earsaver', [2003]))
+            self.assertIsNone(decode_trans_log_record('✅ <@!2001>: drop <@2002> 3 earsaver', [2002, 2001]))
+        records = decode_trans_log_records('✅ <@2001>: count 2 verkstan PLA, lots prusa PLA, 1 verkstan PETG', [2001])
+        self.assertEqual([(record.variant, record.command) for record in records],
+                         [('PLA', 'count 2'), ('PETG', 'count 1')])
+
+    def test_inventory_engine(self):
+        engine = InventoryEngine.in_memory()
+        now = datetime.utcnow()
+        engine.apply_count(engine.plan_count(USER_ROLE_MAKERS, 123, 20, 'ver', 'pet'), now)
+        plan = engine.plan_count(USER_ROLE_MAKERS, 123, 5, delta=True)
+        self.assertEqual((plan.item, plan.variant, plan.previous_count, plan.total), ('verkstan', 'PETG', 20, 25))
+        engine.apply_count(plan, now)
+
+        plan = engine.plan_drop(123, 456, 10)
+        engine.apply_count(plan.maker_plan, now)
+        engine.apply_dropbox_count(plan, now)
+        self.assertEqual(engine.get_user_rows(USER_ROLE_MAKERS, 123)[0].count, 15)
+        self.assertEqual([row.count for row in engine.get_collector_dropbox_rows(456)], [10])
+
+        with self.assertRaises(NegativeCountError):
+            engine.plan_drop(123, 456, 16)
+        engine.apply_count(engine.plan_count(USER_ROLE_MAKERS, 123, 1, 'pru', 'pla'), now)
+        with self.assertRaises(InventoryError) as cm:
+            engine.plan_count(USER_ROLE_MAKERS, 123, 1)
+        self.assertEqual(len(cm.exception.rows), 2)
+
+        engine.apply_remove(engine.plan_remove(USER_ROLE_MAKERS, 123, 'all'))
+        self.assertEqual(engine.get_user_rows(USER_ROLE_MAKERS, 123), [])
+
+    def test_pure_modules_import_without_discord_or_pandas(self):
+        code = ("import sys, bot_config, bot_catalog, outbox, history_cache, memory_stats, inventory_schema, trans_log, "
+                "inventory_engine, sqlite_store, digest, change_feed; "
+                "print(sorted(m for m in ('discord', 'pandas', 'humanize') if m in sys.modules))")
+        output = subprocess.run([sys.executable, '-c', code], capture_output=True, text=True, check=True,
+                                cwd=os.path.dirname(os.path.abspath(__file__))).stdout
+        self.assertEqual(output.strip(), '[]')
+
+        code = ("from lazy_import import lazy_import, load_now; module = lazy_import('colorsys'); "
+                "print(type(module).__name__, type(load_now(module)).__name__)")
+        output = subprocess.run([sys.executable, '-c', code], capture_output=True, text=True, check=True,
+                                cwd=os.path.dirname(os.path.abspath(__file__))).stdout
+        self.assertEqual(output.split(), ['_LazyModule', 'module'])
+
 
 if __name__ == '__main__':
     unittest.main()
@@ -0,0 +1,218 @@
+"""
+Decoding of the '✅ ' transaction records Count Bot posts to the inventory channel, and the last-action bookkeeping
+used to replay them on top of a sync point.
+
+This module is pure Python. It imports neither discord.py nor pandas. Callers pass in the message text and the ids
+of the users mentioned in the message.
+"""
+import re
+import sys
+
+from datetime import datetime
+from typing import NamedTuple, Optional, Tuple
+
+from bot_catalog import get_catalog
+from inventory_schema import USER_ROLE_MAKERS, USER_ROLE_COLLECTORS, USER_ROLE_DROPBOXES
+
+__all__ = {
+    "TransLogAction",
+    "TransLogRecord",
+    "decode_trans_log_record",
+    "decode_trans_log_records",
+    "process_one_trans_record",
+    "SyncPointSummary",
+    "is_sync_point_text",
+    "format_sync_point_text",
+    "decode_sync_point_summary",
+}
+
+SYNC_POINT_SUFFIX = 'sync point'
+_SYNC_POINT_SUMMARY_PATTERN = re.compile(
+    r' \[V(?P<version>\S+) rows=(?P<rows>[0-9,]+) bytes=(?P<size>[0-9]+) sha256=(?P<sha256>[0-9a-f]{64})\]: sync point$')
+
+
+class TransLogAction:
+    """
+    The newest action on one key of a role table, kept while replaying the log. Replay holds one per key it has seen
+    since the sync point, so it has __slots__ rather than being a tuple.
+    """
+    __slots__ = ('count', 'update_time')
+
+    def __init__(self, count: Optional[int], update_time: datetime):
+        self.count = count  # None if the row was removed
+        self.update_time = update_time
+
+    def __eq__(self, other):
+        return isinstance(other, TransLogAction) and (self.count, self.update_time) == (other.count, other.update_time)
+
+    def __repr__(self):
+        return 'TransLogAction(count={0!r}, update_time={1!r})'.format(self.count, self.update_time)
+
+
+class TransLogRecord(NamedTuple):
+    """
+    A user transaction decoded from a '✅ ' message in the inventory channel. Ids are the ints passed in as
+    mention_ids, and item and variant names are interned, so the keys replay builds from records share them.
+    """
+    role_name: str
+    member_id: int
+    collector_id: Optional[int]  # Only dropbox records have a collector
+    item: str
+    variant: str
+    command: str  # 'count <n>', 'remove', or '' for 'remove all'
+
+
+def decode_trans_log_record(text, mention_ids) -> Optional[TransLogRecord]:
+    """
+    Decode the text of a transaction log message, stripped of its ' (from DM chat)' suffix.
+    mention_ids are the ids of the users mentioned in the message, in any order.
+    """
+    if not mention_ids:
+        return None
+
+    # Messages with mentions are records created in response to a user action.
+    # The order of the mentions list is not in any particular order so you should not rely on it.
+    # This is a discord limitation, not one with the library.
+    mention_map = dict([(str(m), m) for m in mention_ids])
+    try:
+        return _decode_trans_log_record(text, mention_map)
+    except (ValueError, KeyError) as error:
+        # E.g. a record of an item that the catalog no longer has, or has with different variants.
+        # Replay skips it rather than stop the bot from starting.
+        print("{:80} {}: {!r}".format(text, 'CANNOT DECODE THIS RECORD', error))
+        return None
+
+
+def _decode_trans_log_record(text, mention_map) -> TransLogRecord:
+    collector_id = None
+    head, item, variant = text.rsplit(maxsplit=2)
+    if variant in get_catalog().items_with_no_variants:
+        head += ' ' + item
+        item = variant
+        variant = " "
+    item, variant = sys.intern(item), sys.intern(variant)
+
+    member_prefix, command_head = head.split(':')
+    _garbage, member_str = member_prefix.rsplit(maxsplit=1)
+    member_str = member_str.strip('<@!>')
+    member_id = mention_map[member_str]
+
+    command_head = command_head.strip()
+    if command_head.startswith('collect'):
+        role_name = USER_ROLE_COLLECTORS
+        if (item, variant) != ('remove', 'all'):
+            _garbage, command = command_head.split(maxsplit=1)
+        else:
+            command = ''
+    elif command_head.startswith('drop'):
+        role_name = USER_ROLE_DROPBOXES
+        _cmd, collector_str, count = command_head.split(maxsplit=3)
+        collector_str = collector_str.strip('<@!>')
+        collector_id = mention_map[collector_str]
+        command = 'count ' + count
+    else:
+        role_name = USER_ROLE_MAKERS
+        command = command_head
+    if command.startswith('count') and not _is_count_command(command):
+        raise ValueError('not a count: ' + command)
+    return TransLogRecord(role_name, member_id, collector_id, item, variant, command)
+
+
+def _is_count_command(command):
+    """True for 'count <n>', where n is a whole number."""
+    parts = command.split()
+    if len(parts) != 2 or parts[0] != 'count':
+        return False
+    try:
+        int(parts[1])
+    except ValueError:
+        return False
+    return True
+
+
+def decode_trans_log_records(text, mention_ids) -> list:
+    """
+    Decode a transaction log message that may hold several counts of one user, separated by commas:
+       ✅ @Freddie: count 12 verkstan PLA, 30 prusa PETG, 5 earsaver
+    Each count is returned as its own record.
+    """
+    first_text, *more_counts = text.split(', ')
+    record = decode_trans_log_record(first_text, mention_ids)
+    if record is None:
+        return []
+
+    records = [record]
+    for count_text in more_counts:
+        words = count_text.split()
+        if len(words) not in (2, 3) or not _is_count_command('count ' + words[0]):
+            print("{:80} {}".format(count_text, 'CANNOT DECODE THIS COUNT'))
+            continue
+        total, item, *variant = words
+        records.append(record._replace(item=sys.intern(item), variant=sys.intern(variant[0]) if variant else " ",
+                                       command='count ' + total))
+    return records
+
+
+def process_one_trans_record(record, last_action, text, update_time):
+    """
+    Record the action of one transaction, unless a newer action on the same key has been seen already.
+    Transaction log messages are processed newest first.
+    """
+    member_id, item, variant, command = record.member_id, record.item, record.variant, record.command
+    if record.collector_id is None:
+        key = (member_id, item, variant)
+    else:
+        key = (member_id, record.collector_id, item, variant)
+
+    if key in last_action:
+        print("{} {:60} {}".format(update_time, text, 'superseded by count or remove'))
+        return
+    else:
+        if (item, variant) == ('remove', 'all'):
+            for combo in get_catalog().all_item_variant_combos:
+                combo_key = (member_id, combo[0], combo[1])
+                if combo_key not in last_action:
+                    last_action[combo_key] = TransLogAction(None, update_time)
+            print("{} {:80} {}".format(update_time, text, 'remove all'))
+            return
+        elif command.startswith('remove'):
+            last_action[key] = TransLogAction(None, update_time)
+            print("{} {:80} {}".format(update_time, text, command))
+        elif _is_count_command(command):
+            parts = command.split()
+            last_action[key] = TransLogAction(int(parts[1]), update_time)
+            print("{} {:80} {}".format(update_time, text, command))
+        else:
+            print("{} {:80} {}".format(update_time, text, 'I DO NOT UNDERSTAND THIS COMMAND'))
+
+
+class SyncPointSummary(NamedTuple):
+    """What a sync point message says about its CSV attachment, so that a bad attachment is caught cheaply."""
+    version: str  # CODE_VERSION of the bot that posted it
+    row_counts: Tuple[int, ...]  # Rows of each table, in USER_ROLES_IN_ORDER
+    size: int  # Bytes in the attachment
+    sha256: str  # Hex digest of the attachment
+
+
+def is_sync_point_text(text):
+    return text.endswith(SYNC_POINT_SUFFIX)
+
+
+def format_sync_point_text(reason, summary: SyncPointSummary):
+    """
+    The text of a sync point message:
+       ✅ Bot restarted [V0.8 rows=12,3,0 bytes=345 sha256=...]: sync point
+    Sync points posted before V0.8 have no summary in brackets.
+    """
+    return '✅ {0} [V{1} rows={2} bytes={3} sha256={4}]: {5}'.format(
+        reason, summary.version, ','.join(str(n) for n in summary.row_counts), summary.size, summary.sha256,
+        SYNC_POINT_SUFFIX)
+
+
+def decode_sync_point_summary(text) -> Optional[SyncPointSummary]:
+    """Returns None for sync points posted before V0.8, which carry no summary."""
+    match = _SYNC_POINT_SUMMARY_PATTERN.search(text)
+    if match is None:
+        return None
+    row_counts = tuple(int(n) for n in match.group('rows').split(','))
+    return SyncPointSummary(match.group('version'), row_counts, int(match.group('size')), match.group('sha256'))